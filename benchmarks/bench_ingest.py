@@ -0,0 +1,130 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+from flask import Flask
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_2'))
+
+from app.db.models import db, Currency, Info
+from app.db.ingest import add_currencies, ingest_snapshot
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+COINS = 1500
+SNAPSHOTS = 1000
+LEGACY_SNAPSHOTS = 3
+
+# Max seconds per snapshot of COINS rows by ingest mode,
+# benchmark fails above it (guard against per-row ORM work in
+# candle rollup and run updates, ~10x slower). Limits leave
+# room for slow CI machines.
+MAX_SNAPSHOT_TIME = {'bulk': 0.3, 'dedup': 0.4}
+
+
+def make_app(path):
+    """
+    Create bare Flask app with temp SQLite DB.
+
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{0}'.format(path)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    db.init_app(app)
+
+    return app
+
+
+def make_snapshot(coins):
+    """
+    Synthetic scraped snapshot, same fields as Scraper records.
+
+    """
+    return [('Coin{0}'.format(n), 'C{0}'.format(n), '$1,234,567',
+             '$12.34', '100,000', '$5,000', '-0.5%', '1.2%', '10.3%')
+            for n in range(coins)]
+
+
+def legacy_ingest(data, date_t):
+    """
+    Old background_task loop: SELECT and commit per record.
+
+    """
+    for rec in data:
+        currency = Currency.query.filter_by(name=rec[0].lower()).first()
+
+        if not currency:
+            continue
+
+        info = Info(rec[2], rec[3], rec[4], rec[5],
+                    rec[6], rec[7], rec[8], date_t, currency=currency)
+
+        currency.info.append(info)
+        db.session.commit()
+
+
+def full_ingest(data, date_t):
+    """
+    Bulk ingest without change detection, row for each record.
+
+    """
+    return ingest_snapshot(data, date_t, dedup=False)
+
+
+def bench(title, func, data, snapshots, date_t=datetime(2017, 5, 1)):
+
+    t0 = default_timer()
+    for n in range(snapshots):
+        func(data, date_t + timedelta(minutes=10 * n))
+    elapsed = default_timer() - t0
+
+    rows = len(data) * snapshots
+    print("{0:<8} snapshots: {1:<5} rows: {2:<8} time: {3:.2f}s  "
+          "per snapshot: {4:.4f}s  rows/sec: {5:,.0f}"
+          .format(title, snapshots, rows, elapsed,
+                  elapsed / snapshots, rows / elapsed))
+
+    return elapsed / snapshots
+
+
+def main():
+    snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else SNAPSHOTS
+
+    tmp_dir = tempfile.mkdtemp()
+    data = make_snapshot(COINS)
+
+    try:
+        app = make_app(os.path.join(tmp_dir, 'bench.db'))
+
+        with app.app_context():
+            db.create_all()
+            add_currencies(data)
+
+            bench('legacy', legacy_ingest, data, LEGACY_SNAPSHOTS)
+            times = {}
+            times['bulk'] = bench('bulk', full_ingest, data, snapshots)
+
+            # Same values in each snapshot, only runs extended.
+            times['dedup'] = bench('dedup', ingest_snapshot, data,
+                                   snapshots, datetime(2018, 1, 1))
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    slow = {title: per_snapshot for title, per_snapshot in times.items()
+            if per_snapshot > MAX_SNAPSHOT_TIME[title]}
+    if slow:
+        sys.exit("[+] Ingest too slow (max per snapshot {0}): {1}"
+                 .format(MAX_SNAPSHOT_TIME, slow))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+
+from timeit import default_timer
+from lxml import html
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_2'))
+
+from app.scraper.scraper import parse_page
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+FIXTURE = os.path.join(BASE_DIR, 'scraper_testing', 'test_coin.html')
+
+
+def legacy_parse(page):
+    """
+    Old parser: seven descendant XPath queries for every row.
+    Kept here only as a baseline for comparison.
+
+    """
+    res_list = []
+
+    root = html.fromstring(page)
+
+    table = root.xpath(
+        '//table[@id="currencies-all"]/tbody/tr')
+
+    for tr in table:
+        name = tr.xpath(
+            './/td[@class="no-wrap currency-name"]'
+            '/a/text()')[0]
+        symbol = tr.xpath(
+            './/td[@class="text-left"]'
+            '/text()')[0]
+        market_cap = tr.xpath(
+            './/td[@class="no-wrap market-cap '
+            'text-right"]'
+            '/text()')[0].strip()
+        price = tr.xpath(
+            './/td[@class="no-wrap text-right"]'
+            '/a[@class="price"]/text()')[0]
+        cs = tr.xpath(
+            './/td[@class="no-wrap text-right"]'
+            '/a[@target="_blank"]/text() |'
+            './/td[@class="no-wrap text-right"]'
+            '/span/text()')[0].strip()
+        volume = tr.xpath(
+            './/td[@class="no-wrap text-right "]'
+            '/a/text()')[0]
+        changes = tr.xpath(
+            './/td[starts-with(@class,"no-wrap percent-")]'
+            '/text() |'
+            './/td[@class="text-right"]/text()')
+
+        res_list.append((name, symbol, market_cap, price, cs, volume,
+                         changes[0], changes[1], changes[2]))
+
+    return res_list
+
+
+def bench(func, page, repeat=5):
+    """
+    Run parser <repeat> times.
+    Return (rows, best time in seconds).
+
+    """
+    best = None
+    rows = 0
+
+    for _ in range(repeat):
+        t0 = default_timer()
+        rows = len(func(page))
+        elapsed = default_timer() - t0
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return rows, best
+
+
+def main():
+    with open(FIXTURE, 'r', encoding='utf-8') as f:
+        page = f.read()
+
+    if legacy_parse(page) != parse_page(page):
+        print("[+] Parsers results differ !!!")
+        sys.exit(1)
+
+    for title, func in (('before (xpath per cell)', legacy_parse),
+                        ('after (single pass)', parse_page)):
+        rows, best = bench(func, page)
+        print("{0:<24} rows: {1}  time: {2:.4f}s  rows/sec: {3:,.0f}"
+              .format(title, rows, best, rows / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_2'))
+
+DB_FILE = os.path.join(BASE_DIR, 'task_8_2', 'app', 'db', 'db.db')
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+ITEMS = 1500
+
+
+def make_items(names, count, date_t):
+    """
+    REST API items with one info record for existing currencies.
+
+    """
+    items = []
+
+    for n in range(count):
+        name, symbol = names[n % len(names)]
+
+        items.append({'name': name, 'symbol': symbol,
+                      'info': {'mc': '$1,234,567', 'price': '$12.34',
+                               'cs': '100,000', 'volume': '$5,000',
+                               'p1h': '-0.5%', 'p24h': '1.2%',
+                               'p7d': '10.3%',
+                               'date_time': '{0:%Y-%m-%d %H:%M:%S}'
+                               .format(date_t)}})
+
+    return items
+
+
+def report(title, items, elapsed):
+    print("{0:<20} items: {1:<6} time: {2:.2f}s  items/sec: {3:,.0f}"
+          .format(title, items, elapsed, items / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS
+
+    tmp_dir = tempfile.mkdtemp()
+    shutil.copy(DB_FILE, os.path.join(tmp_dir, 'db.db'))
+
+    os.environ['COIN_DB_URI'] = 'sqlite:///{0}'.format(
+        os.path.join(tmp_dir, 'db.db'))
+
+    # No background scrapes while benchmarking.
+    os.environ['COIN_SCHEDULER'] = '0'
+
+    from app.index import app, load_currencies
+    from app.db.models import db, User
+    from app.db.migrate import migrate
+
+    try:
+        with app.app_context():
+            # Committed DB has old schema, upgrade the copy.
+            migrate()
+
+            names = load_currencies()
+            key = db.session.query(User.apiid).first()[0]
+
+        client = app.test_client()
+        url = '/api/{0}/currency/'.format(key)
+        date_t = datetime(2017, 6, 1)
+
+        items = make_items(names, count, date_t)
+
+        t0 = default_timer()
+        for item in items:
+            client.post(url, json=item)
+        report('single item', count, default_timer() - t0)
+
+        for size in (100, count):
+            date_t += timedelta(minutes=10)
+            items = make_items(names, count, date_t)
+
+            t0 = default_timer()
+            for i in range(0, count, size):
+                client.post(url + 'batch/', json=items[i:i + size])
+            report('batch of {0}'.format(size), count, default_timer() - t0)
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
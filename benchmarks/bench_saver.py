@@ -0,0 +1,108 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from io import StringIO
+from timeit import default_timer
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_1'))
+
+FIXTURE = os.path.join(BASE_DIR, 'scraper_testing', 'test_coin.html')
+
+from scraper import parse_page
+from saver import ExcelDS, SnapshotDS
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+SNAPSHOTS = 100
+REPORT_EVERY = 20
+
+
+class RewriteDS(object):
+    """
+    Old way to collect snapshots in one .xls: workbook built
+    again with all previous snapshots on each run.
+
+    """
+    def __init__(self, file_name):
+        self.file = file_name
+        self.snapshots = []
+
+    def write_data(self, data_list, date_t):
+        data_list = list(data_list)
+        self.snapshots.append((date_t, data_list))
+
+        saver = ExcelDS(self.file, '')
+        for date_t, data in self.snapshots:
+            saver.sheet = 'Data for {0:%Y-%m-%d-%H-%M-%S}'.format(date_t)
+            saver._add_sheet(1)
+
+            for row_n, record in enumerate(data, 1):
+                row = saver.ws.row(row_n)
+                for n, value in enumerate(record):
+                    row.write(n, value, saver.styles[n])
+
+        saver.data_saving()
+
+        return len(data_list)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+
+
+def bench(title, saver, data, snapshots, out_dir):
+    date_t = datetime(2017, 5, 14)
+    t0 = default_timer()
+
+    for n in range(1, snapshots + 1):
+        start = default_timer()
+
+        with redirect_stdout(StringIO()):
+            saver.write_data(iter(data), date_t)
+
+        elapsed = default_timer() - start
+        date_t += timedelta(minutes=10)
+
+        if n == 1 or n % REPORT_EVERY == 0:
+            print("{0:<14} snapshot: {1:<5} size: {2:>10,} B  "
+                  "append: {3:.4f}s".format(title, n, dir_size(out_dir),
+                                            elapsed))
+
+    print("{0:<14} total: {1:.2f}s\n".format(title, default_timer() - t0))
+
+
+def main():
+    snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else SNAPSHOTS
+
+    with open(FIXTURE) as f:
+        data = parse_page(f.read())
+
+    cases = [
+        ('xls rewrite', lambda d: RewriteDS(os.path.join(d, 'all.xls'))),
+        ('csv append', lambda d: SnapshotDS(
+            os.path.join(d, 'coins-{0:%Y-%m-%d}.csv'))),
+        ('xls per file', lambda d: SnapshotDS(
+            os.path.join(d, 'coins-{0:%Y-%m-%d-%H-%M-%S}.xls'))),
+    ]
+
+    for title, make_saver in cases:
+        out_dir = tempfile.mkdtemp()
+
+        try:
+            bench(title, make_saver(out_dir), data, snapshots, out_dir)
+
+        finally:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import logging
+
+from timeit import default_timer
+
+from fixtures import FixtureServer, load_fixture, BASE_DIR
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_2'))
+
+from app.scraper.scraper import Scraper
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+def run(server, pages, concurrency, parse_executor=None):
+    sc = Scraper(urls=server.urls('page', pages), concurrency=concurrency,
+                 parse_executor=parse_executor)
+
+    t0 = default_timer()
+    rows = len(sc.start())
+    elapsed = default_timer() - t0
+
+    print("pages: {0:<4} concurrency: {1:<3} parse: {2:<8} rows: {3:<6} "
+          "time: {4:.3f}s  pages/sec: {5:.1f}  rows/sec: {6:,.0f}"
+          .format(pages, concurrency, parse_executor or 'loop', rows,
+                  elapsed, pages / elapsed, rows / elapsed))
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+
+    server = FixtureServer({'page': load_fixture()})
+
+    server.start()
+
+    for pages in (1, 10, 100):
+        for concurrency in (1, 10):
+            run(server, pages, concurrency)
+
+    print()
+
+    for pages in (10, 100):
+        for parse_executor in (None, 'thread', 'process'):
+            run(server, pages, 10, parse_executor)
+
+
+if __name__ == '__main__':
+    main()
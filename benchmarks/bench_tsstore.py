@@ -0,0 +1,118 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+from bench_ingest import make_app
+
+from app.db import queries
+from app.db.models import db, Info
+from app.db.ingest import add_currencies, currency_ids
+from app.db.tsstore import TimeSeriesStore
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+COINS = 100
+SNAPSHOTS = 2000
+READS = 200
+
+
+def make_snapshots(ids, snapshots):
+    """
+    Synthetic history: Info mappings with changing prices.
+
+    """
+    date_t = datetime(2017, 5, 1)
+
+    for n in range(snapshots):
+        yield [{'market_cap': 1e6 + n, 'price': 10.0 + n % 7,
+                'cs': 1e5, 'volume': 5e3 + n, 'perc_1h': -0.5,
+                'perc_24h': 1.2, 'perc_7d': 10.3,
+                'date': date_t + timedelta(minutes=10 * n),
+                'currency_id': currency_id} for currency_id in ids]
+
+
+def report(title, sql_time, store_time, ops):
+    print("{0:<20} ops: {1:<6} sqlite: {2:.3f}s  store: {3:.3f}s  "
+          "speedup: {4:.1f}x".format(title, ops, sql_time, store_time,
+                                    sql_time / store_time))
+
+
+def timed(func, args_list):
+    t0 = default_timer()
+    for args in args_list:
+        func(*args)
+
+    return default_timer() - t0
+
+
+def main():
+    snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else SNAPSHOTS
+
+    tmp_dir = tempfile.mkdtemp()
+    data = [('Coin{0}'.format(n), 'C{0}'.format(n)) for n in range(COINS)]
+
+    try:
+        app = make_app(os.path.join(tmp_dir, 'bench.db'))
+        store = TimeSeriesStore(os.path.join(tmp_dir, 'store'))
+
+        with app.app_context():
+            db.create_all()
+            add_currencies(data)
+            ids = sorted(currency_ids(rec[0] for rec in data).values())
+
+            sql_time = store_time = 0.0
+            for mappings in make_snapshots(ids, snapshots):
+                t0 = default_timer()
+                db.session.bulk_insert_mappings(Info, mappings)
+                db.session.commit()
+                sql_time += default_timer() - t0
+
+                t0 = default_timer()
+                store.append_snapshot(mappings)
+                store_time += default_timer() - t0
+
+            report('append snapshot', sql_time, store_time, snapshots)
+
+            last = [(random.choice(ids), 1000) for _ in range(READS)]
+            report('last 1000 points',
+                   timed(queries.last_history, last),
+                   timed(store.last_history, last), READS)
+
+            start = datetime(2017, 5, 1)
+            pages = []
+            for _ in range(READS):
+                date_from = start + timedelta(
+                    minutes=10 * random.randrange(snapshots))
+                pages.append((random.choice(ids), date_from, None, 100))
+
+            report('page of 100 points',
+                   timed(queries.history_page, pages),
+                   timed(store.history_page, pages), READS)
+
+            ranges = [(random.choice(ids), start + timedelta(days=1),
+                       start + timedelta(days=8)) for _ in range(READS)]
+
+            def sql_range(*args):
+                prices = [p.price for p in queries.history_rows(*args)]
+
+                return sum(prices) / len(prices)
+
+            def store_range(*args):
+                return store.history(*args)['price'].mean()
+
+            report('7 days price mean', timed(sql_range, ranges),
+                   timed(store_range, ranges), READS)
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
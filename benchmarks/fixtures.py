@@ -0,0 +1,110 @@
+import os
+import asyncio
+
+from copy import deepcopy
+from threading import Thread, Event
+from aiohttp import web
+from lxml import html
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIXTURE = os.path.join(BASE_DIR, 'scraper_testing', 'test_coin.html')
+
+HOST = '127.0.0.1'
+PORT = 8089
+
+
+def load_fixture(path=FIXTURE):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def synthetic_page(rows, page=None):
+    """
+    Scale recorded coinmarketcap page to rows count.
+    Recorded table rows are repeated with unique names and
+    symbols ("Bitcoin 2", "BTC2"), so every row is a new currency.
+    Return page bytes.
+
+    """
+    root = html.fromstring(page or load_fixture())
+    tbody = root.xpath('//table[@id="currencies-all"]/tbody')[0]
+
+    recorded = tbody.findall('tr')
+    for tr in recorded:
+        tbody.remove(tr)
+
+    for n in range(rows):
+        tr = deepcopy(recorded[n % len(recorded)])
+        copy_n = n // len(recorded)
+
+        if copy_n:
+            cells = tr.findall('td')
+            cells[0].text = str(n + 1)
+
+            link = cells[1].find('a')
+            link.text = '{0} {1}'.format(link.text, copy_n + 1)
+            cells[2].text = '{0}{1}'.format(cells[2].text, copy_n + 1)
+
+        tbody.append(tr)
+
+    return html.tostring(root, encoding='utf-8')
+
+
+class FixtureServer(object):
+    """
+    Local aiohttp server in background thread, replay recorded
+    pages with no network.
+    pages - dict {name: body}, each served at /<name>/<n>/ for any n,
+    so one page can be fetched as many different urls.
+
+    """
+    def __init__(self, pages, host=HOST, port=PORT):
+        """
+        Constructor.
+        port 0 - any free port.
+
+        """
+        self.pages = pages
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.ready = Event()
+
+    async def handler(self, request):
+        body = self.pages.get(request.match_info['name'])
+        if body is None:
+            return web.Response(status=404)
+
+        return web.Response(body=body, content_type='text/html',
+                            charset='utf-8')
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        app = web.Application()
+        app.router.add_get('/{name}/{n}/', self.handler)
+
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        self.loop.run_until_complete(
+            web.TCPSite(runner, self.host, self.port).start())
+
+        self.port = runner.addresses[0][1]
+
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+        self.ready.wait()
+
+    def urls(self, name, count):
+        return ['http://{0}:{1}/{2}/{3}/'.format(self.host, self.port,
+                                                 name, n)
+                for n in range(count)]
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from io import StringIO
+from timeit import default_timer
+
+from fixtures import FixtureServer, load_fixture, synthetic_page, BASE_DIR
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'task_8_2'))
+sys.path.append(os.path.join(BASE_DIR, 'task_8_1'))
+
+DB_FILE = os.path.join(BASE_DIR, 'task_8_2', 'app', 'db', 'db.db')
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+ROWS = 10000
+PAGES = 10
+SNAPSHOTS = 3
+REQUESTS = 50
+REPEAT = 3
+
+STAGES = ['fetch', 'parse', 'ingest', 'rest', 'excel']
+
+
+class DiscardParser(object):
+    """
+    Parser which drops page, for measure download only.
+
+    """
+    def __init__(self, encoding=None):
+        self.size = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+
+        return []
+
+    def close(self):
+        return []
+
+
+class Suite(object):
+    """
+    Offline benchmarks of whole data path: fetch and parse pages
+    replayed by local server, ingest into temp copy of DB, REST
+    read endpoints and Excel export.
+    Each case runs repeat times, best time reported.
+    Results collected as list of dicts for JSON report.
+
+    """
+    def __init__(self, rows=ROWS, pages=PAGES, snapshots=SNAPSHOTS,
+                 requests=REQUESTS, repeat=REPEAT):
+        """
+        Constructor.
+
+        """
+        self.rows = rows
+        self.pages = pages
+        self.snapshots = snapshots
+        self.requests = requests
+        self.repeat = repeat
+        self.results = []
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.recorded = load_fixture()
+        self.synthetic = synthetic_page(rows, self.recorded)
+
+        self.server = FixtureServer({'recorded': self.recorded,
+                                     'synthetic': self.synthetic}, port=0)
+        self.server.start()
+
+        # App configured by env before first import.
+        shutil.copy(DB_FILE, os.path.join(self.tmp_dir, 'db.db'))
+        os.environ['COIN_DB_URI'] = 'sqlite:///{0}'.format(
+            os.path.join(self.tmp_dir, 'db.db'))
+        os.environ['COIN_SCHEDULER'] = '0'
+        os.environ['COIN_SCRAPER_CACHE'] = os.path.join(self.tmp_dir,
+                                                         'cache')
+        os.environ.pop('COIN_TS_STORE', None)
+
+        # Committed DB has old schema, upgrade the copy.
+        from app.index import app
+        from app.db.migrate import migrate
+
+        with app.app_context(), redirect_stdout(StringIO()):
+            migrate()
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def measure(self, stage, name, func, ops, unit, repeat=None, **extra):
+        """
+        Run func repeat times and add result.
+        ops - count of units done by one func call.
+
+        """
+        times = []
+
+        for _ in range(repeat or self.repeat):
+            t0 = default_timer()
+            func()
+            times.append(default_timer() - t0)
+
+        best = min(times)
+        result = {'stage': stage, 'name': name, 'unit': unit, 'ops': ops,
+                  'seconds': best, 'mean': sum(times) / len(times),
+                  'per_sec': ops / best if best else None}
+        result.update(extra)
+
+        self.results.append(result)
+
+        print("{0:<7} {1:<26} {2:>8} {3:<8} best: {4:.4f}s  "
+              "{5:>12,.0f} {3}/sec".format(stage, name, ops, unit, best,
+                                          result['per_sec'] or 0))
+
+        return result
+
+    def bench_fetch(self):
+        from app.scraper.scraper import Scraper
+
+        for name, body in (('recorded', self.recorded),
+                           ('synthetic', self.synthetic)):
+            urls = [(url, DiscardParser)
+                    for url in self.server.urls(name, self.pages)]
+
+            self.measure('fetch', '{0} x{1}'.format(name, self.pages),
+                         lambda: Scraper(urls=urls).start(),
+                         self.pages, 'pages',
+                         bytes=len(body) * self.pages)
+
+    def bench_parse(self):
+        from app.scraper.scraper import Scraper, parse_page, parse_body
+        from app.scraper.records import SnapshotBatch
+
+        page = self.synthetic.decode('utf-8')
+        records = parse_page(page)
+
+        self.measure('parse', 'parse_page', lambda: parse_page(page),
+                     len(records), 'rows')
+        self.measure('parse', 'stream parser',
+                     lambda: parse_body(None, self.synthetic, 'utf-8'),
+                     len(records), 'rows')
+        self.measure('parse', 'snapshot batch',
+                     lambda: SnapshotBatch.from_records(records),
+                     len(records), 'rows')
+
+        urls = self.server.urls('synthetic', 1)
+        self.measure('parse', 'scraper fetch + parse',
+                     lambda: Scraper(urls=urls).start(),
+                     len(records), 'rows')
+
+    def bench_ingest(self):
+        from app.index import app, snapshots
+        from app.db.ingest import add_currencies, ingest_snapshot
+        from app.scraper.scraper import parse_page
+        from app.scraper.records import SnapshotBatch
+
+        batch = SnapshotBatch.from_records(
+            parse_page(self.synthetic.decode('utf-8')))
+        date_t = [datetime(2017, 6, 1)]
+
+        def ingest():
+            for n in range(self.snapshots):
+                date_t[0] += timedelta(minutes=10)
+                ingest_snapshot(batch, date_t[0])
+
+        with app.app_context():
+            self.measure('ingest', 'add currencies',
+                         lambda: add_currencies(batch), len(batch), 'rows',
+                         repeat=1)
+            self.measure('ingest', 'snapshot x{0}'.format(self.snapshots),
+                         ingest, len(batch) * self.snapshots, 'rows')
+
+        snapshots.invalidate()
+
+    def bench_rest(self):
+        from app.index import app, load_currencies
+        from app.db.models import db, User
+
+        with app.app_context():
+            names = load_currencies()
+            key = db.session.query(User.apiid).first()[0]
+
+        client = app.test_client()
+        name = names[0][0]
+
+        cases = [
+            ('currency list', '/api/{0}/currency/'),
+            ('currency list ndjson', '/api/{0}/currency/?format=ndjson'),
+            ('latest', '/api/{0}/currency/{1}/latest/'),
+            ('history page', '/api/{0}/currency/{1}/?limit=100'),
+            ('history ndjson', '/api/{0}/currency/{1}/?format=ndjson'),
+            ('ohlc 1h', '/api/{0}/currency/{1}/ohlc/?period=1h'),
+        ]
+
+        for title, url in cases:
+            url = url.format(key, name)
+
+            def get():
+                for _ in range(self.requests):
+                    response = client.get(url)
+                    response.get_data()
+
+                    if response.status_code != 200:
+                        raise RuntimeError('{0}: {1}'.format(
+                            url, response.status_code))
+
+            self.measure('rest', title, get, self.requests, 'requests')
+
+    def bench_excel(self):
+        from app.scraper.scraper import parse_page
+        from saver import ExcelDS, XlsxDS, CsvDS, xlsxwriter
+
+        records = parse_page(self.synthetic.decode('utf-8'))
+
+        savers = [('xls', ExcelDS), ('csv', CsvDS)]
+        if xlsxwriter is not None:
+            savers.append(('xlsx', XlsxDS))
+
+        for ext, saver_class in savers:
+            path = os.path.join(self.tmp_dir, 'export.' + ext)
+
+            def save():
+                with redirect_stdout(StringIO()):
+                    saver_class(path, 'Data').write_data(iter(records))
+
+            self.measure('excel', ext, save, len(records), 'rows')
+
+    def run(self, stages=STAGES):
+        for stage in stages:
+            getattr(self, 'bench_' + stage)()
+
+    def report(self):
+        """
+        Return JSON report dict.
+
+        """
+        try:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                stderr=subprocess.DEVNULL).decode().strip()
+
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'commit': commit,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'params': {'rows': self.rows, 'pages': self.pages,
+                           'snapshots': self.snapshots,
+                           'requests': self.requests,
+                           'repeat': self.repeat},
+                'results': self.results}
+
+
+def compare(base, report):
+    """
+    Print speed change of each result against base report.
+
+    """
+    base_results = {(r['stage'], r['name']): r for r in base['results']}
+
+    print("\nCompared with {0} ({1}):".format(base.get('commit'),
+                                             base.get('date')))
+
+    if base.get('params') != report['params']:
+        print("[+] Warning: params differ {0}".format(base.get('params')))
+
+    for result in report['results']:
+        old = base_results.get((result['stage'], result['name']))
+        if not old or not old['per_sec'] or not result['per_sec']:
+            continue
+
+        print("{0:<7} {1:<26} {2:>+7.1%}".format(
+            result['stage'], result['name'],
+            result['per_sec'] / old['per_sec'] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmark suite, JSON report.')
+    parser.add_argument('-o', '--out', help='JSON report file')
+    parser.add_argument('-c', '--compare', help='base JSON report')
+    parser.add_argument('-s', '--stages', default=','.join(STAGES),
+                        help='comma separated: ' + ','.join(STAGES))
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--pages', type=int, default=PAGES)
+    parser.add_argument('--snapshots', type=int, default=SNAPSHOTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('Unknown stage: {0}'.format(stage))
+
+    logging.basicConfig(level=logging.ERROR)
+
+    suite = Suite(args.rows, args.pages, args.snapshots, args.requests,
+                  args.repeat)
+
+    try:
+        suite.run(stages)
+
+    finally:
+        suite.close()
+
+    report = suite.report()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        print("[+] Report saved: {0}".format(args.out))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import logging
 import asyncio
 import aiohttp
-from lxml import html
+from lxml import html, etree
 
 url = "https://coinmarketcap.com/all/views/all/"
 
@@ -64,44 +64,31 @@ async def _scrap(url):
             logging.error("[+] Response error...\n"
                           "{0}".format(response.status))
 
-def parse(page):
-    res_list = []
 
+ROWS = etree.XPath('//table[@id="currencies-all"]/tbody/tr')
+
+
+def _parse_row(tr):
+    """
+    Single pass over row cells by position:
+    rank, name, symbol, market cap, price, circulating supply,
+    volume, % 1h, % 24h, % 7d.
+
+    """
+    cells = tr.findall('td')
+
+    name = cells[1].find('a').text
+    symbol = cells[2].text
+    market_cap = cells[3].text.strip()
+    price = cells[4].find('a').text
+    cs = cells[5].find('*').text.strip()
+    volume = cells[6].find('a').text
+
+    return (name, symbol, market_cap, price, cs, volume,
+            cells[7].text, cells[8].text, cells[9].text)
+
+
+def parse(page):
     root = html.fromstring(page)
 
-    table = root.xpath(
-        '//table[@id="currencies-all"]/tbody/tr')
-
-    for n, tr in enumerate(table, 1):
-        name = tr.xpath(
-            './/td[@class="no-wrap currency-name"]'
-            '/a/text()')[0]
-        symbol = tr.xpath(
-            './/td[@class="text-left"]'
-            '/text()')[0]
-        market_cap = tr.xpath(
-            './/td[@class="no-wrap market-cap '
-            'text-right"]'
-            '/text()')[0].strip()
-        price = tr.xpath(
-            './/td[@class="no-wrap text-right"]'
-            '/a[@class="price"]/text()')[0]
-        cs = tr.xpath(
-            './/td[@class="no-wrap text-right"]'
-            '/a[@target="_blank"]/text() |'
-            './/td[@class="no-wrap text-right"]'
-            '/span/text()')[0].strip()
-        volume = tr.xpath(
-            './/td[@class="no-wrap text-right "]'
-            '/a/text()')[0]
-        changes = tr.xpath(
-            './/td[starts-with(@class,"no-wrap percent-")]'
-            '/text() |'
-            './/td[@class="text-right"]/text()')
-
-        t = (name, symbol, market_cap, price, cs, volume,
-             changes[0], changes[1], changes[2])
-
-        res_list.append(t)
-
-    return res_list
\ No newline at end of file
+    return [_parse_row(tr) for tr in ROWS(root)]
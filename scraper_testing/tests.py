@@ -1,8 +1,67 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import time
 import unittest
+import threading
 import asyncio
+import importlib.util
 import scraper
 import aiohttp
 
+import numpy as np
+
+from aiohttp import web
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from lxml import html, etree
+
+TEST_DIR = tempfile.mkdtemp()
+TEST_DB = os.path.join(TEST_DIR, 'test.db')
+
+# App configured by env before first import.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'task_8_2'))
+os.environ['COIN_DB_URI'] = 'sqlite:///' + TEST_DB
+os.environ['COIN_SCHEDULER'] = '0'
+os.environ['COIN_SCRAPER_CACHE'] = os.path.join(TEST_DIR, 'cache')
+os.environ['COIN_TASKS_DIR'] = os.path.join(TEST_DIR, 'tasks')
+os.environ.pop('COIN_TS_STORE', None)
+
+# File savers of task_8_1, appended: local scraper module kept.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'task_8_1'))
+
+from app import index
+from app.db.models import db, User, Info, Snapshot, Candle
+from app.db.ingest import add_currencies, ingest_snapshot, currency_ids, \
+    ingest_items
+from app.db.dedup import compact_history, storage_report
+from app.db.migrate import migrate, needs_migrate
+from app.tasks import TaskQueue
+from app.metrics import Metrics, CONTENT_TYPE
+from app.cache import ApiKeyCache, SnapshotCache
+from app.scheduler import FileLock, Scheduler
+from app.db.archive import archive_history, delete_currencies
+from app.db import queries
+from app.db.queries import history_rows, history_page, history_query, \
+    expand_history, history_stream
+from app.db.tsstore import TimeSeriesStore
+from app.db.rollup import rebuild_candles
+from app.db.export import export_cutoff, count_points, history_chunks, \
+    export_npz
+from app.scraper.records import SnapshotBatch, CoinRecord
+from app.scraper.scraper import Scraper, parse_page, \
+    make_parse_executor, RowStreamParser, ROWS_XPATH
+from app.scraper.cache import ResponseCache
+from app.scraper.service import ScraperService
+from saver import SnapshotDS, open_saver
+
 
 class TestScraper(unittest.TestCase):
 
@@ -76,3 +135,1353 @@ class TestScraper(unittest.TestCase):
         self.assertEqual(len(result[0]), 9, "Tuple size not 9."
                                             "Must be a 9 elements."
                                             "Check it !")
+
+    def test_parser_rows(self):
+        result = scraper.parse(self.content)
+
+        self.assertEqual(len(result), 830, "Wrong rows count."
+                                           "Must be a 830 rows."
+                                           "Check it !")
+        self.assertEqual(result[0], ('Bitcoin', 'BTC', '$35,997,837,378',
+                                     '$2202.43', '16,344,600',
+                                     '$1,690,990,000', '-2.49%', '5.28%',
+                                     '25.49%'), "Wrong first row !")
+        self.assertEqual(result[-1][4], '1,344', "Wrong circulating supply"
+                                                 " in last row !")
+
+    def test_parser_app(self):
+        # Local copy of row parser must stay same as app one.
+        self.assertEqual(scraper.parse(self.content),
+                         parse_page(self.content),
+                         "Parser differs from app parser !")
+
+
+class TestRowStreamParser(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'rb') as f:
+            self.body = f.read()
+
+        self.expected = parse_page(self.body.decode('utf-8'))
+
+    def feed(self, body, size):
+        parser = RowStreamParser('utf-8')
+        records = []
+
+        for n in range(0, len(body), size):
+            records.extend(parser.feed(body[n:n + size]))
+
+        return records + parser.close()
+
+    def test_chunks(self):
+        for size in (1000, 4093, 64 * 1024, len(self.body)):
+            self.assertEqual(self.feed(self.body, size), self.expected,
+                             "Wrong records for {0} byte chunks !"
+                             .format(size))
+
+    def test_rows_freed(self):
+        parser = RowStreamParser('utf-8')
+        records = parser.feed(self.body[:len(self.body) // 2])
+
+        # Tree built so far: only last parsed row left in table.
+        tbody = parser.parser.close().find('.//table/tbody')
+
+        self.assertTrue(records, "No records before page end !")
+        self.assertLessEqual(len(tbody), 2, "Parsed rows kept in tree !")
+
+    def test_other_tables(self):
+        row = etree.tostring(ROWS_XPATH(html.fromstring(self.body))[0])
+        page = (b'<html><body><table><tbody><tr><td>x</td></tr></tbody>'
+                b'</table><table id="currencies-all"><tbody>' + row +
+                b'</tbody></table><table><tr><td>y</td></tr></table>'
+                b'</body></html>')
+
+        self.assertEqual(self.feed(page, 64), self.expected[:1],
+                         "Rows of other tables parsed !")
+
+
+class TestSnapshotSaver(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=TEST_DIR)
+
+        with open('test_coin.html', 'r') as f:
+            self.records = scraper.parse(f.read())[:5]
+
+    def path(self, file_name):
+        return os.path.join(self.dir, file_name)
+
+    def save(self, saver, *dates):
+        with redirect_stdout(StringIO()):
+            return [saver.write_data(iter(self.records), date_t)
+                    for date_t in dates]
+
+    def test_rotate(self):
+        saver = open_saver(self.path('coins-{0:%Y-%m-%d}.csv'), None,
+                           keep=2)
+
+        # Same prefix and suffix, but not snapshot of series.
+        for file_name in ('coins-backup.csv', 'coins-2017-06-01-old.csv'):
+            open(self.path(file_name), 'w').close()
+
+        counts = self.save(saver, *[datetime(2017, 6, day, 12)
+                                    for day in (1, 1, 2, 3)])
+
+        self.assertEqual(counts, [5] * 4, "Wrong saved records count !")
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['coins-2017-06-01-old.csv', 'coins-2017-06-02.csv',
+                          'coins-2017-06-03.csv', 'coins-backup.csv'],
+                         "Wrong files rotated !")
+
+        with open(self.path('coins-2017-06-03.csv')) as f:
+            self.assertEqual(len(f.readlines()), 6, "Wrong rows count !")
+
+    def test_keep_all(self):
+        saver = SnapshotDS(self.path('coins-{0:%Y-%m-%d-%H-%M}.xlsx'))
+        dates = [datetime(2017, 6, 1, 12, n) for n in range(3)]
+
+        self.assertEqual(self.save(saver, *dates), [5] * 3,
+                         "Wrong saved records count !")
+        self.assertEqual(len(saver.files()), 3, "Files removed !")
+
+        with self.assertRaises(ValueError):
+            saver.write_data(iter(self.records), dates[0])
+
+    def test_keep_check(self):
+        with self.assertRaises(ValueError):
+            open_saver(self.path('coins.xls'), 'Data', keep=2)
+
+    def test_stream(self):
+        consumed = []
+
+        def records():
+            for record in self.records:
+                consumed.append(record)
+                yield record
+
+        for file_name in ('coins.xls', 'coins.xlsx', 'coins.tsv'):
+            del consumed[:]
+
+            with redirect_stdout(StringIO()):
+                count = open_saver(self.path(file_name),
+                                   'Data').write_data(records())
+
+            self.assertEqual(count, 5, "Wrong saved records count !")
+            self.assertEqual(consumed, self.records,
+                             "Records not saved from iterator !")
+            self.assertTrue(os.path.getsize(self.path(file_name)),
+                            "Empty file !")
+
+
+    def test_stream_parser(self):
+        # task_8_1 scraper has same module name as local one.
+        spec = importlib.util.spec_from_file_location(
+            'task_8_1_scraper', os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                '..', 'task_8_1', 'scraper.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        with open('test_coin.html', 'rb') as f:
+            body = f.read()
+
+        parser = module.RowStreamParser('utf-8')
+        records = []
+        for n in range(0, len(body), 4096):
+            records.extend(parser.feed(body[n:n + 4096]))
+        records.extend(parser.close())
+
+        self.assertEqual(records, module.parse_page(body.decode('utf-8')),
+                         "Streamed records differ from page parse !")
+        self.assertEqual(records, parse_page(body.decode('utf-8')),
+                         "Parser differs from app parser !")
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Flask app on empty temp DB with one user and
+    first rows of test page ingested.
+
+    """
+    def setUp(self):
+        with open('test_coin.html', 'r') as f:
+            self.batch = SnapshotBatch.from_records(
+                scraper.parse(f.read())[:20])
+
+        self.ctx = index.app.app_context()
+        self.ctx.push()
+
+        db.drop_all()
+        db.create_all()
+
+        user = User('tester', 'tester@mail.ru', 'password')
+        db.session.add(user)
+        db.session.commit()
+        self.key = user.apiid
+
+        add_currencies(self.batch)
+        ingest_snapshot(self.batch, datetime(2017, 6, 1, 12, 0))
+
+        index.api_keys.invalidate()
+        index.snapshots.invalidate()
+
+        self.client = index.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+
+class TestMetrics(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.metrics = index.metrics = Metrics()
+
+    def tearDown(self):
+        index.metrics = None
+        index.app.config['METRICS_TOKEN'] = None
+        super().tearDown()
+
+    def get(self, remote='127.0.0.1', **headers):
+        return self.client.get('/metrics', headers=headers,
+                               environ_base={'REMOTE_ADDR': remote})
+
+    def test_render(self):
+        self.metrics.inc('coin_scrape_pages_total', 'ok')
+        self.metrics.inc('coin_scrape_pages_total', 'ok')
+        self.metrics.observe('coin_pipeline_seconds', 0.3, 'online',
+                             'scrape')
+
+        response = self.get()
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertEqual(response.status_code, 200, "Wrong status !")
+        self.assertEqual(response.content_type, CONTENT_TYPE,
+                         "Wrong content type !")
+        self.assertIn('# TYPE coin_pipeline_seconds histogram', lines,
+                      "No metric type !")
+        self.assertIn('coin_scrape_pages_total{result="ok"} 2', lines,
+                      "Wrong counter !")
+
+        for line in ('coin_pipeline_seconds_bucket{task="online",'
+                     'stage="scrape",le="0.25"} 0',
+                     'coin_pipeline_seconds_bucket{task="online",'
+                     'stage="scrape",le="0.5"} 1',
+                     'coin_pipeline_seconds_bucket{task="online",'
+                     'stage="scrape",le="+Inf"} 1',
+                     'coin_pipeline_seconds_count{task="online",'
+                     'stage="scrape"} 1'):
+            self.assertIn(line, lines, "Wrong histogram !")
+
+    def test_disabled(self):
+        index.metrics = None
+
+        self.assertEqual(self.get().status_code, 404, "Wrong status !")
+
+    def test_access(self):
+        self.assertEqual(self.get('10.0.0.1').status_code, 403,
+                         "Metrics open to remote hosts !")
+
+        index.app.config['METRICS_TOKEN'] = 'secret'
+
+        self.assertEqual(self.get().status_code, 401, "No token check !")
+        self.assertEqual(self.get(Authorization='Bearer wrong').status_code,
+                         401, "Wrong token allowed !")
+        self.assertEqual(self.get('10.0.0.1',
+                                  Authorization='Bearer secret').status_code,
+                         200, "Token not allowed !")
+
+
+class TestSnapshotCache(AppTestCase):
+
+    def test_etag_changed_by_other_process(self):
+        url = '/api/{0}/currency/'.format(self.key)
+
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+
+        self.assertEqual(response.status_code, 200, "Wrong status !")
+        self.assertEqual(len(response.get_json()['data']), 20,
+                         "Wrong currencies count !")
+
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304, "Not modified must "
+                                                    "be 304 !")
+
+        # Write by other process: own connection, no invalidate().
+        conn = sqlite3.connect(TEST_DB)
+        conn.execute("INSERT INTO currency (name, symbol) "
+                     "VALUES ('othercoin', 'OTH')")
+        conn.commit()
+        conn.close()
+
+        index.snapshots.state_ttl = 0
+        try:
+            response = self.client.get(url, headers={'If-None-Match': etag})
+
+        finally:
+            index.snapshots.state_ttl = index.app.config['SNAPSHOT_STATE_TTL']
+
+        self.assertEqual(response.status_code, 200, "Changed DB must "
+                                                    "be 200 !")
+        self.assertNotEqual(response.headers['ETag'], etag,
+                            "ETag must be changed !")
+        self.assertEqual(len(response.get_json()['data']), 21,
+                         "Cached currencies list returned !")
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), "No time.tzset()")
+    def test_last_modified_utc(self):
+        url = '/api/{0}/currency/'.format(self.key)
+        tz = os.environ.get('TZ')
+        snapshots = index.snapshots
+
+        # DB dates are local time, here UTC+3.
+        os.environ['TZ'] = 'Etc/GMT-3'
+        time.tzset()
+        index.snapshots = SnapshotCache(queries.snapshot_state)
+
+        try:
+            modified = self.client.get(url).headers['Last-Modified']
+            same = self.client.get(
+                url, headers={'If-Modified-Since': modified})
+            earlier = self.client.get(
+                url, headers={'If-Modified-Since':
+                              'Thu, 01 Jun 2017 08:59:59 GMT'})
+
+        finally:
+            index.snapshots = snapshots
+
+            if tz is None:
+                os.environ.pop('TZ')
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+
+        self.assertEqual(modified, 'Thu, 01 Jun 2017 09:00:00 GMT',
+                         "Last-Modified is not UTC !")
+        self.assertEqual(same.status_code, 304, "Not modified must "
+                                                "be 304 !")
+        self.assertEqual(earlier.status_code, 200, "Modified must "
+                                                   "be 200 !")
+
+
+class TestTimeSeriesStore(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.store = TimeSeriesStore(tempfile.mkdtemp(dir=TEST_DIR))
+        index.ts_store = self.store
+
+    def tearDown(self):
+        index.ts_store = None
+        super().tearDown()
+
+    def post(self, name, date_time):
+        return self.client.post(
+            '/api/{0}/currency/'.format(self.key),
+            json={'name': name, 'symbol': name[:3],
+                  'info': {'mc': 1, 'price': 2, 'cs': 3, 'volume': 4,
+                           'p1h': 5, 'p24h': 6, 'p7d': 7,
+                           'date_time': date_time}})
+
+    def test_post_delete(self):
+        response = self.post('TestCoin', '2017-06-02 10:00:00')
+        self.assertEqual(response.get_json(), {"Status": "Success!"},
+                         "Currency not added !")
+
+        currency_id = currency_ids(['testcoin'])['testcoin']
+        self.assertEqual(len(self.store.series(currency_id)), 1,
+                         "POST info not written to store !")
+
+        response = self.client.delete('/api/{0}/currency/'.format(self.key),
+                                      json={'name': 'TestCoin'})
+        self.assertEqual(response.get_json()['deleted'], ['testcoin'],
+                         "Currency not deleted !")
+        self.assertFalse(os.path.exists(self.store.path(currency_id)),
+                         "Deleted currency left in store !")
+
+        # SQLite reuses last id, new currency has no old history.
+        self.post('NewCoin', '2017-06-03 10:00:00')
+        new_id = currency_ids(['newcoin'])['newcoin']
+        series = self.store.series(new_id)
+
+        self.assertEqual(new_id, currency_id, "Id is not reused !")
+        self.assertEqual(len(series), 1, "Old history in store !")
+
+    def test_archive(self):
+        dates = [datetime(2017, 6, 2, 12, n * 10) for n in range(3)]
+        for date_t in dates:
+            ingest_snapshot(self.batch, date_t, store=self.store)
+
+        currency_id = currency_ids(self.batch.names[:1])[
+            self.batch.names[0].lower()]
+        self.assertEqual(len(self.store.series(currency_id)), 3,
+                         "Snapshots not written to store !")
+
+        archive_history(dates[1], os.path.join(TEST_DIR, 'archive.db'),
+                        store=self.store)
+
+        points = self.store.last_history(currency_id, 10)
+        self.assertEqual([point.date for point in points], dates[1:],
+                         "Archived points left in store !")
+
+    def test_older_point(self):
+        self.post('TestCoin', '2017-06-03 10:00:00')
+        self.post('TestCoin', '2017-06-02 10:00:00')
+        self.post('TestCoin', '2017-06-04 10:00:00')
+
+        currency_id = currency_ids(['testcoin'])['testcoin']
+        points = self.store.last_history(currency_id, 10)
+
+        self.assertEqual([point.date.day for point in points], [2, 3, 4],
+                         "Older point skipped or not in order !")
+
+    def test_cursor_truncate(self):
+        dates = [datetime(2017, 6, 2, 12, n * 10) for n in range(4)]
+        for date_t in dates:
+            ingest_snapshot(self.batch, date_t, store=self.store)
+
+        currency_id = currency_ids(self.batch.names[:1])[
+            self.batch.names[0].lower()]
+
+        points, cursor = self.store.history_page(currency_id, limit=2)
+        self.store.truncate(dates[1])
+
+        points, cursor = self.store.history_page(currency_id, limit=2,
+                                                 cursor=cursor)
+        self.assertEqual([point.date for point in points], dates[2:],
+                         "Cursor is wrong after truncate !")
+        self.assertIsNone(cursor, "Not last page !")
+
+
+class TestExport(AppTestCase):
+
+    def test_cutoff(self):
+        date_t = datetime(2017, 6, 1, 12, 10)
+        ingest_snapshot(self.batch, date_t)
+
+        cutoff = export_cutoff()
+        count = count_points(cutoff=cutoff)
+
+        # Written after cutoff: runs extended and new rows.
+        ingest_snapshot(self.batch, datetime(2017, 6, 1, 12, 20))
+        ingest_snapshot(self.batch[:5].sorted('price'),
+                        datetime(2017, 6, 1, 12, 30), dedup=False)
+
+        points = sum(len(chunk['date'])
+                     for chunk in history_chunks(cutoff=cutoff))
+
+        self.assertEqual(count, 40, "Wrong points count !")
+        self.assertEqual(points, count, "Count and data differ !")
+
+    def test_npz(self):
+        path = os.path.join(TEST_DIR, 'export.npz')
+        count = export_npz(path)
+
+        with np.load(path) as data:
+            self.assertEqual(len(data['date']), count,
+                             "Wrong exported points count !")
+            self.assertEqual(len(data['names']), 20,
+                             "Wrong exported currencies count !")
+
+
+class TestArchive(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.archive = os.path.join(tempfile.mkdtemp(dir=TEST_DIR),
+                                    'archive.db')
+        self.dates = [datetime(2017, 6, 1, 12, n * 10) for n in range(4)]
+
+        # Same values: one Info row run for each currency.
+        for date_t in self.dates[1:]:
+            ingest_snapshot(self.batch, date_t)
+
+        self.currency_id = currency_ids(self.batch.names[:1])[
+            self.batch.names[0].lower()]
+
+    def archived(self, sql):
+        conn = sqlite3.connect(self.archive)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_split_run(self):
+        count = archive_history(self.dates[2], self.archive)
+
+        self.assertEqual(count, 20, "Wrong moved rows count !")
+        self.assertEqual(
+            [point.date for point in history_rows(self.currency_id)],
+            self.dates[2:], "Run rest not kept in main DB !")
+        self.assertEqual(
+            self.archived('SELECT date, until FROM info JOIN currency '
+                          'ON currency.id = info.currency_id WHERE '
+                          "name = '{0}'".format(self.batch.names[0].lower())),
+            [('2017-06-01 12:00:00.000000', '2017-06-01 12:10:00.000000')],
+            "Archived run not cut at <before> !")
+
+    def test_reused_id(self):
+        name = self.batch.names[-1].lower()
+        old_id = currency_ids([name])[name]
+
+        delete_currencies([name], self.archive)
+        ingest_items([{'name': 'ReusedCoin', 'symbol': 'RC',
+                       'info': {'price': 1,
+                                'date_time': '2017-06-01 12:05:00'}}])
+
+        self.assertEqual(currency_ids(['reusedcoin'])['reusedcoin'], old_id,
+                         "Currency id not reused !")
+
+        archive_history(self.dates[3], self.archive)
+
+        self.assertEqual(
+            self.archived('SELECT name, count(*) FROM info JOIN currency '
+                          'ON currency.id = info.currency_id '
+                          "WHERE name IN ('{0}', 'reusedcoin') "
+                          'GROUP BY name ORDER BY name'.format(name)),
+            sorted([(name, 1), ('reusedcoin', 1)]),
+            "History archived under other currency !")
+
+    def test_tables(self):
+        archive_history(self.dates[1], self.archive)
+        archive_history(self.dates[3], self.archive)
+
+        pk = [row[1] for row in self.archived('PRAGMA table_info(info)')
+              if row[5]]
+        indexes = [row[1] for row in self.archived('PRAGMA index_list(info)')]
+
+        self.assertEqual(pk, ['id'], "Archive info has no primary key !")
+        self.assertIn('ix_info_currency_date', indexes,
+                      "Archive info has no index !")
+        self.assertEqual(self.archived('SELECT count(*) FROM info'), [(40,)],
+                         "Wrong archived rows count !")
+
+    def test_old_archive(self):
+        conn = sqlite3.connect(self.archive)
+        conn.execute('CREATE TABLE currency (id INTEGER, name VARCHAR(64), '
+                     'symbol VARCHAR(6))')
+        conn.execute('CREATE TABLE info (id INTEGER, market_cap FLOAT, '
+                     'price FLOAT, cs FLOAT, volume FLOAT, perc_1h FLOAT, '
+                     'perc_7d FLOAT, perc_24h FLOAT, date DATETIME, '
+                     'currency_id INTEGER)')
+        conn.close()
+
+        count = archive_history(self.dates[3], self.archive)
+
+        self.assertEqual(count, 20, "Wrong moved rows count !")
+        self.assertIn('until', [row[1] for row in
+                                self.archived('PRAGMA table_info(info)')],
+                      "Column not added to old archive !")
+
+
+class TestHistory(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.dates = [datetime(2017, 6, 1, 12, n * 10) for n in range(5)]
+        self.name = self.batch.names[0].lower()
+        self.currency_id = currency_ids([self.name])[self.name]
+
+    def changed(self):
+        return SnapshotBatch(self.batch.names, self.batch.symbols,
+                             self.batch.values * 1.01)
+
+    def dates_of(self, points):
+        return [point.date for point in points]
+
+    def test_expand(self):
+        for date_t in self.dates[1:3]:
+            ingest_snapshot(self.batch, date_t)
+
+        rows = history_query(self.currency_id).all()
+        self.assertEqual(len(rows), 1, "Unchanged rows not merged !")
+        self.assertEqual(rows[0].until, self.dates[2], "Wrong run end !")
+
+        self.assertEqual(self.dates_of(expand_history(rows)),
+                         self.dates[:3], "Wrong expanded dates !")
+        self.assertEqual(
+            self.dates_of(expand_history(rows, date_from=self.dates[1],
+                                         date_to=self.dates[2])),
+            self.dates[1:2], "Points not clipped to range !")
+
+    def test_paging(self):
+        ingest_snapshot(self.batch, self.dates[1])
+        ingest_snapshot(self.changed(), self.dates[2])
+        ingest_snapshot(self.changed(), self.dates[3])
+        ingest_snapshot(self.batch, self.dates[4])
+
+        points = []
+        cursor = None
+        while True:
+            page, cursor = history_page(self.currency_id, limit=2,
+                                        cursor=cursor)
+            points.extend(page)
+            if not cursor:
+                break
+
+        self.assertEqual(len(history_query(self.currency_id).all()), 3,
+                         "Wrong runs count !")
+        self.assertEqual(self.dates_of(points), self.dates,
+                         "Pages skip or repeat points !")
+        self.assertEqual(self.dates_of(points),
+                         self.dates_of(history_rows(self.currency_id)),
+                         "Pages differ from full history !")
+
+    def test_stream(self):
+        ingest_snapshot(self.batch, self.dates[1])
+        ingest_snapshot(self.changed(), self.dates[2])
+        ingest_snapshot(self.batch, self.dates[3])
+
+        self.assertEqual(
+            self.dates_of(history_stream(self.currency_id, chunk=2)),
+            self.dates[:4], "Stream pages skip or repeat points !")
+
+        chunk = index.app.config['STREAM_CHUNK']
+        index.app.config['STREAM_CHUNK'] = 3
+        try:
+            response = self.client.get(
+                '/api/{0}/currency/{1}/?format=ndjson'.format(self.key,
+                                                              self.name))
+            lines = response.get_data(as_text=True).splitlines()
+
+        finally:
+            index.app.config['STREAM_CHUNK'] = chunk
+
+        self.assertEqual(len(lines), 4, "Wrong streamed rows count !")
+
+    def test_compact(self):
+        for date_t in self.dates[1:3]:
+            ingest_snapshot(self.batch, date_t, dedup=False)
+        ingest_snapshot(self.changed(), self.dates[3], dedup=False)
+
+        before = [(p.date, p.price) for p in history_rows(self.currency_id)]
+        deleted = compact_history()
+        after = [(p.date, p.price) for p in history_rows(self.currency_id)]
+
+        self.assertEqual(deleted, 40, "Wrong compacted rows count !")
+        self.assertEqual(after, before, "History changed by compact !")
+        self.assertEqual(Info.query.count(), 40, "Wrong Info rows count !")
+
+    def candles(self):
+        return [(c.currency_id, c.period, c.start, round(c.open, 6),
+                 round(c.high, 6), round(c.low, 6), round(c.close, 6),
+                 round(c.volume_sum, 2), c.volume_count, c.first_date,
+                 c.last_date)
+                for c in Candle.query.order_by(Candle.currency_id,
+                                               Candle.period, Candle.start)]
+
+    def test_candles_rebuild(self):
+        ingest_snapshot(self.batch, self.dates[1])
+        ingest_snapshot(self.changed(), self.dates[2])
+        ingest_snapshot(self.changed(), self.dates[3])
+        ingest_snapshot(self.batch[:5].sorted('price'), self.dates[4],
+                        dedup=False)
+
+        # REST record inside run, older than last snapshot.
+        item = {'name': self.name, 'symbol': 'BTC',
+                'info': {'mc': 1, 'price': 3000, 'cs': 2, 'volume': 5,
+                         'p1h': 0, 'p24h': 0, 'p7d': 0,
+                         'date_time': '2017-06-01 12:25:00'}}
+        statuses = ingest_items([item])
+        self.assertEqual(statuses[0]['status'], 'exists', "Item not saved !")
+
+        upserted = self.candles()
+        count = rebuild_candles()
+
+        self.assertEqual(count, len(upserted), "Wrong candles count !")
+        self.assertEqual(self.candles(), upserted,
+                         "Upserted candles differ from rebuild !")
+
+    def test_backfill_posted(self):
+        # Old row before first snapshot, REST row between snapshots.
+        db.session.bulk_insert_mappings(Info, [
+            {'currency_id': self.currency_id, 'date': date_t, 'price': 1.0}
+            for date_t in (datetime(2017, 5, 1), self.dates[1])])
+        ingest_snapshot(self.batch, self.dates[2], dedup=False)
+
+        compact_history()
+        snapshots = [row[0] for row in db.session.query(Snapshot.date)
+                     .order_by(Snapshot.date)]
+
+        self.assertEqual(snapshots, [datetime(2017, 5, 1), self.dates[0],
+                                     self.dates[2]],
+                         "Posted date backfilled as snapshot !")
+
+    def test_empty_snapshot(self):
+        count = ingest_snapshot(SnapshotBatch.from_records([]),
+                                self.dates[1])
+        ingest_snapshot(self.batch[1:], self.dates[2])
+
+        self.assertEqual(count, 0, "Empty snapshot saved !")
+        self.assertEqual(Snapshot.query.count(), 2,
+                         "Snapshot row of empty scrape !")
+        self.assertEqual(self.dates_of(history_rows(self.currency_id)),
+                         self.dates[:1],
+                         "Run extended for missing currency !")
+
+    def test_post_splits_run(self):
+        for date_t in self.dates[1:4]:
+            ingest_snapshot(self.batch, date_t)
+
+        statuses = ingest_items([
+            {'name': self.name, 'symbol': 'BTC',
+             'info': [{'price': 1, 'date_time': '2017-06-01 12:10:00'},
+                      {'price': 2, 'date_time': '2017-06-01 12:25:00'}]}])
+
+        points = list(history_rows(self.currency_id))
+
+        self.assertEqual(statuses[0]['status'], 'exists', "Wrong status !")
+        self.assertEqual(
+            self.dates_of(points),
+            self.dates[:3] + [datetime(2017, 6, 1, 12, 25), self.dates[3]],
+            "Posted points overlap run !")
+        self.assertEqual([point.price for point in points],
+                         [2202.43, 1, 2202.43, 2, 2202.43], "Wrong prices !")
+
+
+class TestMigrate(AppTestCase):
+    """
+    DB made by first app version: Info values as formatted
+    strings, no until column, snapshot and candle tables.
+
+    """
+    OLD_INFO = """
+    CREATE TABLE info (
+        id INTEGER PRIMARY KEY, market_cap VARCHAR(32),
+        price VARCHAR(32), cs VARCHAR(32), volume VARCHAR(32),
+        perc_1h VARCHAR(8), perc_7d VARCHAR(8), perc_24h VARCHAR(8),
+        date DATETIME, currency_id INTEGER REFERENCES currency (id))
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        for table in ('candle', 'snapshot', 'info'):
+            db.session.execute(db.text('DROP TABLE {0}'.format(table)))
+
+        db.session.execute(db.text(self.OLD_INFO))
+
+        for n, date in enumerate(('2017-05-14 16:44:28.000000',
+                                  '2017-05-14 16:54:28.000000')):
+            db.session.execute(db.text(
+                "INSERT INTO info VALUES (:id, '$29,607,555,402', "
+                "'$1,813.14', '16,329,437', '$450,633,000', '0.91%', "
+                "'15.73%', '2.23%', :date, 1)"), {'id': n + 1, 'date': date})
+
+        db.session.commit()
+
+    def test_old_schema(self):
+        self.assertTrue(needs_migrate(), "Old DB not detected !")
+
+        with redirect_stdout(StringIO()):
+            migrate()
+
+        self.assertFalse(needs_migrate(), "DB still old after migrate !")
+        self.assertEqual(storage_report()['snapshots'], 2,
+                         "Snapshots not backfilled !")
+        self.assertEqual(db.session.query(Info.price).first()[0], 1813.14,
+                         "Info values not converted !")
+
+        response = self.client.get('/api/{0}/currency/{1}/ohlc/'.format(
+            self.key, self.batch.names[0]))
+
+        self.assertEqual(response.status_code, 200, "Wrong status !")
+        self.assertEqual(len(response.get_json()['candles']), 1,
+                         "Candles not rebuilt !")
+
+    def test_new_schema(self):
+        db.drop_all()
+        self.assertFalse(needs_migrate(), "Empty DB migrated !")
+
+        db.create_all()
+        self.assertFalse(needs_migrate(), "New DB migrated !")
+
+
+class TestTasks(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        # Queue of other app worker with same tasks dir.
+        self.other = TaskQueue(root=index.online_tasks.root,
+                               encode=SnapshotBatch.as_json,
+                               decode=SnapshotBatch.from_json)
+
+        with self.client.session_transaction() as sess:
+            sess['user'] = 'tester'
+            sess['api_id'] = self.key
+
+    def tearDown(self):
+        self.other.shutdown()
+        super().tearDown()
+
+    def run_task(self, owner):
+        def func(task):
+            task.update('scraping')
+            return self.batch
+
+        task = self.other.submit('online', func, owner=owner)
+        task.wait(None, timeout=5)
+
+        while not task.done:
+            task.wait(task.version, timeout=5)
+
+        return task
+
+    def test_other_worker(self):
+        task = self.run_task('tester')
+
+        response = self.client.get(
+            '/info/tester/online/{0}/status/'.format(task.id))
+        self.assertEqual(response.status_code, 200, "Task not found !")
+        self.assertEqual(response.get_json()['state'], 'done',
+                         "Wrong task state !")
+
+        response = self.client.get(
+            '/info/tester/online/{0}/'.format(task.id))
+        self.assertIn('Bitcoin', response.get_data(as_text=True),
+                      "No task result on page !")
+
+        stored = index.online_tasks.get(task.id, owner='tester')
+        self.assertEqual(stored.result, self.batch, "Wrong task result !")
+
+    def test_coalesce_other_worker(self):
+        release = Event()
+        runs = []
+
+        def func(task):
+            runs.append(task.id)
+            release.wait(5)
+            return self.batch
+
+        task = self.other.submit('online', func, owner='someone')
+
+        try:
+            shared = index.online_tasks.submit('online', func,
+                                               owner='tester')
+            self.assertEqual(shared.id, task.id, "Task not coalesced !")
+
+            response = self.client.get(
+                '/info/tester/online/{0}/status/'.format(task.id))
+            self.assertEqual(response.status_code, 200,
+                             "Task not shared with owner !")
+
+        finally:
+            release.set()
+
+        while not task.done:
+            task.wait(task.version, timeout=5)
+
+        self.assertEqual(runs, [task.id], "Task run twice !")
+
+        # Key lock released, next submit starts new task.
+        again = index.online_tasks.submit('online', lambda t: self.batch)
+        self.assertNotEqual(again.id, task.id, "Done task reused !")
+
+    def test_owner(self):
+        task = self.run_task('someone')
+
+        response = self.client.get(
+            '/info/tester/online/{0}/status/'.format(task.id))
+        self.assertEqual(response.status_code, 404, "Task of other user !")
+        self.assertIsNone(index.online_tasks.get(task.id, owner='tester'),
+                          "Task of other user !")
+
+
+class PageServer(object):
+    """
+    Local aiohttp server in background thread with one page.
+    ETag sent and checked if etag is set.
+    Each answer delayed by <delay> seconds, max count of requests
+    served at once kept in max_active.
+
+    """
+    def __init__(self, body, etag=None, delay=0):
+        self.body = body
+        self.etag = etag
+        self.delay = delay
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = Event()
+        self.url = None
+
+    async def handler(self, request):
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+        finally:
+            self.active -= 1
+
+        headers = {'ETag': self.etag} if self.etag else {}
+
+        if self.etag and request.headers.get('If-None-Match') == self.etag:
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(body=self.body, content_type='text/html',
+                            charset='utf-8', headers=headers)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+
+        app = web.Application()
+        app.router.add_get('/', self.handler)
+
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        self.loop.run_until_complete(
+            web.TCPSite(self.runner, '127.0.0.1', 0).start())
+
+        self.url = 'http://127.0.0.1:{0}/'.format(
+            self.runner.addresses[0][1])
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+        self.ready.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'rb') as f:
+            self.body = f.read()
+
+        self.root = tempfile.mkdtemp(dir=TEST_DIR)
+        self.expected = SnapshotBatch.from_records(
+            scraper.parse(self.body.decode('utf-8')))
+
+    def serve(self, etag=None):
+        server = PageServer(self.body, etag)
+        server.start()
+        self.addCleanup(server.stop)
+
+        return server
+
+    def scrap(self, server, cache=None):
+        page_scraper = Scraper(urls=[server.url],
+                               cache=cache or ResponseCache(self.root))
+
+        return page_scraper.start(), page_scraper.last_stats
+
+    def test_not_modified(self):
+        server = self.serve(etag='"v1"')
+
+        records, stats = self.scrap(server)
+        self.assertEqual((stats.misses, stats.unchanged), (1, False),
+                         "First page not downloaded !")
+        self.assertEqual(records, self.expected, "Wrong streamed records !")
+
+        records, stats = self.scrap(server)
+        self.assertEqual((stats.not_modified, stats.unchanged), (1, True),
+                         "Page not answered 304 !")
+        self.assertEqual(stats.bytes_saved, len(self.body),
+                         "Wrong saved bytes !")
+        self.assertEqual(records, self.expected, "Wrong cached records !")
+
+    def test_hash_hit(self):
+        server = self.serve()
+
+        self.scrap(server)
+        records, stats = self.scrap(server)
+
+        self.assertEqual((stats.hash_hits, stats.unchanged), (1, True),
+                         "Same body not detected by hash !")
+        self.assertEqual(records, self.expected, "Wrong cached records !")
+
+        server.body = self.body.replace(b'>Bitcoin<', b'>Bitcoin New<')
+        records, stats = self.scrap(server)
+
+        self.assertEqual((stats.misses, stats.unchanged), (1, False),
+                         "Changed body not parsed !")
+        self.assertEqual(records.names[0], 'Bitcoin New',
+                         "Records of changed page not parsed !")
+
+    def test_other_worker(self):
+        server = self.serve(etag='"v1"')
+        first = ResponseCache(self.root)
+        other = ResponseCache(self.root)
+
+        self.scrap(server, first)
+        self.assertEqual(other.get(server.url)['etag'], '"v1"',
+                         "Entry of other worker not read !")
+
+        server.etag = '"v2"'
+        self.scrap(server, other)
+
+        self.assertEqual(first.get(server.url)['etag'], '"v2"',
+                         "Stale entry kept in memory !")
+        self.assertEqual(self.scrap(server, first)[1].not_modified, 1,
+                         "Stale validators sent !")
+
+
+class TestParseExecutor(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'rb') as f:
+            self.body = f.read()
+
+        self.expected = SnapshotBatch.from_records(
+            scraper.parse(self.body.decode('utf-8')))
+
+        self.server = PageServer(self.body)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_make(self):
+        for kind, cls in (('thread', ThreadPoolExecutor),
+                          ('process', ProcessPoolExecutor)):
+            executor = make_parse_executor(kind, 2)
+            self.addCleanup(executor.shutdown)
+
+            self.assertIsInstance(executor, cls, "Wrong executor type !")
+            self.assertEqual(executor._max_workers, 2, "Wrong pool size !")
+
+        with self.assertRaises(ValueError):
+            make_parse_executor('fiber')
+
+    def test_own_pool(self):
+        page_scraper = Scraper(urls=[self.server.url] * 2,
+                               parse_executor='thread', parse_workers=2)
+
+        executor = page_scraper._executor()
+        self.assertIs(page_scraper._executor(), executor,
+                      "Pool created twice !")
+
+        records = page_scraper.start()
+
+        self.assertEqual(len(records), 2 * len(self.expected),
+                         "Wrong parsed records count !")
+        self.assertEqual(records[:len(self.expected)], self.expected,
+                         "Wrong records parsed in pool !")
+        self.assertIsNone(page_scraper.executor, "Pool not shut down !")
+
+        with self.assertRaises(RuntimeError):
+            executor.submit(len, [])
+
+    def test_caller_pool(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+
+        records = Scraper(urls=[self.server.url],
+                          parse_executor=executor).start()
+
+        self.assertEqual(records, self.expected, "Wrong records !")
+        self.assertEqual(executor.submit(len, [1]).result(), 1,
+                         "Caller pool shut down by scraper !")
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'rb') as f:
+            self.body = f.read()
+
+    def serve(self, body=None, delay=0):
+        server = PageServer(body or self.body, delay=delay)
+        server.start()
+        self.addCleanup(server.stop)
+
+        return server
+
+    def test_bounded(self):
+        server = self.serve(delay=0.2)
+        records = Scraper(urls=[server.url] * 6, concurrency=2).start()
+
+        self.assertEqual(server.requests, 6, "Wrong requests count !")
+        self.assertEqual(server.max_active, 2,
+                         "Concurrency limit not kept !")
+        self.assertEqual(len(records), 6 * 830, "Wrong records count !")
+
+    def test_order(self):
+        slow = self.serve(self.body.replace(b'>Bitcoin<', b'>Slow<'), 0.3)
+        fast = self.serve()
+
+        records = Scraper(urls=[slow.url, fast.url]).start()
+
+        self.assertEqual((records.names[0], records.names[830]),
+                         ('Slow', 'Bitcoin'), "Records not in urls order !")
+
+    def test_timeout(self):
+        slow = self.serve(delay=2)
+        fast = self.serve()
+
+        records = Scraper(urls=[slow.url, fast.url], timeout=0.5).start()
+
+        self.assertEqual(len(records), 830,
+                         "Pages done before timeout not returned !")
+
+
+class TestScraperService(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'rb') as f:
+            self.server = PageServer(f.read(), delay=0.1)
+
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        self.service = ScraperService(
+            urls=[self.server.url],
+            cache=ResponseCache(tempfile.mkdtemp(dir=TEST_DIR)))
+        self.addCleanup(self.service.stop)
+
+    def loop_threads(self):
+        return [thread for thread in threading.enumerate()
+                if thread.name == 'scraper-service']
+
+    def test_shared_loop(self):
+        self.service.start()
+        session = self.service.scraper.session
+        counts = []
+
+        def scrape():
+            counts.append(len(self.service.scrape()))
+
+        threads = [Thread(target=scrape) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(counts, [830] * 4, "Wrong scraped records !")
+        self.assertEqual(len(self.loop_threads()), 1,
+                         "Loop thread started twice !")
+        self.assertIs(self.service.scraper.session, session,
+                      "Session not shared !")
+        self.assertGreater(self.server.max_active, 1,
+                           "Jobs not run concurrently !")
+        self.assertEqual(self.service.total_stats.requests, 4,
+                         "Wrong total stats !")
+
+    def test_stop_restart(self):
+        self.assertEqual(len(self.service.scrape()), 830,
+                         "Wrong scraped records !")
+
+        session = self.service.scraper.session
+        self.service.stop()
+
+        self.assertFalse(self.service.running, "Service still running !")
+        self.assertTrue(session.closed, "Session not closed !")
+        self.assertEqual(self.loop_threads(), [], "Loop thread left !")
+
+        self.assertEqual(len(self.service.scrape()), 830,
+                         "Service not restarted !")
+        self.assertIsNot(self.service.scraper.session, session,
+                         "Closed session reused !")
+
+
+class TestApiKeyCache(unittest.TestCase):
+
+    def test_unknown_keys(self):
+        calls = []
+
+        def loader(api_key):
+            calls.append(api_key)
+            return api_key == 'valid'
+
+        keys = ApiKeyCache(loader, max_size=2, negative_size=2)
+
+        self.assertTrue(keys.check('valid'), "Valid key rejected !")
+        for n in range(10):
+            self.assertFalse(keys.check('wrong{0}'.format(n)),
+                             "Wrong key accepted !")
+
+        self.assertTrue(keys.check('valid'), "Valid key rejected !")
+        self.assertEqual(calls.count('valid'), 1,
+                         "Valid key evicted by wrong keys !")
+
+        keys.check('wrong9')
+        self.assertEqual(calls.count('wrong9'), 1,
+                         "Wrong key not cached !")
+        self.assertEqual(keys.requests('valid'), 2, "Wrong requests count !")
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(dir=TEST_DIR), 'lock')
+
+    def wait_for(self, check, timeout=5):
+        deadline = time.time() + timeout
+        while not check() and time.time() < deadline:
+            time.sleep(0.01)
+
+        return check()
+
+    def test_file_lock(self):
+        first = FileLock(self.path)
+        second = FileLock(self.path)
+
+        self.assertTrue(first.acquire(), "Lock not acquired !")
+        self.assertFalse(second.acquire(), "Lock held twice !")
+
+        first.release()
+        self.assertTrue(second.acquire(), "Released lock not acquired !")
+        second.release()
+
+    def test_standby_takeover(self):
+        runs = {'active': 0, 'standby': 0}
+        active = Scheduler(self.path, lock_retry=0.05, tick=0.01)
+        standby = Scheduler(self.path, lock_retry=0.05, tick=0.01)
+
+        for name, scheduler in (('active', active), ('standby', standby)):
+            scheduler.every(0.02, lambda name=name: runs.update(
+                {name: runs[name] + 1}), name='job', jitter=0)
+
+        try:
+            active.start()
+            self.assertTrue(self.wait_for(lambda: runs['active'] > 1),
+                            "Jobs not run by lock owner !")
+
+            standby.start()
+            time.sleep(0.2)
+            self.assertFalse(standby.active, "Two active schedulers !")
+            self.assertEqual(runs['standby'], 0, "Standby runs jobs !")
+
+            active.stop()
+            self.assertTrue(self.wait_for(lambda: runs['standby'] > 1),
+                            "Standby didn't take over !")
+            self.assertTrue(standby.active, "Standby not active !")
+
+        finally:
+            active.stop()
+            standby.stop()
+
+
+class TestBatch(AppTestCase):
+
+    def url(self):
+        return '/api/{0}/currency/batch/'.format(self.key)
+
+    def test_add_currencies_pairs(self):
+        count = add_currencies([('PairCoin', 'pc'),
+                                (self.batch.names[0], 'BTC'),
+                                ('PairCoin', 'PC')])
+
+        self.assertEqual(count, 1, "Wrong added currencies count !")
+        self.assertEqual(currency_ids(['paircoin']).keys(), {'paircoin'},
+                         "Currency from pair not added !")
+
+    def test_json_errors(self):
+        items = [{'name': 'NewCoin', 'symbol': 'new',
+                  'info': {'price': '$1.5',
+                           'date_time': '2017-06-02 10:00:00'}},
+                 {'symbol': 'NONAME'},
+                 {'name': 'BadDate', 'symbol': 'BAD',
+                  'info': {'date_time': '02.06.2017'}},
+                 'not object',
+                 {'name': self.batch.names[0], 'symbol': 'BTC'}]
+
+        data = self.client.post(self.url(), json=items).get_json()
+
+        self.assertEqual((data['items'], data['errors']), (5, 3),
+                         "Wrong items / errors count !")
+        self.assertEqual([row['status'] for row in data['data']],
+                         ['added', 'ERROR', 'ERROR', 'ERROR', 'exists'],
+                         "Wrong item statuses !")
+        self.assertEqual(data['data'][1]['error'], 'No name or symbol field',
+                         "Wrong error message !")
+        self.assertEqual(currency_ids(['newcoin', 'baddate']).keys(),
+                         {'newcoin'}, "Error item saved !")
+
+    def test_ndjson_errors(self):
+        body = '\n'.join([
+            '{"name": "LineCoin", "symbol": "LC", "info": '
+            '[{"price": 2, "date_time": "2017-06-02 10:00:00"}, '
+            '{"price": 3, "date_time": "2017-06-02 10:10:00"}]}',
+            '{broken json',
+            '',
+            '{"name": "NoInfo", "symbol": "NI", "info": 5}'])
+
+        data = self.client.post(self.url(), data=body,
+                                content_type='application/x-ndjson')\
+            .get_json()
+
+        self.assertEqual((data['items'], data['errors']), (3, 2),
+                         "Wrong items / errors count !")
+        self.assertEqual([row['error'] for row in data['data'][1:]],
+                         ['Item must be JSON object',
+                          'Info must be object or list'],
+                         "Wrong error rows !")
+        self.assertEqual(data['data'][0]['info'], 2, "Wrong info count !")
+
+    def test_empty(self):
+        data = self.client.post(self.url(), json=[]).get_json()
+
+        self.assertIn('ERROR', data, "Empty batch accepted !")
+
+
+class TestSnapshotBatch(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_coin.html', 'r') as f:
+            self.records = scraper.parse(f.read())
+
+        self.batch = SnapshotBatch.from_records(self.records)
+
+    def test_record(self):
+        rec = self.batch[0]
+
+        self.assertIsInstance(rec, CoinRecord, "Row is not CoinRecord !")
+        self.assertEqual((rec.name, rec.symbol, rec.price, rec.perc_1h),
+                         ('Bitcoin', 'BTC', 2202.43, -2.49),
+                         "Wrong record values !")
+        self.assertEqual(rec[3], rec.price, "Wrong record by position !")
+        self.assertEqual(rec[:2], ('Bitcoin', 'BTC'), "Wrong record slice !")
+        self.assertEqual(len(rec), 9, "Record size not 9 !")
+
+    def test_round_trip(self):
+        records = list(self.batch)
+
+        self.assertEqual(len(self.batch), 830, "Wrong rows count !")
+        self.assertEqual(SnapshotBatch.from_records(records), self.batch,
+                         "Batch from records differs !")
+        self.assertEqual(SnapshotBatch.from_records(
+            [rec.as_tuple() for rec in records]), self.batch,
+            "Batch from tuples differs !")
+        self.assertEqual(SnapshotBatch.from_json(self.batch.as_json()),
+                         self.batch, "Batch from JSON differs !")
+
+    def test_unknown_values(self):
+        batch = SnapshotBatch.from_records(
+            [('Coin', 'CN', '?', '$1.5', None, '$10', '?', '1%', '2%')])
+        rec = batch[0]
+
+        self.assertEqual((rec.market_cap, rec.cs, rec.perc_1h),
+                         (None, None, None), "Unknown value is not None !")
+        self.assertEqual(batch.value_rows(),
+                         [(None, 1.5, None, 10.0, None, 1.0, 2.0)],
+                         "Wrong value rows !")
+        self.assertEqual(list(batch)[0], rec, "Iter and index differ !")
+
+    def test_take_sorted(self):
+        top = self.batch.sorted('price', reverse=True)[:3]
+        prices = [rec.price for rec in top]
+
+        self.assertEqual(prices, sorted(prices, reverse=True),
+                         "Batch not sorted !")
+        self.assertEqual(top[0].price,
+                         max(rec.price for rec in self.batch
+                             if rec.price is not None),
+                         "Wrong max price !")
+        self.assertEqual(self.batch.take([0]).names, ['Bitcoin'],
+                         "Wrong taken rows !")
@@ -1,8 +1,9 @@
+import sys
 import logging
 
 from datetime import datetime
 from scraper import Scraper
-from saver import ExcelDS
+from saver import open_saver
 
 
 __author__ = "Andrew Gafiychuk!"
@@ -12,15 +13,34 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     logging.debug("[+] App started...")
 
+    # File type by extension: .xls, .xlsx, .csv, .tsv
+    # Name with date format adds snapshot to series of files,
+    # second param - max count of files to keep:
+    #     python main.py "coins-{0:%Y-%m-%d}.csv" 7
+    file_name = sys.argv[1] if len(sys.argv) > 1 else 'test.xls'
+    sheet_name = 'Data for {0:%Y-%m-%d-%H-%M-%S}'.format(datetime.now())
+
+    keep = sys.argv[2] if len(sys.argv) > 2 else None
+    if keep is not None:
+        if '{' not in file_name or not keep.isdigit() or int(keep) < 1:
+            print("[+] Files count to keep must be positive number "
+                  "and file name must have date format.")
+            sys.exit(1)
+
+        keep = int(keep)
+
     scraper = Scraper()
-    data_list = scraper.start()
 
-    print("Data size: {0}".format(len(data_list)))
+    # Records saved while page is downloading, no data list in memory.
+    saver = open_saver(file_name, sheet_name, keep=keep)
 
-    file_name = 'test.xls'
-    sheet_name = 'Data for {0:%Y-%m-%d-%H-%M-%S}'.format(datetime.now())
+    try:
+        count = saver.write_data(scraper.records())
+
+    except ValueError as err:
+        print("[+] {0}".format(err))
+        sys.exit(1)
 
-    ecl = ExcelDS(file_name, sheet_name)
-    ecl.write_data(data_list)
+    print("Data size: {0}".format(count))
 
     logging.debug("[+] App complete!!!")
@@ -1,60 +1,114 @@
+import os
+import csv
+import glob
 import xlwt
 
+from datetime import datetime
+from itertools import islice
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
 
 __author__ = "Andrew Gafiychuk"
 
 
+HEADER = ['Name', 'Symbol', 'Market Cap',
+          'Price', 'Circulating Supply',
+          'Volume(24h)', '% 1h', '% 24h', '% 7d']
+
+MONEY_FORMAT = '_("$"* #,##0.00_);_("$"* (#,##0.00);_("$"* "-"??_);_(@_)'
+PERC_FORMAT = '0.00%'
+
+# Excel limit for sheet name length.
+SHEET_NAME_LEN = 31
+
+
+def sheet_title(sheet_name, part):
+    """
+    Sheet name for part of data (rollover to new sheet).
+    "Data", "Data (2)", ... cut to Excel limit.
+
+    """
+    if part == 1:
+        return sheet_name[:SHEET_NAME_LEN]
+
+    suffix = ' ({0})'.format(part)
+
+    return sheet_name[:SHEET_NAME_LEN - len(suffix)] + suffix
+
+
 class ExcelDS(object):
     """
     Class that implement some methods to work with
     Excel file format.
     Takes Scraper data and save it in .xls file.
-    
+    Data over .xls rows limit continued on next sheets.
+
     """
+    MAX_ROWS = 65536
+
     def __init__(self, file_name, sheet_name):
         """
         Constructor.
         Init some file params as file_name and sheet_name.
         Create WorkBook and Worksheet.
-        
+
         """
         self.file = file_name
         self.sheet = sheet_name
 
         self.wb = xlwt.Workbook()
-        self.ws = self.wb.add_sheet(self.sheet)
+        self.ws = None
+
+        self.style0 = xlwt.easyxf(num_format_str='general')
+        self.style1 = xlwt.easyxf(num_format_str=MONEY_FORMAT)
+        self.style2 = xlwt.easyxf(num_format_str=PERC_FORMAT)
+
+        self.styles = [self.style0] * 2 + [self.style1] * 4 + \
+                      [self.style2] * 3
+
+    def _add_sheet(self, part):
+        """
+        Private method, add sheet with header.
+
+        """
+        self.ws = self.wb.add_sheet(sheet_title(self.sheet, part))
+
+        header = self.ws.row(0)
+        for n, name in enumerate(HEADER):
+            header.write(n, name)
 
     def write_data(self, data_list):
         """
-        Method that takes list of data from scraper and save it
-        in file.
+        Method that takes list (or any iterable) of data
+        from scraper and save it in file.
+        Return count of saved records.
 
         """
+        count = 0
+
         try:
-            style0 = xlwt.easyxf(num_format_str='general')
-            style1 = xlwt.easyxf(
-                num_format_str='_("$"* #,##0.00_);'
-                               '_("$"* (#,##0.00);'
-                               '_("$"* "-"??_);_(@_)')
-            style2 = xlwt.easyxf(num_format_str='0.00%')
-
-            header_name = ['Name', 'Symbol', 'Market Cap',
-                           'Price', 'Circulating Supply',
-                           'Volume(24h)', '% 1h', '% 24h', '% 7d']
-
-            for n, header in enumerate(header_name):
-                self.ws.write(0, n, header)
-
-            for n, record in enumerate(data_list, 1):
-                self.ws.write(n, 0, record[0], style0)
-                self.ws.write(n, 1, record[1], style0)
-                self.ws.write(n, 2, record[2], style1)
-                self.ws.write(n, 3, record[3], style1)
-                self.ws.write(n, 4, record[4], style1)
-                self.ws.write(n, 5, record[5], style1)
-                self.ws.write(n, 6, record[6], style2)
-                self.ws.write(n, 7, record[7], style2)
-                self.ws.write(n, 8, record[8], style2)
+            part = 1
+            row_n = self.MAX_ROWS
+
+            for record in data_list:
+                if row_n == self.MAX_ROWS:
+                    self._add_sheet(part)
+                    part += 1
+                    row_n = 1
+
+                row = self.ws.row(row_n)
+                for n, value in enumerate(record):
+                    row.write(n, value, self.styles[n])
+
+                row_n += 1
+                count += 1
+
+            if self.ws is None:
+                self._add_sheet(part)
 
             self.data_saving()
 
@@ -64,6 +118,8 @@ class ExcelDS(object):
             print("[+] Data save error...\n"
                   "{0}".format(err))
 
+        return count
+
     def data_saving(self):
         """
         Save data method.
@@ -71,3 +127,265 @@ class ExcelDS(object):
 
         """
         self.wb.save(self.file)
+
+
+class XlsxDS(object):
+    """
+    Streaming .xlsx saver.
+    Workbook opened in xlsxwriter constant memory mode: each row
+    flushed to disk when next one started, so memory doesn't grow
+    with data size. Data over sheet rows limit continued on
+    next sheets.
+
+    """
+    MAX_ROWS = 1048576
+
+    def __init__(self, file_name, sheet_name):
+        """
+        Constructor.
+
+        """
+        if xlsxwriter is None:
+            raise RuntimeError('.xlsx save needs xlsxwriter package')
+
+        self.file = file_name
+        self.sheet = sheet_name
+
+        self.wb = xlsxwriter.Workbook(self.file, {'constant_memory': True})
+        self.ws = None
+
+        self.money = self.wb.add_format({'num_format': MONEY_FORMAT})
+        self.perc = self.wb.add_format({'num_format': PERC_FORMAT})
+
+    def _add_sheet(self, part):
+        """
+        Private method, add sheet with header and column formats.
+
+        """
+        self.ws = self.wb.add_worksheet(sheet_title(self.sheet, part))
+
+        self.ws.set_column(0, 1, 16)
+        self.ws.set_column(2, 5, 20, self.money)
+        self.ws.set_column(6, 8, 10, self.perc)
+
+        self.ws.write_row(0, 0, HEADER)
+
+    def write_data(self, data_list):
+        """
+        Takes iterable of data from scraper, write each record
+        as one row and close workbook.
+        Return count of saved records.
+
+        """
+        count = 0
+
+        try:
+            part = 1
+            row_n = self.MAX_ROWS
+
+            for record in data_list:
+                if row_n == self.MAX_ROWS:
+                    self._add_sheet(part)
+                    part += 1
+                    row_n = 1
+
+                self.ws.write_row(row_n, 0, record)
+
+                row_n += 1
+                count += 1
+
+            if self.ws is None:
+                self._add_sheet(part)
+
+            self.wb.close()
+
+            print("[+] Data saved success !!!")
+
+        except Exception as err:
+            print("[+] Data save error...\n"
+                  "{0}".format(err))
+
+        return count
+
+
+class CsvDS(object):
+    """
+    CSV / TSV saver. Records written by chunks with writerows,
+    no limit for rows count.
+    In append mode rows added to end of existing file (header
+    written only to new file), saved data is not touched.
+    If timestamp set, it is written in first "Date" column.
+
+    """
+    CHUNK = 1000
+
+    def __init__(self, file_name, sheet_name=None, delimiter=',',
+                 append=False, timestamp=None):
+        """
+        Constructor.
+        sheet_name not used, kept for same interface as ExcelDS.
+
+        """
+        self.file = file_name
+        self.delimiter = delimiter
+        self.append = append
+        self.timestamp = timestamp
+
+    def write_data(self, data_list):
+        """
+        Takes iterable of data from scraper and write it to file.
+        Return count of saved records.
+
+        """
+        count = 0
+
+        header = HEADER
+        data_list = iter(data_list)
+
+        if self.timestamp is not None:
+            date = '{0:%Y-%m-%d %H:%M:%S}'.format(self.timestamp)
+            header = ['Date'] + HEADER
+            data_list = ((date,) + tuple(record) for record in data_list)
+
+        try:
+            new_file = not self.append or not os.path.exists(self.file) \
+                or not os.path.getsize(self.file)
+
+            with open(self.file, 'a' if self.append else 'w',
+                      newline='', encoding='utf-8') as f:
+                writer = csv.writer(f, delimiter=self.delimiter)
+
+                if new_file:
+                    writer.writerow(header)
+
+                while True:
+                    chunk = list(islice(data_list, self.CHUNK))
+                    if not chunk:
+                        break
+
+                    writer.writerows(chunk)
+                    count += len(chunk)
+
+            print("[+] Data saved success !!!")
+
+        except Exception as err:
+            print("[+] Data save error...\n"
+                  "{0}".format(err))
+
+        return count
+
+
+class SnapshotDS(object):
+    """
+    Saver for series of snapshots, saved data never re-read
+    or re-written.
+    file_pattern - file name with snapshot date format:
+        "coins-{0:%Y-%m-%d}.csv" - all snapshots of a day in one
+        CSV / TSV file, rows appended with Date column;
+        "coins-{0:%Y-%m-%d-%H-%M-%S}.xlsx" - Excel file for each
+        snapshot (.xls / .xlsx can't be appended).
+    keep - max count of files, oldest removed (None - keep all).
+
+    """
+    def __init__(self, file_pattern, keep=None):
+        """
+        Constructor.
+
+        """
+        self.pattern = file_pattern
+        self.keep = keep
+
+        ext = os.path.splitext(file_pattern)[1].lower()
+        self.rows_mode = ext in ('.csv', '.tsv')
+        self.delimiter = '\t' if ext == '.tsv' else ','
+
+    def write_data(self, data_list, date_t=None):
+        """
+        Save snapshot taken at date_t (now by default).
+        Return count of saved records.
+
+        """
+        date_t = date_t or datetime.now()
+        file_name = self.pattern.format(date_t)
+
+        if self.rows_mode:
+            saver = CsvDS(file_name, delimiter=self.delimiter,
+                          append=True, timestamp=date_t)
+        else:
+            if os.path.exists(file_name):
+                raise ValueError('Snapshot file exists: {0}. Add time '
+                                 'to file pattern.'.format(file_name))
+
+            sheet_name = 'Data for {0:%Y-%m-%d-%H-%M-%S}'.format(date_t)
+            saver = open_saver(file_name, sheet_name)
+
+        count = saver.write_data(data_list)
+        self.rotate()
+
+        return count
+
+    def files(self):
+        """
+        Return files of series, oldest first (by date in name).
+        Only names with date in pattern format are selected,
+        other files matched by "<prefix>*<suffix>" are not touched.
+
+        """
+        prefix, _, rest = self.pattern.partition('{')
+        spec, _, suffix = rest.partition('}')
+        date_format = spec.partition(':')[2]
+
+        files = []
+        for file_name in glob.glob(glob.escape(prefix) + '*' +
+                                   glob.escape(suffix)):
+            date = file_name[len(prefix):len(file_name) - len(suffix)]
+
+            try:
+                if date_format:
+                    date_t = datetime.strptime(date, date_format)
+                else:
+                    date_t = datetime.fromisoformat(date)
+
+            except ValueError:
+                continue
+
+            files.append((date_t, file_name))
+
+        return [file_name for _, file_name in sorted(files)]
+
+    def rotate(self):
+        """
+        Remove oldest files over keep limit.
+
+        """
+        if not self.keep:
+            return
+
+        files = self.files()
+        for file_name in files[:max(len(files) - self.keep, 0)]:
+            os.remove(file_name)
+
+
+def open_saver(file_name, sheet_name, keep=None):
+    """
+    Return saver for file by its extension:
+    .xls, .xlsx, .csv or .tsv.
+    File name with date format ("{0:%Y-%m-%d}") - SnapshotDS,
+    keep - its max count of files (not allowed for other savers).
+
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+
+    if '{' in file_name:
+        return SnapshotDS(file_name, keep)
+    if keep is not None:
+        raise ValueError('Files count to keep is used only with file '
+                         'name date format: {0}'.format(file_name))
+    if ext == '.xlsx':
+        return XlsxDS(file_name, sheet_name)
+    if ext == '.csv':
+        return CsvDS(file_name, sheet_name)
+    if ext == '.tsv':
+        return CsvDS(file_name, sheet_name, delimiter='\t')
+
+    return ExcelDS(file_name, sheet_name)
@@ -3,7 +3,7 @@ import asyncio
 import aiohttp
 import sys
 
-from lxml import html
+from lxml import html, etree
 
 
 __author__ = "Andrew Gafiychuk"
@@ -17,14 +17,14 @@ class Scraper(object):
     price, circulating supply, volume(24h), change in %(24h)
     
     """
-    def __init__(self):
+    def __init__(self, url=None):
         """
         Constructor.
         
         """
         logging.debug("[+] Scraper initial...")
 
-        self.url = "https://coinmarketcap.com/all/views/all/"
+        self.url = url or "https://coinmarketcap.com/all/views/all/"
         self.session = None
 
     async def _init_session(self):
@@ -81,6 +81,39 @@ class Scraper(object):
 
             logging.debug("[+] Scrap complete!!!")
 
+    def records(self):
+        """
+        Generator of records for sync code (file savers).
+        Page downloaded and parsed by chunks, each record
+        yielded as soon as its table row parsed, so page and
+        results are never kept in memory.
+        
+        """
+        logging.debug("[+] Start stream scrap task...")
+
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+
+        event_loop.run_until_complete(self._init_session())
+        stream = self._stream(self.url)
+
+        try:
+            while True:
+                try:
+                    rec = event_loop.run_until_complete(stream.__anext__())
+
+                except StopAsyncIteration:
+                    break
+
+                yield rec
+
+        finally:
+            event_loop.run_until_complete(stream.aclose())
+            event_loop.run_until_complete(self.session.close())
+            event_loop.close()
+
+            logging.debug("[+] Stream scrap complete!!!")
+
     async def _main_task(self):
         """
         Create task and start it.
@@ -115,46 +148,142 @@ class Scraper(object):
             if response.status == 200:
                 page = await response.text()
 
-                res_list = []
-
-                root = html.fromstring(page)
-
-                table = root.xpath(
-                    '//table[@id="currencies-all"]/tbody/tr')
-
-                for n, tr in enumerate(table, 1):
-                    name = tr.xpath(
-                        './/td[@class="no-wrap currency-name"]'
-                        '/a/text()')[0]
-                    symbol = tr.xpath(
-                        './/td[@class="text-left"]'
-                        '/text()')[0]
-                    market_cap = tr.xpath(
-                        './/td[@class="no-wrap market-cap '
-                        'text-right"]'
-                        '/text()')[0].strip()
-                    price = tr.xpath(
-                        './/td[@class="no-wrap text-right"]'
-                        '/a[@class="price"]/text()')[0]
-                    cs = tr.xpath(
-                        './/td[@class="no-wrap text-right"]'
-                        '/a[@target="_blank"]/text() |'
-                        './/td[@class="no-wrap text-right"]'
-                        '/span/text()')[0].strip()
-                    volume = tr.xpath(
-                        './/td[@class="no-wrap text-right "]'
-                        '/a/text()')[0]
-                    changes = tr.xpath(
-                        './/td[starts-with(@class,"no-wrap percent-")]'
-                        '/text() |'
-                        './/td[@class="text-right"]/text()')
-
-                    t = (name, symbol, market_cap, price, cs, volume,
-                         changes[0], changes[1], changes[2])
-
-                    res_list.append(t)
-
-                return res_list
+                return parse_page(page)
             else:
                 logging.error("[+] Response error...\n"
                               "{0}".format(response.status))
+
+    async def _stream(self, url):
+        """
+        Private async generator for GET data from host.
+        Feed response body chunks to incremental parser and
+        yield records while page is downloading.
+        
+        """
+        async with self.session.get(url) as response:
+            if response.status != 200:
+                logging.error("[+] Response error...\n"
+                              "{0}".format(response.status))
+                return
+
+            parser = RowStreamParser(response.charset)
+
+            while True:
+                chunk = await response.content.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                for rec in parser.feed(chunk):
+                    yield rec
+
+            for rec in parser.close():
+                yield rec
+
+
+CHUNK_SIZE = 64 * 1024
+
+ROWS_XPATH = etree.XPath('//table[@id="currencies-all"]/tbody/tr')
+
+
+def parse_row(tr):
+    """
+    Parse one currency table row in a single pass over its cells.
+    Cells are taken by position: rank, name, symbol, market cap,
+    price, circulating supply, volume(24h), % 1h, % 24h, % 7d.
+    Return tuple of 9 fields.
+
+    """
+    cells = tr.findall('td')
+
+    name = cells[1].find('a').text
+    symbol = cells[2].text
+    market_cap = cells[3].text.strip()
+    price = cells[4].find('a').text
+    cs = cells[5].find('*').text.strip()
+    volume = cells[6].find('a').text
+
+    return (name, symbol, market_cap, price, cs, volume,
+            cells[7].text, cells[8].text, cells[9].text)
+
+
+def parse_page(page):
+    """
+    Parse full coinmarketcap page.
+    Return list of tuples (see parse_row).
+
+    """
+    root = html.fromstring(page)
+
+    return [parse_row(tr) for tr in ROWS_XPATH(root)]
+
+
+class RowStreamParser(object):
+    """
+    Incremental parser for coinmarketcap page.
+    Takes page by chunks and return records for each
+    currency row as soon as its </tr> closed.
+    Parsed rows are dropped from tree, so memory stay flat.
+    
+    """
+    def __init__(self, encoding=None):
+        """
+        Constructor.
+        Create lxml pull parser, listen only for rows end.
+        
+        """
+        self.parser = etree.HTMLPullParser(events=('end',), tag='tr',
+                                           encoding=encoding)
+
+    def feed(self, chunk):
+        """
+        Feed next page chunk.
+        Return list of records completed by this chunk.
+        
+        """
+        self.parser.feed(chunk)
+
+        return self._read_rows()
+
+    def close(self):
+        """
+        Finish parsing.
+        Return list of rest records.
+        
+        """
+        self.parser.close()
+
+        return self._read_rows()
+
+    def _read_rows(self):
+        """
+        Private method for parse finished currency rows
+        and free them.
+        
+        """
+        res_list = []
+
+        for _, tr in self.parser.read_events():
+            if not is_currency_row(tr):
+                continue
+
+            res_list.append(parse_row(tr))
+
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+
+        return res_list
+
+
+def is_currency_row(tr):
+    """
+    Check row is in <table id="currencies-all"><tbody>.
+    
+    """
+    tbody = tr.getparent()
+    if tbody is None or tbody.tag != 'tbody':
+        return False
+
+    table = tbody.getparent()
+
+    return table is not None and table.get('id') == 'currencies-all'
@@ -0,0 +1,248 @@
+from time import monotonic
+from hashlib import sha1
+from datetime import datetime, timezone
+from threading import Lock
+from collections import OrderedDict, Counter
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Marker for missing cache value (None is valid value).
+MISSING = object()
+
+# Last-Modified for empty DB.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class TTLCache(object):
+    """
+    Simple process local cache.
+    Bounded by max_size with LRU eviction, each value
+    expires after ttl seconds. Thread safe.
+
+    """
+    def __init__(self, max_size=1024, ttl=300):
+        """
+        Constructor.
+
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Return cached value or default if missing or expired.
+
+        """
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+
+            value, expires = item
+            if expires < monotonic():
+                del self.data[key]
+                return default
+
+            self.data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        """
+        Put value in cache, evict least recently used if full.
+
+        """
+        with self.lock:
+            self.data[key] = (value, monotonic() + self.ttl)
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ApiKeyCache(object):
+    """
+    REST API keys cache.
+    Keep result of key check for ttl seconds, so API auth doesn't
+    go to DB on each request. Unknown keys kept in separate smaller
+    cache with shorter ttl, so requests with random keys can't
+    evict valid ones.
+    Count requests for each valid key.
+
+    """
+    def __init__(self, loader, max_size=1024, ttl=300, negative_size=256,
+                 negative_ttl=30):
+        """
+        Constructor.
+        loader - function(api_key) -> bool, check key in DB.
+
+        """
+        self.loader = loader
+        self.keys = TTLCache(max_size, ttl)
+        self.unknown = TTLCache(negative_size, negative_ttl)
+
+        self.counters = Counter()
+        self.lock = Lock()
+
+    def check(self, api_key):
+        """
+        Check API key is valid and count request.
+
+        """
+        valid = self.keys.get(api_key)
+
+        if valid is None and self.unknown.get(api_key) is None:
+            valid = self.loader(api_key)
+
+            if valid:
+                self.keys.set(api_key, True)
+            else:
+                self.unknown.set(api_key, True)
+
+        if valid:
+            with self.lock:
+                self.counters[api_key] += 1
+
+        return bool(valid)
+
+    def invalidate(self, api_key=None):
+        """
+        Drop cached check for api_key, or all keys if None.
+        Call it when users added or deleted.
+
+        """
+        if api_key is None:
+            self.keys.clear()
+            self.unknown.clear()
+        else:
+            self.keys.pop(api_key)
+            self.unknown.pop(api_key)
+
+    def requests(self, api_key):
+        """
+        Return count of requests for api_key.
+
+        """
+        with self.lock:
+            return self.counters[api_key]
+
+
+def http_date_of(date):
+    """
+    Return DB date (naive, local time as written by datetime.now())
+    as aware UTC datetime without microseconds, for HTTP dates.
+
+    """
+    if date is None:
+        return EPOCH
+
+    return date.replace(microsecond=0).astimezone(timezone.utc)
+
+
+class SnapshotCache(object):
+    """
+    Cache for data that changes only with new snapshot in DB
+    (currency list, latest quotes).
+    Values loaded on miss and kept until ttl or DB state change.
+    state_loader() -> (state, last_modified) reads DB state
+    (max ids, counts, last date). It is checked at most once in
+    state_ttl seconds: if state changed (write by any process),
+    cached values dropped.
+    ETag built from state, so it is same in all workers and
+    conditional requests are answered without loading data.
+    Last-Modified is aware UTC datetime (see http_date_of).
+    Call invalidate() after own writes to check state at once.
+
+    """
+    def __init__(self, state_loader, max_size=2048, ttl=600, state_ttl=10):
+        """
+        Constructor.
+
+        """
+        self.items = TTLCache(max_size, ttl)
+
+        self.state_loader = state_loader
+        self.state_ttl = state_ttl
+        self.state = MISSING
+        self.checked = None
+        self.etag = None
+        self.last_modified = None
+        self.lock = Lock()
+
+    def refresh(self):
+        """
+        Load DB state if it is older than state_ttl.
+        On change drop cached values and set new validators.
+
+        """
+        now = monotonic()
+
+        with self.lock:
+            if self.checked is not None and \
+                    now - self.checked < self.state_ttl:
+                return
+
+        state, modified = self.state_loader()
+
+        with self.lock:
+            self.checked = now
+
+            if state == self.state:
+                return
+
+            self.items.clear()
+
+            self.state = state
+            self.etag = sha1(repr(state).encode('utf-8')).hexdigest()[:16]
+            self.last_modified = http_date_of(modified)
+
+    def validators(self):
+        """
+        Return (etag, last_modified) of current DB state.
+
+        """
+        self.refresh()
+
+        with self.lock:
+            return self.etag, self.last_modified
+
+    def get(self, key, loader):
+        """
+        Return cached value or load it with loader() and cache.
+        loader must return plain data, not ORM objects.
+
+        """
+        self.refresh()
+
+        value = self.items.get(key, MISSING)
+
+        if value is MISSING:
+            value = loader()
+            self.items.set(key, value)
+
+        return value
+
+    def invalidate(self):
+        """
+        Drop all cached values, DB state checked on next access.
+
+        """
+        with self.lock:
+            self.items.clear()
+            self.checked = None
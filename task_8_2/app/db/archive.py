@@ -0,0 +1,249 @@
+import os
+import sys
+
+from datetime import datetime
+from sqlalchemy import text, bindparam, MetaData
+
+from app.db.models import db, Currency, Info, Candle
+from app.db.ingest import IN_CHUNK
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Cold storage is separate SQLite file with copy of currency
+# and info tables, attached to main DB connection.
+# Archived rows get own ids (main ids may be reused), currencies
+# matched by name.
+ARCHIVE_TABLES = [Currency.__table__, Info.__table__]
+
+ARCHIVE = MetaData()
+
+# Archive tables declared same as main ones (keys, indexes).
+for _table in ARCHIVE_TABLES:
+    _table.to_metadata(ARCHIVE, schema='archive')
+
+
+def _attach(conn, archive_path):
+    """
+    Private function, attach archive DB and create tables in it.
+    Relative path is taken from main DB file folder.
+    Columns added to main tables later are added to old
+    archive tables too.
+
+    """
+    if not os.path.isabs(archive_path):
+        archive_path = os.path.join(
+            os.path.dirname(os.path.abspath(conn.engine.url.database)),
+            archive_path)
+
+    conn.execute(text('ATTACH DATABASE :path AS archive'),
+                 {'path': archive_path})
+
+    ARCHIVE.create_all(conn)
+
+    for table in ARCHIVE.tables.values():
+        columns = set(row[1] for row in conn.execute(text(
+            'PRAGMA archive.table_info({0})'.format(table.name))))
+
+        for column in table.columns:
+            if column.name not in columns:
+                conn.execute(text('ALTER TABLE archive.{0} ADD COLUMN {1} {2}'
+                                  .format(table.name, column.name,
+                                          column.type.compile(conn.dialect))))
+
+
+def _copy_currencies(conn, where, params=None, sql=text):
+    """
+    Private function, copy main currencies (by where condition)
+    which are not in archive yet.
+    Archive currencies matched by name and get own ids, as main
+    id may be reused by new currency after delete.
+    sql - statement factory (text with typed bind params).
+
+    """
+    columns = [column.name for column in Currency.__table__.columns
+               if column.name != 'id']
+
+    rows = conn.execute(sql(
+        'SELECT {0} FROM main.currency WHERE ({1}) AND name NOT IN '
+        '(SELECT name FROM archive.currency)'
+        .format(', '.join(columns), where)), params or {}).fetchall()
+    if not rows:
+        return
+
+    last = conn.execute(text('SELECT max(id) FROM archive.currency'))\
+        .scalar() or 0
+
+    conn.execute(ARCHIVE.tables['archive.currency'].insert(),
+                 [dict(zip(columns, row), id=last + n)
+                  for n, row in enumerate(rows, 1)])
+
+
+def _copy_info_sql(where, until='i.until'):
+    """
+    Private function, INSERT of main Info rows (alias i) into
+    archive, currency_id mapped to archive currency of same name.
+    Archived rows get own ids.
+
+    """
+    columns = [column.name for column in Info.__table__.columns
+               if column.name not in ('id', 'until', 'currency_id')]
+
+    return 'INSERT INTO archive.info (currency_id, until, {0}) ' \
+           'SELECT a.id, {1}, {2} FROM main.info AS i ' \
+           'JOIN main.currency AS c ON c.id = i.currency_id ' \
+           'JOIN archive.currency AS a ON a.name = c.name ' \
+           'WHERE {3}'.format(', '.join(columns), until,
+                              ', '.join('i.' + name for name in columns),
+                              where)
+
+
+def _detach(conn):
+    conn.execute(text('DETACH DATABASE archive'))
+
+
+def delete_currencies(names, archive_path=None, store=None):
+    """
+    Delete currencies by names with all their history and candles.
+    Set-based DELETE's, no ORM objects loaded for history.
+    If archive_path is set, history moved to archive DB first.
+    If store (TimeSeriesStore) is set, currencies dropped from it
+    after commit.
+    Return list of deleted names.
+
+    """
+    names = list(set(name.lower() for name in names))
+    found = {}
+
+    for i in range(0, len(names), IN_CHUNK):
+        found.update(db.session.query(Currency.id, Currency.name).filter(
+            Currency.name.in_(names[i:i + IN_CHUNK])).all())
+
+    if not found:
+        return []
+
+    ids = list(found)
+    conn = db.session.connection()
+
+    if archive_path:
+        _attach(conn, archive_path)
+
+    try:
+        for i in range(0, len(ids), IN_CHUNK):
+            chunk = ids[i:i + IN_CHUNK]
+
+            if archive_path:
+                params = {'id{0}'.format(n): v for n, v in enumerate(chunk)}
+                in_list = ', '.join(':' + key for key in params)
+
+                _copy_currencies(conn, 'id IN ({0})'.format(in_list),
+                                 params)
+                conn.execute(text(_copy_info_sql(
+                    'i.currency_id IN ({0})'.format(in_list))), params)
+
+            Info.query.filter(Info.currency_id.in_(chunk))\
+                .delete(synchronize_session=False)
+            Candle.query.filter(Candle.currency_id.in_(chunk))\
+                .delete(synchronize_session=False)
+            Currency.query.filter(Currency.id.in_(chunk))\
+                .delete(synchronize_session=False)
+
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    finally:
+        if archive_path:
+            _detach(db.session.connection())
+
+    if store is not None:
+        for currency_id in ids:
+            store.drop(currency_id)
+
+    return list(found.values())
+
+
+def archive_history(before, archive_path, store=None):
+    """
+    Move Info rows older than <before> date to archive DB.
+    Run of unchanged values (Info.until) which crosses <before>
+    is split: archived part ends at last snapshot before it,
+    rest stays in main DB as new row from first snapshot
+    at or after <before>.
+    Candles are kept, so charts for old dates still work.
+    If store (TimeSeriesStore) is set, same points removed from it
+    after commit.
+    Return count of moved rows.
+
+    """
+    conn = db.session.connection()
+    _attach(conn, archive_path)
+
+    columns = [column.name for column in Info.__table__.columns
+               if column.name not in ('id', 'date', 'until')]
+    prev_date = '(SELECT max(date) FROM main.snapshot WHERE date < :before)'
+    next_date = '(SELECT min(date) FROM main.snapshot WHERE date >= :before)'
+
+    def sql(statement):
+        return text(statement).bindparams(bindparam('before',
+                                                    type_=db.DateTime))
+
+    try:
+        params = {'before': before}
+
+        _copy_currencies(conn, 'id IN (SELECT currency_id FROM main.info '
+                               'WHERE date < :before)', params, sql)
+
+        # Archived rows, crossing runs cut at last date before.
+        conn.execute(sql(_copy_info_sql(
+            'i.date < :before',
+            until='CASE WHEN i.until IS NULL OR i.until < :before '
+                  'THEN i.until WHEN {0} > i.date THEN {0} END'
+            .format(prev_date))), params)
+
+        # Rest of crossing runs kept as new rows.
+        conn.execute(sql(
+            'INSERT INTO main.info (date, until, {0}) '
+            'SELECT {1}, CASE WHEN until > {1} THEN until END, {0} '
+            'FROM main.info WHERE date < :before AND until >= :before '
+            'ORDER BY id'.format(', '.join(columns), next_date)), params)
+
+        count = Info.query.filter(Info.date < before)\
+            .delete(synchronize_session=False)
+
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    finally:
+        _detach(db.session.connection())
+
+    if store is not None:
+        store.truncate(before)
+
+    return count
+
+
+if __name__ == '__main__':
+    from app.index import app, ts_store
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m app.db.archive <before: %Y-%m-%d>")
+        sys.exit(1)
+
+    with app.app_context():
+        try:
+            date_t = datetime.strptime(sys.argv[1], "%Y-%m-%d")
+            count = archive_history(date_t, app.config['ARCHIVE_DB'],
+                                    store=ts_store)
+
+            print("Done... ({0}) Row's moved to archive !".format(count))
+
+        except Exception as err:
+            print("Archive Error...\n"
+                  "{0}".format(err))
@@ -1,5 +1,6 @@
 from app.index import app
-from app.db.models import db, User, Currency, Info
+from app.db.models import db, User
+from app.db.ingest import add_currencies, ingest_snapshot
 from app.scraper.scraper import Scraper
 
 from datetime import datetime
@@ -51,15 +52,7 @@ if __name__ == '__main__':
         # Add all virtual Currency to DB...
         data = fill_currencys()
         try:
-            for rec in data:
-                if not Currency.query.filter_by(name=rec[0].lower()).first():
-                    currency = Currency(name=rec[0], symbol=rec[1])
-
-                    db.session.add(currency)
-                else:
-                    continue
-
-                db.session.commit()
+            add_currencies(data)
 
         except Exception as err:
             print("Currency data add Error...\n"
@@ -67,27 +60,11 @@ if __name__ == '__main__':
 
         # Add Currency info to DB...
         data_t = datetime.now()
-        count = 0
         try:
-            for rec in data:
-                currency = Currency.query.filter_by(
-                    name=rec[0].lower()).first()
-
-                if not currency:
-                    continue
-
-                info = Info(rec[2], rec[3], rec[4], rec[5],
-                            rec[6], rec[7], rec[8], data_t,
-                            currency=currency)
-
-                currency.info.append(info)
-
-                count += 1
+            count = ingest_snapshot(data, data_t)
 
             print("Done... ({0}) Write's !".format(count))
 
-            db.session.commit()
-
         except Exception as err:
             print("Info data add Error...\n"
                   "{0}".format(err))
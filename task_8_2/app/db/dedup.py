@@ -0,0 +1,147 @@
+import os
+import sys
+
+from sqlalchemy import text
+
+from app.db.models import db, Info, Snapshot
+from app.db.ingest import INFO_VALUES
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+CHUNK = 10000
+
+# Old history has no snapshot records, take them from Info dates.
+# Only dates before first snapshot: later Info dates without
+# snapshot are REST posted records, not scrapes.
+BACKFILL_SQL = """
+INSERT INTO snapshot (date, rows, written)
+SELECT date, COUNT(*), COUNT(*) FROM info
+WHERE (SELECT MIN(date) FROM snapshot) IS NULL
+   OR date < (SELECT MIN(date) FROM snapshot)
+GROUP BY date
+"""
+
+WRITTEN_SQL = """
+UPDATE snapshot
+SET written = (SELECT COUNT(*) FROM info WHERE info.date = snapshot.date)
+"""
+
+RUN_POINTS_SQL = """
+SELECT COUNT(*) FROM info AS i
+JOIN snapshot AS s ON s.date > i.date AND s.date <= i.until
+"""
+
+
+def backfill_snapshots():
+    """
+    Add Snapshot rows for Info dates of old history
+    (before first snapshot, all if there is none).
+    Changes made in session transaction.
+    Return count of added snapshots.
+
+    """
+    return db.session.execute(text(BACKFILL_SQL)).rowcount
+
+
+def compact_history():
+    """
+    Merge repeated Info rows of existing history into runs:
+    row same as previous one of currency at previous snapshot
+    is deleted and previous row <until> extended to its date.
+    Rows of dates without snapshot (REST posted) are not merged.
+    Return count of deleted rows.
+
+    """
+    columns = [getattr(Info, name) for name in INFO_VALUES]
+    query = db.session.query(Info.id, Info.currency_id, Info.date,
+                             Info.until, *columns)\
+        .order_by(Info.currency_id, Info.date, Info.id)
+
+    try:
+        backfill_snapshots()
+
+        snapshots = {row[0]: n for n, row in enumerate(
+            db.session.query(Snapshot.date).order_by(Snapshot.date))}
+
+        head = None
+        runs = {}
+        deleted = []
+
+        for row in query.yield_per(CHUNK):
+            info_id, currency_id, date, until = row[:4]
+            values = tuple(row[4:])
+
+            # Merge only rows of neighbour snapshots, gaps kept.
+            if head and head[1] == currency_id and head[2] == values \
+                    and head[3] in snapshots and date in snapshots \
+                    and snapshots[head[3]] + 1 == snapshots[date]:
+                runs[head[0]] = {'id': head[0], 'until': until or date}
+                head = head[:3] + (until or date,)
+                deleted.append(info_id)
+                continue
+
+            head = (info_id, currency_id, values, until or date)
+
+        db.session.bulk_update_mappings(Info, list(runs.values()))
+
+        for i in range(0, len(deleted), CHUNK):
+            Info.query.filter(Info.id.in_(deleted[i:i + CHUNK]))\
+                .delete(synchronize_session=False)
+
+        db.session.execute(text(WRITTEN_SQL))
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return len(deleted)
+
+
+def storage_report():
+    """
+    Return dict with Info rows stored and history points
+    they represent (saved rows - points not stored).
+    saved_bytes is estimate by DB size per stored row.
+
+    """
+    stored = Info.query.count()
+    saved = db.session.execute(text(RUN_POINTS_SQL)).scalar()
+    points = stored + saved
+
+    report = {'snapshots': Snapshot.query.count(),
+              'stored_rows': stored,
+              'history_points': points,
+              'saved_rows': saved,
+              'saved_perc': round(100.0 * saved / points, 2)
+              if points else 0.0}
+
+    database = db.engine.url.database
+    if database and os.path.exists(database):
+        size = os.path.getsize(database)
+
+        report['db_size'] = size
+        report['saved_bytes'] = int(size * saved / stored) if stored else 0
+
+    return report
+
+
+if __name__ == '__main__':
+    from app.index import app
+
+    with app.app_context():
+        if sys.argv[1:] == ['compact']:
+            try:
+                count = compact_history()
+
+                print("History compacted... ({0}) Row's removed !"
+                      .format(count))
+
+            except Exception as err:
+                print("History compact Error...\n"
+                      "{0}".format(err))
+
+        for key, value in sorted(storage_report().items()):
+            print("{0:<16} {1}".format(key, value))
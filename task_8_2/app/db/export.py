@@ -0,0 +1,250 @@
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+
+import numpy as np
+
+from itertools import islice
+
+from app.db.models import db, Currency, Info, Snapshot
+from app.db.ingest import INFO_VALUES, currency_ids
+from app.db.queries import expand_history
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# History points read from DB and written by chunks.
+CHUNK = 10000
+
+FORMATS = ('npz', 'parquet') if pyarrow else ('npz',)
+
+MIMETYPES = {'npz': 'application/zip',
+             'parquet': 'application/octet-stream'}
+
+COLUMNS = [('currency_id', np.int32), ('date', 'datetime64[us]')] + \
+          [(name, np.float64) for name in INFO_VALUES]
+
+
+def export_cutoff():
+    """
+    Return (last Info id, last snapshot date): export reads history
+    as it was at this moment, rows added and runs extended later
+    are skipped. Same cutoff used for count and for data.
+
+    """
+    last_id = db.session.query(db.func.max(Info.id)).scalar()
+    last_date = db.session.query(db.func.max(Snapshot.date)).scalar()
+
+    return last_id or 0, last_date
+
+
+def history_query(ids=None, cutoff=None):
+    query = Info.query.order_by(Info.currency_id, Info.date, Info.id)
+
+    if ids is not None:
+        query = query.filter(Info.currency_id.in_(ids))
+    if cutoff is not None:
+        query = query.filter(Info.id <= cutoff[0])
+
+    return query
+
+
+def count_points(ids=None, cutoff=None):
+    """
+    Return count of history points: Info rows and snapshot
+    dates of their runs (up to cutoff if set).
+
+    """
+    dates = db.session.query(Snapshot.date).distinct()
+    if cutoff is not None:
+        dates = dates.filter(Snapshot.date <= cutoff[1])
+    dates = dates.subquery()
+
+    rows = db.session.query(db.func.count(Info.id))
+    runs = db.session.query(db.func.count(Info.id))\
+        .join(dates, db.and_(dates.c.date > Info.date,
+                             dates.c.date <= Info.until))
+
+    if ids is not None:
+        rows = rows.filter(Info.currency_id.in_(ids))
+        runs = runs.filter(Info.currency_id.in_(ids))
+    if cutoff is not None:
+        rows = rows.filter(Info.id <= cutoff[0])
+        runs = runs.filter(Info.id <= cutoff[0])
+
+    return rows.scalar() + runs.scalar()
+
+
+def history_chunks(ids=None, cutoff=None):
+    """
+    Read full history from DB by chunks, as of cutoff
+    (export_cutoff(), taken now if not set).
+    Generator of dicts {column: numpy array}, None values as NaN.
+
+    """
+    if cutoff is None:
+        cutoff = export_cutoff()
+
+    points = expand_history(history_query(ids, cutoff).yield_per(CHUNK),
+                            last_date=cutoff[1])
+
+    while True:
+        chunk = list(islice(points, CHUNK))
+        if not chunk:
+            break
+
+        yield {name: np.array([getattr(p, name) for p in chunk], dtype=dtype)
+               for name, dtype in COLUMNS}
+
+
+def export_npz(path, ids=None):
+    """
+    Write history to NumPy .npz archive: one array per column
+    and currencies / names arrays for currency_id's.
+    Columns filled in temp .npy memmaps, so memory is bounded
+    by chunk size.
+    Count and data read as of one cutoff, so rows written while
+    export runs are not counted nor exported. Rows deleted
+    meanwhile (archive) make columns shorter: they are trimmed.
+    Return count of exported points.
+
+    """
+    cutoff = export_cutoff()
+    count = count_points(ids, cutoff)
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+        arrays = {name: np.lib.format.open_memmap(
+            os.path.join(tmp_dir, name + '.npy'), mode='w+',
+            dtype=dtype, shape=(count,)) for name, dtype in COLUMNS}
+
+        pos = 0
+        for chunk in history_chunks(ids, cutoff):
+            size = len(chunk['date'])
+
+            if pos + size > count:
+                raise RuntimeError('History changed while export')
+
+            for name, array in arrays.items():
+                array[pos:pos + size] = chunk[name]
+            pos += size
+
+        for array in arrays.values():
+            array.flush()
+
+        if pos < count:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, name + '.trim.npy'),
+                        array[:pos])
+            del arrays
+
+            for name, _ in COLUMNS:
+                os.replace(os.path.join(tmp_dir, name + '.trim.npy'),
+                           os.path.join(tmp_dir, name + '.npy'))
+            count = pos
+
+        else:
+            del arrays
+
+        query = db.session.query(Currency.id, Currency.name)
+        if ids is not None:
+            query = query.filter(Currency.id.in_(ids))
+        currencies = query.order_by(Currency.id).all()
+
+        np.save(os.path.join(tmp_dir, 'currencies.npy'),
+                np.array([row[0] for row in currencies], dtype=np.int32))
+        np.save(os.path.join(tmp_dir, 'names.npy'),
+                np.array([row[1] for row in currencies], dtype=np.str_))
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as archive:
+            for name in [n for n, _ in COLUMNS] + ['currencies', 'names']:
+                archive.write(os.path.join(tmp_dir, name + '.npy'),
+                              name + '.npy')
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return count
+
+
+def export_parquet(path, ids=None):
+    """
+    Write history to Parquet file, one row group per chunk.
+    Currency names stored in dictionary encoded column.
+    Return count of exported points.
+
+    """
+    names = dict(db.session.query(Currency.id, Currency.name))
+    schema = pyarrow.schema(
+        [('currency', pyarrow.string()), ('date', pyarrow.timestamp('us'))] +
+        [(name, pyarrow.float64()) for name in INFO_VALUES])
+
+    count = 0
+    writer = pyarrow.parquet.ParquetWriter(path, schema,
+                                           compression='snappy')
+
+    try:
+        for chunk in history_chunks(ids):
+            chunk['currency'] = [names.get(currency_id) for currency_id
+                                 in chunk.pop('currency_id').tolist()]
+
+            writer.write_table(pyarrow.Table.from_pydict(chunk, schema))
+            count += len(chunk['date'])
+
+    finally:
+        writer.close()
+
+    return count
+
+
+def export_history(path, fmt='npz', names=None):
+    """
+    Export history of all currencies or selected by names.
+    Return count of exported points.
+    Raise ValueError if format is not available.
+
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Export format not available: {0}'.format(fmt))
+
+    ids = None
+    if names:
+        ids = list(currency_ids(names).values())
+
+    if fmt == 'parquet':
+        return export_parquet(path, ids)
+
+    return export_npz(path, ids)
+
+
+if __name__ == '__main__':
+    from app.index import app
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m app.db.export <file.npz|file.parquet> "
+              "[currency names...]")
+        sys.exit(1)
+
+    out_file = sys.argv[1]
+    fmt = os.path.splitext(out_file)[1].lstrip('.') or 'npz'
+
+    with app.app_context():
+        try:
+            count = export_history(out_file, fmt, sys.argv[2:])
+
+            print("Done... ({0}) Point's exported to {1} !"
+                  .format(count, out_file))
+
+        except Exception as err:
+            print("Export Error...\n"
+                  "{0}".format(err))
@@ -0,0 +1,341 @@
+from datetime import datetime
+from collections import defaultdict
+from sqlalchemy import text, bindparam
+
+from app.db.models import db, Currency, Info, Snapshot
+from app.db.rollup import update_candles
+from app.scraper.normalize import to_number
+from app.scraper.records import SnapshotBatch
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# SQLite limit for host parameters in one statement is 999.
+IN_CHUNK = 500
+
+# REST API info record fields: request key -> Info column.
+INFO_FIELDS = [('mc', 'market_cap'), ('price', 'price'), ('cs', 'cs'),
+               ('volume', 'volume'), ('p1h', 'perc_1h'),
+               ('p24h', 'perc_24h'), ('p7d', 'perc_7d')]
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+INFO_VALUES = [column for _, column in INFO_FIELDS]
+
+# Point added inside unchanged run (Info.until) splits it:
+# rest of run copied as new row from next snapshot date,
+# run closed at last snapshot date before the point.
+SPLIT_REST_SQL = """
+INSERT INTO info (currency_id, date, until, {0})
+SELECT currency_id, :next, CASE WHEN until > :next THEN until END, {0}
+FROM info
+WHERE currency_id = :currency_id AND date < :date AND until >= :date
+  AND until >= :next
+""".format(', '.join(INFO_VALUES))
+
+SPLIT_CLOSE_SQL = """
+UPDATE info SET until = CASE WHEN :prev > date THEN :prev END
+WHERE currency_id = :currency_id AND date < :date AND until >= :date
+"""
+
+
+def currency_ids(names):
+    """
+    Resolve currency names to id's with IN queries.
+    Return dict {name: id} for names that exist in DB.
+
+    """
+    names = list(set(name.lower() for name in names))
+    ids = {}
+
+    for i in range(0, len(names), IN_CHUNK):
+        query = db.session.query(Currency.name, Currency.id).filter(
+            Currency.name.in_(names[i:i + IN_CHUNK]))
+
+        ids.update(query.all())
+
+    return ids
+
+
+def add_currencies(data):
+    """
+    Add new currencies from scraped records (SnapshotBatch or
+    list of records, only name and symbol used) in one transaction.
+    Existing names and duplicates are skipped.
+    Return count of added currencies.
+
+    """
+    if isinstance(data, SnapshotBatch):
+        pairs = list(zip(data.names, data.symbols))
+    else:
+        pairs = [(rec[0], rec[1]) for rec in data]
+
+    existing = currency_ids(name for name, _ in pairs)
+    mappings = {}
+
+    for name, symbol in pairs:
+        name = name.lower()
+
+        if name in existing or name in mappings:
+            continue
+
+        mappings[name] = {'name': name, 'symbol': symbol.upper()}
+
+    try:
+        db.session.bulk_insert_mappings(Currency, list(mappings.values()))
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return len(mappings)
+
+
+def last_values(ids):
+    """
+    Load last Info row of each currency.
+    Return dict {currency_id: (info_id, values, last_date)}.
+
+    """
+    ids = list(ids)
+    last = {}
+
+    for i in range(0, len(ids), IN_CHUNK):
+        latest = db.session.query(
+            Info.currency_id, db.func.max(Info.date).label('date'))\
+            .filter(Info.currency_id.in_(ids[i:i + IN_CHUNK]))\
+            .group_by(Info.currency_id).subquery()
+
+        columns = [getattr(Info, name) for name in INFO_VALUES]
+        query = db.session.query(Info.id, Info.currency_id, Info.date,
+                                 Info.until, *columns)\
+            .join(latest, db.and_(Info.currency_id == latest.c.currency_id,
+                                  Info.date == latest.c.date))
+
+        for row in query:
+            last[row[1]] = (row[0], tuple(row[4:]), row[3] or row[2])
+
+    return last
+
+
+def split_runs(ids, date_t):
+    """
+    Split unchanged runs of currencies (ids) which cover date_t,
+    so point added at date_t doesn't overlap them.
+    Set-based: two statements for all currencies.
+
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return
+
+    prev_date = db.session.query(db.func.max(Snapshot.date))\
+        .filter(Snapshot.date < date_t).scalar()
+    next_date = db.session.query(db.func.min(Snapshot.date))\
+        .filter(Snapshot.date > date_t).scalar()
+
+    params = [{'currency_id': currency_id, 'date': date_t,
+               'prev': prev_date, 'next': next_date} for currency_id in ids]
+
+    for sql in (SPLIT_REST_SQL, SPLIT_CLOSE_SQL):
+        statement = text(sql).bindparams(
+            *[bindparam(name, type_=db.DateTime)
+              for name in ('date', 'prev', 'next') if ':' + name in sql])
+
+        db.session.execute(statement, params)
+
+
+def ingest_snapshot(data, date_t, dedup=True, store=None):
+    """
+    Save scraped snapshot (SnapshotBatch or list of records)
+    as Info rows in one transaction.
+    If dedup, records same as values stored at previous snapshot
+    are not written, last Info row run extended to date_t
+    (Info.until) instead.
+    Price candles refreshed in same transaction.
+    Records for unknown currencies are skipped.
+    Empty snapshot (failed scrape) writes nothing: no Snapshot
+    row, no runs extended.
+    If store (TimeSeriesStore) is set, records appended to it too.
+    Return count of saved records.
+
+    """
+    data = SnapshotBatch.from_records(data)
+    ids = currency_ids(data.names)
+    mappings = []
+
+    for name, values in zip(data.names, data.value_rows()):
+        currency_id = ids.get(name.lower())
+
+        if currency_id is None:
+            continue
+
+        mapping = dict(zip(INFO_VALUES, values))
+        mapping['date'] = date_t
+        mapping['currency_id'] = currency_id
+
+        mappings.append(mapping)
+
+    if not mappings:
+        return 0
+
+    new = mappings
+    unchanged = []
+
+    if dedup:
+        last = last_values(set(m['currency_id'] for m in mappings))
+        new = []
+
+        # Run extended only if currency was in previous snapshot.
+        prev_date = db.session.query(db.func.max(Snapshot.date))\
+            .filter(Snapshot.date < date_t).scalar()
+
+        for m in mappings:
+            values = tuple(m[name] for name in INFO_VALUES)
+            info_id, last_vals, last_date = last.get(m['currency_id'],
+                                                     (None, None, None))
+
+            if info_id and values == last_vals and last_date == prev_date:
+                unchanged.append(info_id)
+                continue
+
+            # Next record of same currency compared with this one.
+            last[m['currency_id']] = (None, values, date_t)
+            new.append(m)
+
+    try:
+        db.session.bulk_insert_mappings(Info, new)
+
+        for i in range(0, len(unchanged), IN_CHUNK):
+            Info.query.filter(Info.id.in_(unchanged[i:i + IN_CHUNK]))\
+                .update({'until': date_t}, synchronize_session=False)
+
+        db.session.add(Snapshot(date=date_t, rows=len(mappings),
+                                written=len(new)))
+        update_candles(mappings, date_t)
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if store is not None:
+        store.append_snapshot(mappings)
+
+    return len(mappings)
+
+
+def validate_item(item):
+    """
+    Validate REST API batch item:
+    {name, symbol, info: {mc, price, cs, volume, p1h, p24h, p7d,
+    date_time} or list of them}.
+    Return (name, symbol, list of Info mappings without currency_id).
+    Raise ValueError with message if item is wrong.
+
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Item must be JSON object')
+
+    name = item.get('name')
+    symbol = item.get('symbol')
+    if not isinstance(name, str) or not isinstance(symbol, str) \
+            or not name or not symbol:
+        raise ValueError('No name or symbol field')
+
+    infos = item.get('info') or []
+    if isinstance(infos, dict):
+        infos = [infos]
+    if not isinstance(infos, list):
+        raise ValueError('Info must be object or list')
+
+    mappings = []
+    for info in infos:
+        if not isinstance(info, dict) or 'date_time' not in info:
+            raise ValueError('No info date_time field')
+
+        try:
+            mapping = {'date': datetime.strptime(info['date_time'],
+                                                 DATE_FORMAT)}
+        except (TypeError, ValueError):
+            raise ValueError('Wrong info date_time: {0}'
+                             .format(info['date_time']))
+
+        for key, column in INFO_FIELDS:
+            mapping[column] = to_number(info.get(key))
+
+        mappings.append(mapping)
+
+    return name.lower(), symbol, mappings
+
+
+def ingest_items(items, store=None):
+    """
+    Batch upsert of currencies with info records in one transaction.
+    Records inside unchanged runs split them (split_runs()).
+    Wrong items are skipped, each item gets own status:
+    {index, name, status: added / exists / ERROR, info, error}.
+    If store (TimeSeriesStore) is set, info added to it too
+    (in one call, so older records rewrite series once).
+    Return list of statuses.
+
+    """
+    statuses = []
+    valid = []
+
+    for n, item in enumerate(items):
+        try:
+            name, symbol, mappings = validate_item(item)
+
+        except ValueError as err:
+            statuses.append({'index': n, 'status': 'ERROR',
+                             'error': str(err)})
+            continue
+
+        status = {'index': n, 'name': name, 'status': 'exists',
+                  'info': len(mappings)}
+
+        statuses.append(status)
+        valid.append((status, symbol, mappings))
+
+    ids = currency_ids(status['name'] for status, _, _ in valid)
+    new = {}
+
+    for status, symbol, _ in valid:
+        if status['name'] not in ids:
+            status['status'] = 'added'
+            new.setdefault(status['name'], {'name': status['name'],
+                                            'symbol': symbol.upper()})
+
+    try:
+        if new:
+            db.session.bulk_insert_mappings(Currency, list(new.values()))
+            ids.update(currency_ids(new))
+
+        by_date = defaultdict(list)
+
+        for status, _, mappings in valid:
+            for mapping in mappings:
+                mapping['currency_id'] = ids[status['name']]
+                by_date[mapping['date']].append(mapping)
+
+        for date_t in sorted(by_date):
+            mappings = by_date[date_t]
+
+            split_runs((m['currency_id'] for m in mappings), date_t)
+            db.session.bulk_insert_mappings(Info, mappings)
+            update_candles(mappings, date_t)
+
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if store is not None:
+        store.append_snapshot([m for date_t in sorted(by_date)
+                               for m in by_date[date_t]])
+
+    return statuses
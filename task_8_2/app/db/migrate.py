@@ -0,0 +1,243 @@
+from sqlalchemy import text
+
+from app.db.models import db, Info
+from app.db.ingest import INFO_VALUES
+from app.db.rollup import rebuild_candles
+from app.db.dedup import backfill_snapshots
+from app.scraper.normalize import to_number
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Indexes declared in models, but missing in DB's created before them.
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_user_apiid ON user (apiid)',
+    'CREATE INDEX IF NOT EXISTS ix_info_currency_date '
+    'ON info (currency_id, date)',
+]
+
+# Columns added to models after DB's were created.
+COLUMNS = [
+    ('info', 'until', 'DATETIME'),
+]
+
+# Tables added to models after DB's were created.
+TABLES = ['snapshot', 'candle']
+
+CHUNK = 10000
+
+
+def add_indexes():
+    """
+    Create missing indexes in existing DB.
+
+    """
+    for sql in INDEXES:
+        db.session.execute(text(sql))
+
+    db.session.commit()
+
+
+def add_columns():
+    """
+    Add missing columns to existing DB.
+    Return count of added columns.
+
+    """
+    count = 0
+
+    for table, column, col_type in COLUMNS:
+        columns = db.session.execute(
+            text('PRAGMA table_info({0})'.format(table))).fetchall()
+
+        if column in [col[1] for col in columns]:
+            continue
+
+        db.session.execute(text('ALTER TABLE {0} ADD COLUMN {1} {2}'
+                                .format(table, column, col_type)))
+        count += 1
+
+    db.session.commit()
+
+    return count
+
+
+def info_is_text():
+    """
+    Check Info values stored as formatted strings (old schema).
+
+    """
+    columns = db.session.execute(text('PRAGMA table_info(info)')).fetchall()
+    types = {col[1]: col[2].upper() for col in columns}
+
+    return types.get('price', '').startswith('VARCHAR')
+
+
+def table_names():
+    """
+    Return names of tables in DB.
+
+    """
+    rows = db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")).fetchall()
+
+    return set(row[0] for row in rows)
+
+
+def needs_migrate():
+    """
+    Check existing DB is older than models: Info values as
+    strings, missing columns or tables.
+    Empty DB (no info table) is not migrated, db_init creates it.
+
+    """
+    tables = table_names()
+    if 'info' not in tables:
+        return False
+
+    if any(table not in tables for table in TABLES):
+        return True
+
+    for table, column, _ in COLUMNS:
+        columns = db.session.execute(
+            text('PRAGMA table_info({0})'.format(table))).fetchall()
+
+        if column not in [col[1] for col in columns]:
+            return True
+
+    return info_is_text()
+
+
+def convert_info():
+    """
+    Rebuild info table with numeric columns.
+    SQLite can't change column type, so old table renamed,
+    new one created from model and rows copied by chunks
+    with values converted to numbers.
+    Return count of converted rows.
+
+    """
+    if not info_is_text():
+        return 0
+
+    columns = ['id'] + INFO_VALUES + ['date', 'currency_id']
+    select = text('SELECT {0} FROM info_old WHERE id > :last '
+                  'ORDER BY id LIMIT :limit'.format(', '.join(columns)))
+    select = select.columns(date=db.DateTime)
+    insert = Info.__table__.insert()
+
+    conn = db.session.connection()
+
+    conn.execute(text('ALTER TABLE info RENAME TO info_old'))
+
+    # Old indexes moved with table, free names for new ones.
+    indexes = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' "
+        "AND tbl_name = 'info_old' AND sql IS NOT NULL")).fetchall()
+    for index in indexes:
+        conn.execute(text('DROP INDEX {0}'.format(index[0])))
+
+    Info.__table__.create(conn)
+
+    count = 0
+    last = 0
+
+    while True:
+        rows = conn.execute(select, {'last': last, 'limit': CHUNK}).fetchall()
+        if not rows:
+            break
+
+        mappings = []
+        for row in rows:
+            rec = dict(zip(columns, row))
+
+            for name in INFO_VALUES:
+                rec[name] = to_number(rec[name])
+
+            mappings.append(rec)
+
+        conn.execute(insert, mappings)
+
+        count += len(rows)
+        last = rows[-1][0]
+
+    conn.execute(text('DROP TABLE info_old'))
+    db.session.commit()
+
+    return count
+
+
+def migrate():
+    """
+    Upgrade existing DB to current models: numeric Info values,
+    indexes, new columns and tables (snapshots and candles filled
+    from history).
+    Each step reported, failed step rolled back.
+
+    """
+    try:
+        count = convert_info()
+
+        print("Info converted to numbers... ({0}) Row's !"
+              .format(count))
+
+    except Exception as err:
+        db.session.rollback()
+
+        print("Info convert Error...\n"
+              "{0}".format(err))
+
+    try:
+        add_indexes()
+
+        print("Indexes added !")
+
+    except Exception as err:
+        db.session.rollback()
+
+        print("Indexes add Error...\n"
+              "{0}".format(err))
+
+    try:
+        count = add_columns()
+
+        print("Columns added... ({0}) !".format(count))
+
+    except Exception as err:
+        db.session.rollback()
+
+        print("Columns add Error...\n"
+              "{0}".format(err))
+
+    # Create new tables (candle, snapshot) and fill them from history.
+    try:
+        db.create_all()
+        count = backfill_snapshots()
+        db.session.commit()
+
+        print("Snapshots backfilled... ({0}) Row's !".format(count))
+
+    except Exception as err:
+        db.session.rollback()
+
+        print("Snapshots backfill Error...\n"
+              "{0}".format(err))
+
+    try:
+        count = rebuild_candles()
+
+        print("Candles rebuilt... ({0}) Row's !".format(count))
+
+    except Exception as err:
+        db.session.rollback()
+
+        print("Candles rebuild Error...\n"
+              "{0}".format(err))
+
+
+if __name__ == '__main__':
+    from app.index import app
+
+    with app.app_context():
+        migrate()
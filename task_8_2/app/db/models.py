@@ -4,6 +4,8 @@ from flask_sqlalchemy import SQLAlchemy
 from random import choice
 from werkzeug.security import generate_password_hash
 
+from app.scraper.normalize import to_number
+
 
 
 db = SQLAlchemy()
@@ -19,7 +21,7 @@ class User(db.Model):
     user_name = db.Column(db.String(128), unique=True)
     email = db.Column(db.Text, unique=True)
     password = db.Column(db.Text)
-    apiid = db.Column(db.String(32))
+    apiid = db.Column(db.String(32), index=True)
 
     def __init__(self, username, email, password):
         self.user_name = username.lower()
@@ -70,17 +72,25 @@ class Info(db.Model):
     """
     Class for describe Currency info ORM table.
     Use at Currensy table as personal info.
+    Values stored as numbers (USD, coins, %), None if unknown.
+    until - last snapshot date with same values (row is not
+    repeated for unchanged snapshots), None if seen once.
     
     """
+    __table_args__ = (
+        db.Index('ix_info_currency_date', 'currency_id', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    market_cap = db.Column(db.String(32))
-    price = db.Column(db.String(32))
-    cs = db.Column(db.String(32))
-    volume = db.Column(db.String(32))
-    perc_1h = db.Column(db.String(32))
-    perc_7d = db.Column(db.String(32))
-    perc_24h = db.Column(db.String(32))
+    market_cap = db.Column(db.Float)
+    price = db.Column(db.Float)
+    cs = db.Column(db.Float)
+    volume = db.Column(db.Float)
+    perc_1h = db.Column(db.Float)
+    perc_7d = db.Column(db.Float)
+    perc_24h = db.Column(db.Float)
     date = db.Column(db.DateTime)
+    until = db.Column(db.DateTime)
 
     currency_id = db.Column(db.Integer, db.ForeignKey('currency.id'))
     currency = db.relationship('Currency',
@@ -88,13 +98,13 @@ class Info(db.Model):
 
     def __init__(self, mc, price, cs, volume,
                  p1h, p24h, p7d, datet, currency):
-        self.market_cap = mc
-        self.price = price
-        self.cs = cs
-        self.volume = volume
-        self.perc_1h = p1h
-        self.perc_24h = p24h
-        self.perc_7d = p7d
+        self.market_cap = to_number(mc)
+        self.price = to_number(price)
+        self.cs = to_number(cs)
+        self.volume = to_number(volume)
+        self.perc_1h = to_number(p1h)
+        self.perc_24h = to_number(p24h)
+        self.perc_7d = to_number(p7d)
         self.date = datet
         self.currency = currency
 
@@ -109,4 +119,61 @@ class Info(db.Model):
                   "p7d": self.perc_7d,
                   "date": self.date}
 
-        return j_data
\ No newline at end of file
+        return j_data
+
+
+class Snapshot(db.Model):
+    """
+    Class for describe scraped snapshots ORM table.
+    rows - records in snapshot, written - new Info rows
+    (others only extended <until> of last Info row).
+    Dates used to restore full history from Info runs.
+    
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.DateTime, index=True)
+    rows = db.Column(db.Integer)
+    written = db.Column(db.Integer)
+
+
+class Candle(db.Model):
+    """
+    Class for describe Currency price candles ORM table.
+    Rollup of Info rows: open/high/low/close price and volume
+    per period bucket (5m, 1h, 1d).
+    Refreshed by ingest, see db/rollup.py.
+    
+    """
+    __table_args__ = (
+        db.Index('ix_candle_currency_period_start',
+                 'currency_id', 'period', 'start', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(3))
+    start = db.Column(db.DateTime)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float)
+    volume_sum = db.Column(db.Float)
+    volume_count = db.Column(db.Integer)
+    first_date = db.Column(db.DateTime)
+    last_date = db.Column(db.DateTime)
+
+    currency_id = db.Column(db.Integer, db.ForeignKey('currency.id'))
+
+    def as_json(self):
+        if self.volume_count:
+            volume = self.volume_sum / self.volume_count
+        else:
+            volume = None
+
+        j_data = {"date": self.start,
+                  "open": self.open,
+                  "high": self.high,
+                  "low": self.low,
+                  "close": self.close,
+                  "volume": volume}
+
+        return j_data
@@ -0,0 +1,237 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import islice
+
+from app.db.models import db, Currency, Info, Snapshot
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Info rows expanded by chunks, one snapshot dates query per chunk.
+EXPAND_CHUNK = 500
+
+
+class SeriesPoint(object):
+    """
+    Info row values at one snapshot date of unchanged run.
+    Other attributes taken from Info row.
+
+    """
+    def __init__(self, info, date):
+        self.info = info
+        self.date = date
+
+    def __getattr__(self, name):
+        return getattr(self.info, name)
+
+    as_json = Info.as_json
+
+
+def info_last_date():
+    """
+    SQL expression: last date of Info row run.
+
+    """
+    return db.func.coalesce(Info.until, Info.date)
+
+
+def snapshot_dates(date_from, date_to):
+    """
+    Return sorted snapshot dates in range (date_from, date_to].
+
+    """
+    query = db.session.query(Snapshot.date).filter(
+        Snapshot.date > date_from, Snapshot.date <= date_to)
+
+    return sorted(set(row[0] for row in query))
+
+
+def expand_history(rows, date_from=None, date_to=None, after=None,
+                   last_date=None):
+    """
+    Restore full series from Info rows ordered by (date, id):
+    row with <until> repeated at each snapshot date of its run.
+    Points clipped to [date_from, date_to) and to points
+    after (date, id) cursor.
+    If last_date is set, runs repeated only at snapshot dates
+    up to it (runs extended later are cut).
+    Generator of Info rows and SeriesPoint's.
+
+    """
+    rows = iter(rows)
+
+    while True:
+        chunk = list(islice(rows, EXPAND_CHUNK))
+        if not chunk:
+            break
+
+        runs = [row for row in chunk if row.until]
+        dates = []
+        if runs:
+            until = max(row.until for row in runs)
+            if last_date and last_date < until:
+                until = last_date
+
+            dates = snapshot_dates(min(row.date for row in runs), until)
+
+        for row in chunk:
+            points = [row]
+
+            if row.until:
+                lo = bisect_right(dates, row.date)
+                hi = bisect_right(dates, row.until)
+                points.extend(SeriesPoint(row, date)
+                              for date in dates[lo:hi])
+
+            for point in points:
+                if date_from and point.date < date_from:
+                    continue
+                if date_to and point.date >= date_to:
+                    continue
+                if after and (point.date, point.id) <= after:
+                    continue
+
+                yield point
+
+
+def encode_cursor(info):
+    """
+    Make keyset cursor from last Info row of page: "<date>_<id>".
+
+    """
+    return '{0}_{1}'.format(info.date.strftime(CURSOR_FORMAT), info.id)
+
+
+def decode_cursor(cursor):
+    """
+    Parse keyset cursor. Raise ValueError if cursor is wrong.
+
+    """
+    date, _, info_id = cursor.rpartition('_')
+
+    return datetime.strptime(date, CURSOR_FORMAT), int(info_id)
+
+
+def history_query(currency_id, date_from=None, date_to=None):
+    """
+    Return query of currency Info rows with runs in date range,
+    ordered by (date, id). Use expand_history() for full series.
+
+    """
+    query = Info.query.filter(Info.currency_id == currency_id)
+
+    if date_from:
+        query = query.filter(info_last_date() >= date_from)
+    if date_to:
+        query = query.filter(Info.date < date_to)
+
+    return query.order_by(Info.date, Info.id)
+
+
+def history_rows(currency_id, date_from=None, date_to=None, chunk=500):
+    """
+    Generator of full currency history in date range,
+    rows read from DB by chunks.
+
+    """
+    query = history_query(currency_id, date_from, date_to)
+
+    return expand_history(query.yield_per(chunk), date_from, date_to)
+
+
+def history_page(currency_id, date_from=None, date_to=None,
+                 limit=100, cursor=None):
+    """
+    Return one page of currency history ordered by (date, id)
+    and cursor for next page (None if it is last page).
+    Keyset pagination on (currency_id, date) index, so page cost
+    doesn't depend on history length.
+
+    """
+    query = history_query(currency_id, date_from, date_to)
+    after = None
+
+    if cursor:
+        after = decode_cursor(cursor)
+        last_date, last_id = after
+
+        query = query.filter(db.or_(
+            info_last_date() > last_date,
+            db.and_(Info.date == last_date, Info.id > last_id)))
+
+    rows = query.limit(limit + 1).all()
+    points = list(islice(expand_history(rows, date_from, date_to, after),
+                         limit + 1))
+
+    if len(points) > limit:
+        return points[:limit], encode_cursor(points[limit - 1])
+
+    if len(rows) > limit and points:
+        return points, encode_cursor(points[-1])
+
+    return points, None
+
+
+def history_stream(currency_id, date_from=None, date_to=None, chunk=500):
+    """
+    Generator of full currency history in date range for slow
+    consumers (streamed responses): read by keyset pages of chunk
+    points, session closed after each page, so no DB cursor or
+    read transaction is held while consumer reads.
+
+    """
+    cursor = None
+
+    while True:
+        points, cursor = history_page(currency_id, date_from, date_to,
+                                      chunk, cursor)
+        db.session.close()
+
+        for point in points:
+            yield point
+
+        if not cursor:
+            break
+
+
+def last_history(currency_id, limit):
+    """
+    Return last <limit> history points ordered by date.
+
+    """
+    rows = Info.query.filter(Info.currency_id == currency_id)\
+        .order_by(Info.date.desc(), Info.id.desc()).limit(limit).all()
+
+    return list(expand_history(rows[::-1]))[-limit:]
+
+
+def snapshot_state():
+    """
+    Return (state, last_modified) of snapshot data for cache
+    validators. State made of currencies count and min/max ids of
+    Info and Snapshot rows (PK index lookups), so it changes with
+    any write, delete or archive done by any process.
+    last_modified - date of last snapshot or Info row.
+
+    """
+    currencies = db.session.query(db.func.count(Currency.id),
+                                  db.func.max(Currency.id)).one()
+    infos = db.session.query(db.func.min(Info.id),
+                             db.func.max(Info.id)).one()
+    snaps = db.session.query(db.func.min(Snapshot.id),
+                             db.func.max(Snapshot.id),
+                             db.func.max(Snapshot.date)).one()
+
+    dates = [snaps[2]]
+    if infos[1] is not None:
+        dates.append(db.session.query(Info.date)
+                     .filter(Info.id == infos[1]).scalar())
+
+    dates = [date for date in dates if date is not None]
+
+    state = tuple(currencies) + tuple(infos) + tuple(snaps[:2])
+
+    return state, max(dates) if dates else None
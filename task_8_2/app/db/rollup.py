@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.db.models import db, Candle
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Candle periods and their length in seconds.
+PERIODS = OrderedDict([('5m', 300), ('1h', 3600), ('1d', 86400)])
+
+EPOCH = datetime(1970, 1, 1)
+
+# Rebuild candles of one period from all Info history in SQL.
+# Info runs expanded to all snapshot dates they cover.
+# Dates bucketed by unix time, open/close taken from first/last
+# row of bucket. Date format same as SQLAlchemy stores in SQLite.
+REBUILD_SQL = """
+WITH series AS (
+    SELECT currency_id, price, volume, date FROM info
+    UNION ALL
+    SELECT i.currency_id, i.price, i.volume, s.date
+    FROM info AS i
+    JOIN snapshot AS s ON s.date > i.date AND s.date <= i.until
+)
+INSERT INTO candle (currency_id, period, start, open, high, low, close,
+                    volume_sum, volume_count, first_date, last_date)
+SELECT g.currency_id, :period,
+       strftime('%Y-%m-%d %H:%M:%S.000000', g.bucket * :step, 'unixepoch'),
+       o.price, g.high, g.low, c.price,
+       g.volume_sum, g.volume_count, g.first_date, g.last_date
+FROM (SELECT currency_id,
+             CAST(strftime('%s', date) AS INTEGER) / :step AS bucket,
+             MAX(price) AS high, MIN(price) AS low,
+             TOTAL(volume) AS volume_sum, COUNT(volume) AS volume_count,
+             MIN(date) AS first_date, MAX(date) AS last_date
+      FROM series
+      WHERE price IS NOT NULL
+      GROUP BY currency_id, bucket) AS g
+JOIN series AS o ON o.currency_id = g.currency_id AND o.date = g.first_date
+JOIN series AS c ON c.currency_id = g.currency_id AND c.date = g.last_date
+GROUP BY g.currency_id, g.bucket
+"""
+
+
+# Merge one snapshot into candles on unique (currency_id, period, start).
+# SET expressions see old row values, excluded is the new one.
+# Run by DB-API executemany, named params in sqlite3 style.
+UPSERT_SQL = """
+INSERT INTO candle (currency_id, period, start, open, high, low, close,
+                    volume_sum, volume_count, first_date, last_date)
+VALUES (:currency_id, :period, :start, :price, :price, :price, :price,
+        :volume_sum, :volume_count, :date, :date)
+ON CONFLICT (currency_id, period, start) DO UPDATE SET
+    high = max(high, excluded.high),
+    low = min(low, excluded.low),
+    close = CASE WHEN excluded.last_date >= last_date
+                 THEN excluded.close ELSE close END,
+    last_date = max(last_date, excluded.last_date),
+    open = CASE WHEN excluded.first_date < first_date
+                THEN excluded.open ELSE open END,
+    first_date = min(first_date, excluded.first_date),
+    volume_sum = volume_sum + excluded.volume_sum,
+    volume_count = volume_count + excluded.volume_count
+"""
+
+# DateTime format of SQLAlchemy SQLite dialect.
+SQL_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def bucket_start(date, step):
+    """
+    Return start of period bucket for date.
+
+    """
+    seconds = int((date - EPOCH).total_seconds()) // step * step
+
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def update_candles(mappings, date_t):
+    """
+    Incremental refresh of candles by one snapshot.
+    mappings - Info rows of snapshot (dicts as in ingest_snapshot).
+    One UPSERT statement per period, executed for all rows
+    on session connection (no ORM objects).
+    Changes made in session transaction, caller commit them
+    with snapshot.
+
+    """
+    rows = [m for m in mappings if m['price'] is not None]
+    if not rows:
+        return
+
+    # Dates bound as strings, same as stored by DateTime columns.
+    date = date_t.strftime(SQL_DATE_FORMAT)
+    cursor = db.session.connection().connection.cursor()
+
+    for period, step in PERIODS.items():
+        start = bucket_start(date_t, step).strftime(SQL_DATE_FORMAT)
+
+        params = [{'currency_id': m['currency_id'], 'period': period,
+                   'start': start, 'price': m['price'],
+                   'volume_sum': m['volume'] or 0.0,
+                   'volume_count': int(m['volume'] is not None),
+                   'date': date} for m in rows]
+
+        cursor.executemany(UPSERT_SQL, params)
+
+    cursor.close()
+
+
+def rebuild_candles():
+    """
+    Drop all candles and build them again from Info history.
+    Return count of candles.
+
+    """
+    try:
+        Candle.query.delete()
+
+        for period, step in PERIODS.items():
+            db.session.execute(text(REBUILD_SQL),
+                               {'period': period, 'step': step})
+
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return Candle.query.count()
+
+
+def get_candles(currency_id, period, date_from=None, date_to=None,
+                limit=1000):
+    """
+    Return candles of currency for period ordered by date.
+    If range is not set, last <limit> candles returned.
+
+    """
+    query = Candle.query.filter_by(currency_id=currency_id, period=period)
+
+    if date_from:
+        query = query.filter(Candle.start >= date_from)
+    if date_to:
+        query = query.filter(Candle.start < date_to)
+
+    if date_from:
+        return query.order_by(Candle.start).limit(limit).all()
+
+    return query.order_by(Candle.start.desc()).limit(limit).all()[::-1]
@@ -0,0 +1,366 @@
+import os
+import sys
+
+import numpy as np
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+from app.db.models import Info
+from app.db.ingest import INFO_VALUES
+from app.db.queries import CURSOR_FORMAT, decode_cursor
+from app.scheduler import FileLock
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Fixed width record: date (microseconds since epoch) and Info
+# values as float64, NaN if unknown. 64 bytes per point.
+RECORD = np.dtype([('date', '<i8')] +
+                  [(name, '<f8') for name in INFO_VALUES])
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_stamp(date):
+    return (date - EPOCH) // MICROSECOND
+
+
+def from_stamp(stamp):
+    return EPOCH + timedelta(microseconds=int(stamp))
+
+
+class StorePoint(object):
+    """
+    History point of store, same attributes as Info row.
+    record - tuple (date stamp, values...).
+    id - index of point in currency series.
+
+    """
+    def __init__(self, currency_id, index, record):
+        self.id = index
+        self.currency_id = currency_id
+        self.date = from_stamp(record[0])
+
+        for name, value in zip(INFO_VALUES, record[1:]):
+            setattr(self, name, None if value != value else value)
+
+    as_json = Info.as_json
+
+
+class TimeSeriesStore(object):
+    """
+    On-disk history store, file of fixed width records sorted by
+    date for each currency (<root>/<currency_id>.bin), read with
+    numpy.memmap. Range reads are slices of memmap, no copy.
+    Points newer than last stored one are appended, older are
+    merged in order (file rewritten). Writes of all processes
+    are serialized by lock file (<root>/.lock).
+    DB writes that remove history must be done here too:
+    drop() for deleted currency, truncate() for archived dates.
+    Read API same as app.db.queries: history_page, last_history,
+    history_rows, history_stream.
+
+    """
+    def __init__(self, root):
+        """
+        Constructor.
+
+        """
+        self.root = root
+        self.lock_path = os.path.join(root, '.lock')
+        self.maps = {}
+        self.lock = Lock()
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, currency_id):
+        return os.path.join(self.root, '{0}.bin'.format(currency_id))
+
+    def series(self, currency_id):
+        """
+        Return all points of currency as structured array (memmap).
+        Memmap reopened only if file grew or was replaced
+        (drop, truncate).
+
+        """
+        try:
+            stat = os.stat(self.path(currency_id))
+        except OSError:
+            return np.empty(0, dtype=RECORD)
+
+        count = stat.st_size // RECORD.itemsize
+        if not count:
+            return np.empty(0, dtype=RECORD)
+
+        key = (stat.st_ino, count)
+
+        with self.lock:
+            cached = self.maps.get(currency_id)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+            series = np.memmap(self.path(currency_id), dtype=RECORD,
+                               mode='r', shape=(count,))
+            self.maps[currency_id] = (key, series)
+
+            return series
+
+    def append(self, currency_id, mappings):
+        """
+        Add Info mappings (dicts as in ingest_snapshot) of one
+        currency. Points not older than last stored one are appended
+        to file, else series is merged with them and rewritten
+        (points of same date keep stored first).
+        Return count of added points.
+
+        """
+        records = np.array(
+            [(to_stamp(m['date']),) + tuple(
+                np.nan if m[name] is None else m[name]
+                for name in INFO_VALUES)
+             for m in sorted(mappings, key=lambda m: m['date'])],
+            dtype=RECORD)
+
+        if not len(records):
+            return 0
+
+        path = self.path(currency_id)
+
+        with FileLock(self.lock_path):
+            mode = 'r+b' if os.path.exists(path) else 'w+b'
+
+            with open(path, mode) as series_file:
+                series_file.seek(0, os.SEEK_END)
+                size = series_file.tell()
+
+                # Cut off partial record left by interrupted write.
+                if size % RECORD.itemsize:
+                    size -= size % RECORD.itemsize
+                    series_file.truncate(size)
+
+                last = None
+                if size:
+                    series_file.seek(size - RECORD.itemsize)
+                    last = np.frombuffer(series_file.read(RECORD.itemsize),
+                                         dtype=RECORD)[0]['date']
+
+                if last is None or records['date'][0] >= last:
+                    series_file.seek(size)
+                    series_file.write(records.tobytes())
+
+                    return len(records)
+
+                series_file.seek(0)
+                series = np.frombuffer(series_file.read(size), dtype=RECORD)
+
+            merged = np.concatenate([series, records])
+            merged = merged[np.argsort(merged['date'], kind='mergesort')]
+
+            self.replace(currency_id, merged)
+
+        return len(records)
+
+    def replace(self, currency_id, series):
+        """
+        Write series to new file which replaces old one,
+        so readers with open memmap see old or new series.
+        Call with lock file held.
+
+        """
+        with NamedTemporaryFile(dir=self.root, suffix='.tmp',
+                                delete=False) as series_file:
+            series_file.write(series.tobytes())
+
+        os.replace(series_file.name, self.path(currency_id))
+
+    def append_snapshot(self, mappings):
+        """
+        Append Info mappings of many currencies.
+        Return count of appended points.
+
+        """
+        by_currency = defaultdict(list)
+        for m in mappings:
+            by_currency[m['currency_id']].append(m)
+
+        return sum(self.append(currency_id, rows)
+                   for currency_id, rows in by_currency.items())
+
+    def drop(self, currency_id):
+        """
+        Remove all points of currency (deleted currency id may be
+        reused by new one).
+
+        """
+        with self.lock:
+            self.maps.pop(currency_id, None)
+
+        with FileLock(self.lock_path):
+            try:
+                os.remove(self.path(currency_id))
+            except OSError:
+                pass
+
+    def truncate(self, before):
+        """
+        Remove points older than <before> date from all currencies.
+        Kept points written to new file (replace()).
+        Return count of removed points.
+
+        """
+        stamp = to_stamp(before)
+        count = 0
+
+        with FileLock(self.lock_path):
+            for file_name in os.listdir(self.root):
+                currency_id, ext = os.path.splitext(file_name)
+                if ext != '.bin' or not currency_id.isdigit():
+                    continue
+
+                currency_id = int(currency_id)
+                series = self.series(currency_id)
+
+                cut = int(np.searchsorted(series['date'], stamp, 'left'))
+                if not cut:
+                    continue
+
+                self.replace(currency_id, series[cut:])
+                count += cut
+
+        return count
+
+    def range(self, currency_id, date_from=None, date_to=None):
+        """
+        Return (series, lo, hi) - slice bounds of date range.
+
+        """
+        series = self.series(currency_id)
+        dates = series['date']
+
+        lo = 0
+        hi = len(series)
+        if date_from:
+            lo = int(np.searchsorted(dates, to_stamp(date_from), 'left'))
+        if date_to:
+            hi = int(np.searchsorted(dates, to_stamp(date_to), 'left'))
+
+        return series, lo, hi
+
+    def history(self, currency_id, date_from=None, date_to=None):
+        """
+        Return points in date range as array slice (no copy).
+
+        """
+        series, lo, hi = self.range(currency_id, date_from, date_to)
+
+        return series[lo:hi]
+
+    def points(self, currency_id, series, lo, hi):
+        return [StorePoint(currency_id, lo + n, record)
+                for n, record in enumerate(series[lo:hi].tolist())]
+
+    def history_rows(self, currency_id, date_from=None, date_to=None,
+                     chunk=500):
+        """
+        Generator of points in date range.
+
+        """
+        series, lo, hi = self.range(currency_id, date_from, date_to)
+
+        for start in range(lo, hi, chunk):
+            for point in self.points(currency_id, series, start,
+                                     min(start + chunk, hi)):
+                yield point
+
+    # No DB session to release, memmap read by chunks anyway.
+    history_stream = history_rows
+
+    def history_page(self, currency_id, date_from=None, date_to=None,
+                     limit=100, cursor=None):
+        """
+        Return one page of points and cursor for next page.
+        Cursor has last point date and its number among points of
+        same date ("<date>_<n>"), not index in series, so it stays
+        valid after truncate() or merge of older points.
+
+        """
+        series, lo, hi = self.range(currency_id, date_from, date_to)
+        dates = series['date']
+
+        if cursor:
+            date_t, number = decode_cursor(cursor)
+            stamp = to_stamp(date_t)
+
+            start = int(np.searchsorted(dates, stamp, 'left'))
+            if start < len(dates) and dates[start] == stamp:
+                start += number + 1
+
+            lo = max(lo, start)
+
+        end = min(lo + limit, hi)
+        points = self.points(currency_id, series, lo, end)
+
+        if end < hi and points:
+            last = points[-1]
+            number = last.id - int(np.searchsorted(dates, dates[last.id],
+                                                   'left'))
+
+            return points, '{0}_{1}'.format(
+                last.date.strftime(CURSOR_FORMAT), number)
+
+        return points, None
+
+    def last_history(self, currency_id, limit):
+        series = self.series(currency_id)
+        lo = max(len(series) - limit, 0)
+
+        return self.points(currency_id, series, lo, len(series))
+
+    def build(self, chunks):
+        """
+        Fill store from column chunks (app.db.export.history_chunks).
+        Return count of appended points.
+
+        """
+        count = 0
+
+        for chunk in chunks:
+            rows = [dict(zip(chunk, values)) for values in
+                    zip(*[chunk[name].tolist() for name in chunk])]
+
+            for currency_id, group in groupby(rows,
+                                              lambda r: r['currency_id']):
+                count += self.append(currency_id, list(group))
+
+        return count
+
+
+if __name__ == '__main__':
+    from app.index import app
+    from app.db.export import history_chunks
+
+    root = app.config['TS_STORE']
+    if len(sys.argv) > 1:
+        root = sys.argv[1]
+
+    if not root:
+        print("Usage: python -m app.db.tsstore <store dir> "
+              "(or set COIN_TS_STORE)")
+        sys.exit(1)
+
+    with app.app_context():
+        try:
+            count = TimeSeriesStore(root).build(history_chunks())
+
+            print("Done... ({0}) Point's added to store !".format(count))
+
+        except Exception as err:
+            print("Store build Error...\n"
+                  "{0}".format(err))
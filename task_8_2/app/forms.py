@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 
-from wtforms import StringField, PasswordField, SubmitField
+from wtforms import StringField, PasswordField, SubmitField, SelectField
 from wtforms.validators import InputRequired, Email, Length
 
 
@@ -40,4 +40,7 @@ class UserControlForm(FlaskForm):
     online = SubmitField(label='Get Online and Save')
     curr_name = StringField(
         'Currency', validators=[InputRequired()])
-    get_history = SubmitField(label='Show History')
\ No newline at end of file
+    get_history = SubmitField(label='Show History')
+    period = SelectField(
+        'Period', choices=[('5m', '5 min'), ('1h', '1 hour'), ('1d', '1 day')])
+    get_candles = SubmitField(label='Show Candles')
\ No newline at end of file
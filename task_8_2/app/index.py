@@ -1,33 +1,130 @@
-import schedule
+import atexit
 import logging
 
-from os import urandom
-from time import sleep
+from os import urandom, environ, path, remove
 from functools import wraps
-from datetime import datetime
-from threading import Thread
+from hmac import compare_digest
+from datetime import datetime, timezone
+from time import perf_counter
+from tempfile import gettempdir, mkstemp
 
 from flask import Flask, flash, redirect, render_template, \
-    url_for, session, g, jsonify, request
+    url_for, session, g, jsonify, request, make_response, json, \
+    Response, stream_with_context
 from flask_bootstrap import Bootstrap
 
 from app.forms import LoginForm, RegisterForm, UserControlForm
-from app.db.models import db, User, Currency, Info
-from app.scraper.scraper import Scraper
+from app.db.models import db, User, Currency
+from app.db.ingest import ingest_snapshot, ingest_items
+from app.db import queries
+from app.db.rollup import PERIODS, get_candles
+from app.db.archive import delete_currencies
+from app.db.dedup import storage_report
+from app.db.export import export_history, FORMATS, MIMETYPES
+from app.db.tsstore import TimeSeriesStore
+from app.db.migrate import migrate, needs_migrate
+from app.cache import ApiKeyCache, SnapshotCache
+from app.scheduler import Scheduler, FileLock
+from app.tasks import TaskQueue
+from app.metrics import Metrics, CONTENT_TYPE, init_app as init_metrics
+from app.scraper.service import ScraperService
+from app.scraper.cache import ResponseCache
+from app.scraper.records import SnapshotBatch
+from app.scraper.normalize import format_money, format_number, \
+    format_perc
 
 from werkzeug.security import check_password_hash
+from sqlalchemy.engine import make_url
 
 
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = urandom(64)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db/db.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = environ.get(
+    'COIN_DB_URI', 'sqlite:///' + path.join(app.root_path, 'db', 'db.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['BG_TASK_TIME'] = 10
+app.config['BG_TASK_JITTER'] = 0.1
+app.config['SCHEDULER_ENABLED'] = environ.get('COIN_SCHEDULER', '1') != '0'
+app.config['SCHEDULER_LOCK'] = environ.get(
+    'COIN_SCHEDULER_LOCK', path.join(gettempdir(), 'coin_scheduler.lock'))
+app.config['MIGRATE_LOCK'] = environ.get(
+    'COIN_MIGRATE_LOCK', path.join(gettempdir(), 'coin_migrate.lock'))
+app.config['API_KEY_TTL'] = 300
+app.config['API_KEY_NEGATIVE_TTL'] = 30
+app.config['HISTORY_LIMIT'] = 100
+app.config['HISTORY_LIMIT_MAX'] = 1000
+app.config['SNAPSHOT_CACHE_TTL'] = 600
+app.config['SNAPSHOT_STATE_TTL'] = 10
+app.config['STREAM_CHUNK'] = 500
+app.config['EXPORT_CHUNK'] = 64 * 1024
+app.config['TS_STORE'] = environ.get('COIN_TS_STORE')
+app.config['SCRAPER_CACHE'] = environ.get('COIN_SCRAPER_CACHE')
+app.config['ARCHIVE_DB'] = environ.get('COIN_ARCHIVE_DB', 'archive.db')
+app.config['SCRAPER_PARSE'] = environ.get('COIN_SCRAPER_PARSE') or None
+app.config['METRICS_ENABLED'] = environ.get('COIN_METRICS', '0') != '0'
+app.config['METRICS_TOKEN'] = environ.get('COIN_METRICS_TOKEN')
+app.config['TASKS_DIR'] = environ.get(
+    'COIN_TASKS_DIR', path.join(gettempdir(), 'coin_tasks'))
+
+
+def db_folder():
+    """
+    Folder of SQLite DB file (relative path taken from instance
+    folder, as Flask-SQLAlchemy does), temp folder for other DB's.
+    
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    if url.get_backend_name() != 'sqlite' or \
+            url.database in (None, '', ':memory:'):
+        return gettempdir()
+
+    return path.dirname(path.join(app.instance_path, url.database))
+
+
+# Scraped pages cache kept next to DB, shared by all workers.
+if not app.config['SCRAPER_CACHE']:
+    app.config['SCRAPER_CACHE'] = path.join(db_folder(), 'scraper_cache')
 
 Bootstrap(app)
 db.init_app(app)
 
+metrics = None
+if app.config['METRICS_ENABLED']:
+    metrics = Metrics()
+    init_metrics(app, metrics)
+
+scraper_service = ScraperService(
+    cache=ResponseCache(app.config['SCRAPER_CACHE']),
+    parse_executor=app.config['SCRAPER_PARSE'], metrics=metrics)
+atexit.register(scraper_service.stop)
+
+snapshots = SnapshotCache(queries.snapshot_state,
+                          ttl=app.config['SNAPSHOT_CACHE_TTL'],
+                          state_ttl=app.config['SNAPSHOT_STATE_TTL'])
+
+scheduler = Scheduler(app.config['SCHEDULER_LOCK'])
+atexit.register(scheduler.stop)
+
+# Task state shared by all workers in TASKS_DIR.
+online_tasks = TaskQueue(root=app.config['TASKS_DIR'],
+                         encode=SnapshotBatch.as_json,
+                         decode=SnapshotBatch.from_json)
+atexit.register(online_tasks.shutdown)
+
+ts_store = None
+if app.config['TS_STORE']:
+    ts_store = TimeSeriesStore(app.config['TS_STORE'])
+
+
+def history_backend():
+    """
+    History reads from memmap store if it is set, else from DB.
+    
+    """
+    return ts_store or queries
+
 
 @app.before_request
 def before_request():
@@ -40,21 +137,47 @@ def before_request():
         g.user = session['user']
 
 
+def upgrade_db():
+    """
+    Migrate DB made by older app version (app.db.migrate) on app
+    start, so bundled DB works without manual step.
+    Workers wait for lock file, only first one migrates.
+    Raise error if DB still old after migrate.
+    
+    """
+    with app.app_context():
+        if not needs_migrate():
+            return
+
+        with FileLock(app.config['MIGRATE_LOCK']):
+            if needs_migrate():
+                logging.debug("[+]Old DB schema, migrating...")
+                migrate()
+
+        if needs_migrate():
+            raise RuntimeError('DB schema is older than app and migrate '
+                               'failed. Run: python -m app.db.migrate')
+
+
+upgrade_db()
+
+
 @app.before_first_request
 def initialize():
     """
     Initializing BG Task for Data Scrapping.
-    Time delta in app.config[BG_TASK_TIME]
+    Time delta in app.config[BG_TASK_TIME] (minutes).
+    Only one process with scheduler lock runs the task.
     
     """
-    logging.debug("[+]Initializing app BG Task...")
+    if not app.config['SCHEDULER_ENABLED'] or scheduler.jobs:
+        return
 
-    time_delta = app.config['BG_TASK_TIME']
-
-    schedule.every(time_delta).minutes.do(background_task)
+    logging.debug("[+]Initializing app BG Task...")
 
-    bg_task = Thread(target=run)
-    bg_task.start()
+    scheduler.every(app.config['BG_TASK_TIME'] * 60, background_task,
+                    jitter=app.config['BG_TASK_JITTER'])
+    scheduler.start()
 
 
 def check_login(f):
@@ -90,18 +213,30 @@ def is_login(f):
     return wrapper
 
 
+def api_key_exists(api_key):
+    """
+    Check API_KEY in DB by indexed User.apiid.
+    
+    """
+    user = db.session.query(User.user_id).filter_by(apiid=api_key).first()
+
+    return user is not None
+
+
+api_keys = ApiKeyCache(api_key_exists, ttl=app.config['API_KEY_TTL'],
+                       negative_ttl=app.config['API_KEY_NEGATIVE_TTL'])
+
+
 def check_api_key(f):
     """
     Check valid API_KEY for REST API.
+    Use process local keys cache, DB checked only on cache miss.
      
     """
     @wraps(f)
     def wrapper(*args, **kwargs):
-        users = User.query.all()
-
-        for user in users:
-            if kwargs['api_key'] == user.apiid:
-                return f(*args, **kwargs)
+        if api_keys.check(kwargs['api_key']):
+            return f(*args, **kwargs)
 
         return jsonify({'ERROR': 'API Key Error !!!'})
 
@@ -191,6 +326,8 @@ def register():
             db.session.add(new_user)
             db.session.commit()
 
+            api_keys.invalidate(new_user.apiid)
+
             flash('Success ! Try Login...')
 
             return redirect(url_for('login'))
@@ -216,49 +353,25 @@ def info(user):
 
     # User Get Currency data.
     if uform.currencys.data:
-        db_query = Currency.query.all()
+        db_query = snapshots.get('currencies', load_currencies)
 
         if not db_query:
             flash('Data Error...')
 
         data = []
 
-        for obj in db_query:
-            data.append((obj.name.capitalize(), obj.symbol,))
+        for name, symbol in db_query:
+            data.append((name.capitalize(), symbol,))
 
         return render_template('info/currencys.html', user=user,
                                data=data, api=api, uform=uform)
 
     # User Get Online data.
     elif uform.online.data:
-        sc = Scraper()
-        data = sc.start()
-
-        try:
-            date_t = datetime.now()
-
-            for rec in data:
-                currency = Currency.query.filter_by(
-                    name=rec[0].lower()).first()
-
-                if not currency:
-                    continue
-
-                info = Info(rec[2], rec[3], rec[4], rec[5],
-                            rec[6], rec[7], rec[8], date_t, currency=currency)
-
-                currency.info.append(info)
-                db.session.commit()
-
-            return render_template('info/online.html', user=user,
-                                   data=data, api=api, uform=uform,
-                                   online=True)
-
-        except Exception as err:
-            db.session.rollback()
+        task = online_tasks.submit('online', online_task, owner=user)
 
-            return '<h3>Some error...</h3>{0}'\
-                .format(err)
+        return redirect(url_for('online_status', user=user,
+                                task_id=task.id))
 
     # User Get data from DB.
     elif uform.get_history.data:
@@ -280,16 +393,55 @@ def info(user):
 
         data = []
 
-        history = curr_query.info.all()
+        history = history_backend().last_history(
+            curr_query.id, app.config['HISTORY_LIMIT_MAX'])
         for obj in history:
-            data.append((obj.market_cap, obj.price, obj.cs,
-                         obj.volume, obj.perc_1h, obj.perc_24h,
-                         obj.perc_7d, obj.date,))
+            data.append((format_money(obj.market_cap),
+                         format_money(obj.price), format_number(obj.cs),
+                         format_money(obj.volume), format_perc(obj.perc_1h),
+                         format_perc(obj.perc_24h), format_perc(obj.perc_7d),
+                         obj.date,))
 
         return render_template('info/history.html', user=user,
                                currency=currency, data=data, api=api,
                                uform=uform)
 
+    # User Get price candles from DB.
+    elif uform.get_candles.data:
+        currency = uform.curr_name.data
+        period = uform.period.data
+        if not currency:
+            flash("Input Currency name or Symbol to search!")
+
+        if currency.isupper():
+            curr_query = Currency.query.filter_by(symbol=currency).first()
+        else:
+            curr_query = Currency.query.filter_by(
+                name=currency.lower()).first()
+
+        if not curr_query or period not in PERIODS:
+            flash('No such currensy: In Name or Symbol'.format(currency))
+
+            return render_template('info.html', user=user,
+                                   data=None, api=api, uform=uform)
+
+        data = []
+
+        candles = get_candles(curr_query.id, period,
+                              limit=app.config['HISTORY_LIMIT_MAX'])
+        for obj in candles:
+            candle = obj.as_json()
+
+            data.append((candle['date'], format_money(candle['open']),
+                         format_money(candle['high']),
+                         format_money(candle['low']),
+                         format_money(candle['close']),
+                         format_money(candle['volume']),))
+
+        return render_template('info/candles.html', user=user,
+                               currency=currency, period=period, data=data,
+                               api=api, uform=uform)
+
     return render_template('info.html', user=user,
                            data=None, api=api, uform=uform)
 
@@ -317,31 +469,376 @@ def err404(e):
     return render_template('err_pages/err404.html', error=e)
 
 
+def parse_date_param(value):
+    """
+    Parse date from query param. Return None if param empty.
+    Raise ValueError if date is wrong.
+    
+    """
+    if not value:
+        return None
+
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+
+        except ValueError:
+            continue
+
+    raise ValueError(value)
+
+
+def online_task(task):
+    """
+    Background "Get Online and Save" task.
+    Return scraped data for info/online.html.
+    
+    """
+    task.update('scraping')
+
+    start = perf_counter()
+    data, stats = scraper_service.fetch()
+
+    if metrics:
+        metrics.since('coin_pipeline_seconds', start, 'online', 'scrape')
+
+    # Page same as on last scrap, data already saved.
+    if stats.unchanged:
+        scraper_service.commit(stats)
+        task.update('unchanged', rows=len(data))
+
+        return data
+
+    task.update('saving', rows=len(data))
+
+    with app.app_context():
+        try:
+            start = perf_counter()
+            count = ingest_snapshot(data, datetime.now(), store=ts_store)
+            snapshots.invalidate()
+            scraper_service.commit(stats)
+
+            if metrics:
+                metrics.since('coin_pipeline_seconds', start,
+                              'online', 'ingest')
+                metrics.inc('coin_pipeline_rows_total', 'online',
+                            amount=count)
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+    task.update('saved')
+
+    return data
+
+
+@app.route('/info/<user>/online/<task_id>/', methods=['GET'])
+@check_login
+def online_status(user, task_id):
+    """
+    Online task page. Show progress until task is done,
+    then render scraped data.
+    
+    """
+    task = online_tasks.get(task_id, owner=user)
+    if task is None:
+        flash('Online task not found. Try again!')
+
+        return redirect(url_for('info', user=user))
+
+    if task.state == 'error':
+        return '<h3>Some error...</h3>{0}'.format(task.error)
+
+    uform = UserControlForm()
+    api = session['api_id']
+
+    if task.state == 'done':
+        data = []
+
+        for rec in task.result or []:
+            data.append((rec.name, rec.symbol, format_money(rec.market_cap),
+                         format_money(rec.price), format_number(rec.cs),
+                         format_money(rec.volume), format_perc(rec.perc_1h),
+                         format_perc(rec.perc_24h), format_perc(rec.perc_7d)))
+
+        return render_template('info/online.html', user=user,
+                               data=data, api=api, uform=uform,
+                               online=True)
+
+    return render_template('info/task.html', user=user, task=task,
+                           api=api, uform=uform)
+
+
+@app.route('/info/<user>/online/<task_id>/status/', methods=['GET'])
+@check_login
+def online_task_status(user, task_id):
+    """
+    Online task progress as JSON (for polling).
+    
+    """
+    task = online_tasks.get(task_id, owner=user)
+    if task is None:
+        return jsonify({'ERROR': 'Task not found!'}), 404
+
+    return jsonify(task.as_json())
+
+
+@app.route('/api/<api_key>/usage/', methods=['GET'])
+@check_api_key
+def get_usage(api_key):
+    """
+    REST API to GET requests count for API_KEY.
+     
+    """
+    return jsonify({'api_key': api_key,
+                    'requests': api_keys.requests(api_key)})
+
+
+@app.route('/api/<api_key>/scheduler/', methods=['GET'])
+@check_api_key
+def get_scheduler(api_key):
+    """
+    REST API to GET background jobs status.
+    active - this process holds scheduler lock and runs jobs.
+     
+    """
+    return jsonify(scheduler.status())
+
+
+@app.route('/api/<api_key>/scraper/', methods=['GET'])
+@check_api_key
+def get_scraper(api_key):
+    """
+    REST API to GET scraper response cache counters:
+    last run and total since app start.
+     
+    """
+    last = scraper_service.last_stats
+
+    return jsonify({'last': last.as_json() if last else None,
+                    'total': scraper_service.total_stats.as_json()})
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics in text format: scrape stages, scrap
+    tasks, request latency and DB queries.
+    Not found if metrics disabled (COIN_METRICS=0).
+    With COIN_METRICS_TOKEN scraper must send it as
+    "Authorization: Bearer <token>", without it only local
+    requests are allowed (set token if app is behind proxy).
+     
+    """
+    if metrics is None:
+        return Response('Metrics disabled\n', status=404,
+                        content_type=CONTENT_TYPE)
+
+    token = app.config['METRICS_TOKEN']
+
+    if token:
+        auth = request.headers.get('Authorization', '')
+        if not compare_digest(auth.encode(),
+                              'Bearer {0}'.format(token).encode()):
+            return Response('Unauthorized\n', status=401,
+                            content_type=CONTENT_TYPE,
+                            headers={'WWW-Authenticate': 'Bearer'})
+
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return Response('Forbidden\n', status=403,
+                        content_type=CONTENT_TYPE)
+
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/api/<api_key>/storage/', methods=['GET'])
+@check_api_key
+def get_storage(api_key):
+    """
+    REST API to GET history storage report:
+    Info rows stored and rows saved by unchanged runs.
+     
+    """
+    return jsonify(storage_report())
+
+
+def conditional(f):
+    """
+    Conditional GET for snapshot data.
+    Return 304 by ETag / Last-Modified of current DB state
+    without loading data, else add validators to response.
+    
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        etag, modified = snapshots.validators()
+        since = request.if_modified_since
+
+        # HTTP dates are UTC, compared with aware UTC DB date.
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+
+        if request.if_none_match.contains(etag) or \
+                (not request.if_none_match and since and since >= modified):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+
+        response.set_etag(etag)
+        response.last_modified = modified
+
+        return response
+
+    return wrapper
+
+
+def load_currencies():
+    """
+    Load all currencies (name, symbol) for snapshots cache.
+    
+    """
+    return [tuple(row) for row in
+            db.session.query(Currency.name, Currency.symbol).all()]
+
+
+def load_latest(name):
+    """
+    Load currency latest Info for snapshots cache.
+    Return dict or None if no such currency.
+    
+    """
+    if name.isupper():
+        curr_query = Currency.query.filter_by(symbol=name).first()
+    else:
+        curr_query = Currency.query.filter_by(name=name.lower()).first()
+
+    if not curr_query:
+        return None
+
+    last = history_backend().last_history(curr_query.id, 1)
+
+    return {'name': curr_query.name, 'symb': curr_query.symbol,
+            'latest': last[0].as_json() if last else None}
+
+
+STREAM_FORMATS = ('stream', 'ndjson')
+
+
+def stream_response(head, key, rows, fmt):
+    """
+    Streaming REST API response, rows encoded one by one.
+    fmt "stream" - JSON object: head fields + key: [rows],
+    fmt "ndjson" - one JSON row per line, head not sent.
+    
+    """
+    def json_gen():
+        prefix = json.dumps(head)[:-1]
+        if head:
+            prefix += ', '
+
+        yield prefix + json.dumps(key) + ': ['
+
+        for n, row in enumerate(rows):
+            yield (', ' if n else '') + json.dumps(row)
+
+        yield ']}'
+
+    def ndjson_gen():
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(ndjson_gen()),
+                        mimetype='application/x-ndjson')
+
+    return Response(stream_with_context(json_gen()),
+                    mimetype='application/json')
+
+
+def history_as_json(obj):
+    """
+    Info row as REST API history record.
+    
+    """
+    return {'market cap': obj.market_cap, 'price': obj.price,
+            'cs': obj.cs, 'volume': obj.volume,
+            '%1h': obj.perc_1h, '%24h': obj.perc_24h,
+            '%7d': obj.perc_7d, 'date-time': obj.date}
+
+
 @app.route('/api/<api_key>/currency/', methods=['GET'])
 @check_api_key
+@conditional
 def get_all(api_key):
     """
     REST API to GET all Currency in DB.
+    Query params (optional):
+        format - json (default), stream or ndjson.
      
     """
-    curr_query = Currency.query.all()
+    fmt = request.args.get('format', 'json')
+
+    curr_query = snapshots.get('currencies', load_currencies)
     if not curr_query:
         return jsonify({'ERROR': 'No such data !'})
 
+    if fmt in STREAM_FORMATS:
+        rows = ({'name': name, 'sym': symbol} for name, symbol in curr_query)
+
+        return stream_response({}, 'data', rows, fmt)
+
     data = []
-    for obj in curr_query:
-        data.append({'name': obj.name, 'sym': obj.symbol})
+    for name, symbol in curr_query:
+        data.append({'name': name, 'sym': symbol})
 
     return jsonify({'data': data})
 
 
+@app.route('/api/<api_key>/currency/<name>/latest/', methods=['GET'])
+@check_api_key
+@conditional
+def get_latest(api_key, name):
+    """
+    REST API to GET Currency latest Info by name or symbol.
+     
+    """
+    data = snapshots.get('latest:' + name, lambda: load_latest(name))
+    if not data:
+        return jsonify({'ERROR': 'No data by: {0}'.format(name)})
+
+    return jsonify(data)
+
+
 @app.route('/api/<api_key>/currency/<name>/', methods=['GET'])
 @check_api_key
 def get_one(api_key, name):
     """
     REST API to GET Currency Info by name or symbol.
+    Query params (all optional):
+        from, to - date range, "%Y-%m-%d %H:%M:%S" or "%Y-%m-%d",
+        limit - page size (HISTORY_LIMIT, max HISTORY_LIMIT_MAX),
+        cursor - value of "next" from previous page,
+        format - json (default, one page), stream or ndjson
+                 (whole range streamed, limit and cursor ignored).
      
     """
+    fmt = request.args.get('format', 'json')
+
+    try:
+        date_from = parse_date_param(request.args.get('from'))
+        date_to = parse_date_param(request.args.get('to'))
+        limit = min(request.args.get('limit', app.config['HISTORY_LIMIT'],
+                                     type=int),
+                    app.config['HISTORY_LIMIT_MAX'])
+        cursor = request.args.get('cursor')
+
+    except ValueError:
+        return jsonify({'ERROR': 'Wrong query params!',
+                        "Template:": "?from=2017-05-14&to=2017-05-15"
+                                     "&limit=100&cursor=<next>",
+                        "Date Format": "%Y-%m-%d %H:%M:%S"})
+
     if name.isupper():
         curr_query = Currency.query.filter_by(symbol=name).first()
     else:
@@ -350,20 +847,136 @@ def get_one(api_key, name):
     if not curr_query:
         return jsonify({'ERROR': 'No data by: {0}'.format(name)})
 
-    his_query = curr_query.info.all()
-    if not his_query:
+    # Read by pages while streaming, no DB cursor kept open
+    # for slow client.
+    if fmt in STREAM_FORMATS:
+        rows = (history_as_json(obj) for obj in
+                history_backend().history_stream(
+                    curr_query.id, date_from, date_to,
+                    app.config['STREAM_CHUNK']))
+
+        return stream_response({'name': curr_query.name,
+                                'symb': curr_query.symbol},
+                               'history', rows, fmt)
+
+    try:
+        his_query, next_cursor = history_backend().history_page(
+            curr_query.id, date_from, date_to, max(limit, 1), cursor)
+
+    except ValueError:
+        return jsonify({'ERROR': 'Wrong cursor: {0}'.format(cursor)})
+
+    if not his_query and not cursor:
         return jsonify({'name': curr_query.name, 'symb': curr_query.symbol,
                  'history': 'No Quotation history now...'})
 
     history = []
     for obj in his_query:
-        history.append({'market cap': obj.market_cap, 'price': obj.price,
-                        'cs': obj.cs, 'volume': obj.volume,
-                        '%1h': obj.perc_1h, '%24h': obj.perc_24h,
-                        '%7d': obj.perc_7d, 'date-time': obj.date})
+        history.append(history_as_json(obj))
 
     return jsonify({'name': curr_query.name, 'symb': curr_query.symbol,
-                    'history': history})
+                    'history': history, 'next': next_cursor})
+
+
+@app.route('/api/<api_key>/export/', methods=['GET'])
+@check_api_key
+def get_export(api_key):
+    """
+    REST API to download history in columnar format.
+    Query params (all optional):
+        format - npz (default) or parquet (if pyarrow installed),
+        names - currency names, comma separated (default all).
+    File written to temp dir and streamed, removed after send.
+     
+    """
+    fmt = request.args.get('format', 'npz')
+    if fmt not in FORMATS:
+        return jsonify({'ERROR': 'Wrong export format: {0}'.format(fmt),
+                        "Formats:": list(FORMATS)})
+
+    names = [name for name in request.args.get('names', '').split(',')
+             if name.strip()]
+
+    fd, file_name = mkstemp(suffix='.' + fmt)
+
+    try:
+        with open(fd, 'wb'):
+            pass
+        export_history(file_name, fmt, names)
+
+    except Exception as err:
+        remove(file_name)
+
+        print("[+]REST API Export error...\n"
+              "{0}".format(err))
+
+        return jsonify({'ERROR': 'Export some error! Try later!'})
+
+    def read_file():
+        try:
+            with open(file_name, 'rb') as export_file:
+                while True:
+                    chunk = export_file.read(app.config['EXPORT_CHUNK'])
+                    if not chunk:
+                        break
+
+                    yield chunk
+
+        finally:
+            remove(file_name)
+
+    response = Response(read_file(), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=history.{0}'.format(fmt)
+    response.headers['Content-Length'] = path.getsize(file_name)
+
+    return response
+
+
+@app.route('/api/<api_key>/currency/<name>/ohlc/', methods=['GET'])
+@check_api_key
+def get_ohlc(api_key, name):
+    """
+    REST API to GET Currency price candles by name or symbol.
+    Query params (all optional):
+        period - 5m, 1h or 1d (default 1h),
+        from, to - date range, "%Y-%m-%d %H:%M:%S" or "%Y-%m-%d",
+        limit - max candles (HISTORY_LIMIT_MAX).
+     
+    """
+    period = request.args.get('period', '1h')
+
+    try:
+        date_from = parse_date_param(request.args.get('from'))
+        date_to = parse_date_param(request.args.get('to'))
+        limit = min(request.args.get('limit', app.config['HISTORY_LIMIT_MAX'],
+                                     type=int),
+                    app.config['HISTORY_LIMIT_MAX'])
+
+    except ValueError:
+        return jsonify({'ERROR': 'Wrong query params!',
+                        "Template:": "?period=1h&from=2017-05-14"
+                                     "&to=2017-05-15&limit=100",
+                        "Date Format": "%Y-%m-%d %H:%M:%S"})
+
+    if period not in PERIODS:
+        return jsonify({'ERROR': 'Wrong period: {0}'.format(period),
+                        "Periods": list(PERIODS)})
+
+    if name.isupper():
+        curr_query = Currency.query.filter_by(symbol=name).first()
+    else:
+        curr_query = Currency.query.filter_by(name=name.lower()).first()
+
+    if not curr_query:
+        return jsonify({'ERROR': 'No data by: {0}'.format(name)})
+
+    candles = get_candles(curr_query.id, period, date_from, date_to,
+                          max(limit, 1))
+
+    return jsonify({'name': curr_query.name, 'symb': curr_query.symbol,
+                    'period': period,
+                    'candles': [obj.as_json() for obj in candles]})
 
 
 @app.route('/api/<api_key>/currency/', methods=['POST'])
@@ -393,127 +1006,165 @@ def post_one(api_key):
 
     curr_query = Currency.query.filter_by(name=data['name'].lower()).first()
 
-    if 'info' not in data.keys():
-        info = None
-    else:
-        d_info = data['info']
-        date_time = datetime.strptime(d_info['date_time'], "%Y-%m-%d %H:%M:%S")
+    if curr_query and not data.get('info'):
+        return jsonify({'ERROR': 'This currency alredy exists',
+                        "Template:": "name: Bitcoin, symbol: BTC, info: {}",
+                        "Info params:": "ms, price, cs, volume, p1h, p24h, p7d, date_time",
+                        "Data Format": "JSON"})
+
+    # Same write path as batch: candles, history runs and store.
+    try:
+        status = ingest_items([data], store=ts_store)[0]
+        snapshots.invalidate()
 
-        info = Info(mc=d_info['mc'], price=d_info['price'], cs=d_info['cs'],
-                    volume=d_info['volume'], p1h=d_info['p1h'],
-                    p24h=d_info['p24h'], p7d=d_info['p7d'],
-                    datet=date_time, currency=None)
+    except Exception as err:
+        print("[+]REST API Add Currency Error...\n"
+              "{0}".format(err))
 
-    if curr_query and not info:
-        return jsonify({'ERROR': 'This currency alredy exists',
+        return jsonify({'ERROR': 'Data Add some error! Try later!'})
+
+    if status['status'] == 'ERROR':
+        return jsonify({'ERROR': status['error'],
                         "Template:": "name: Bitcoin, symbol: BTC, info: {}",
                         "Info params:": "ms, price, cs, volume, p1h, p24h, p7d, date_time",
                         "Data Format": "JSON"})
-    elif curr_query and info:
-        try:
-            curr_query.info.append(info)
-            db.session.commit()
 
-            return jsonify({"Status": "Success! Info Add..."})
+    if status['status'] == 'exists':
+        return jsonify({"Status": "Success! Info Add..."})
 
-        except Exception as err:
-            db.session.rollback()
+    return jsonify({"Status": "Success!"})
 
-            print("[+]REST API Add Currency Info Error...\n"
-                  "{0}".format(err))
 
-            return jsonify({'ERROR': 'Data Add some error! Try later!'})
+@app.route('/api/<api_key>/currency/batch/', methods=['POST'])
+@check_api_key
+def post_batch(api_key):
+    """
+    REST API to POST many currencies with info in one request.
+    Body: JSON list of items, or NDJSON stream (one item per line,
+    Content-Type: application/x-ndjson).
+    Item: name, symbol,
+          info: {mc, price, cs, volume, p1h, p24h, p7d, date_time}
+                or list of them.
+    All valid items saved in one transaction.
+    Return status for each item.
+     
+    """
+    if request.mimetype == 'application/x-ndjson':
+        items = []
 
-    try:
-        new_curr = Currency(name=data['name'], symbol=data['symbol'])
-        if info:
-            new_curr.info = info
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
 
-        db.session.add(new_curr)
-        db.session.commit()
+            try:
+                items.append(json.loads(line.decode('utf-8')))
 
-        return jsonify({"Status": "Success!"})
+            except ValueError:
+                items.append(None)
+    else:
+        items = request.get_json(silent=True)
 
-    except Exception as err:
-        db.session.rollback()
+    if not isinstance(items, list) or not items:
+        return jsonify({'ERROR': 'No data to ADD!',
+                        "Template:": "[{name: Bitcoin, symbol: BTC, "
+                                     "info: {} or []}, ...]",
+                        "Info params:": "mc, price, cs, volume, p1h, p24h, p7d, date_time",
+                        "Data Format": "JSON list or NDJSON"})
 
-        print("[+]REST API Add Currency Error...\n"
+    try:
+        statuses = ingest_items(items, store=ts_store)
+        snapshots.invalidate()
+
+    except Exception as err:
+        print("[+]REST API Batch Add Error...\n"
               "{0}".format(err))
 
         return jsonify({'ERROR': 'Data Add some error! Try later!'})
 
+    errors = sum(1 for status in statuses if status['status'] == 'ERROR')
+
+    return jsonify({"Status": "Success!", "items": len(statuses),
+                    "errors": errors, "data": statuses})
+
 
 @app.route('/api/<api_key>/currency/', methods=['DELETE'])
 @check_api_key
 def del_one(api_key):
     """
     REST API to DELETE data from DB.
-    Params: name.
+    Params: name or names (list), archive (bool, optional).
+    Currency deleted with all history and candles.
+    If archive set, history moved to archive DB.
     
     """
-    data = request.data
-    if not data:
-        return jsonify({'ERROR': 'No params to DEL data',
-                        "Template:": "name: Bitcoin",
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or \
+            ('name' not in data and 'names' not in data):
+        return jsonify({'ERROR': 'To DEL data set <name> or <names> param!',
+                        "Template:": "name: Bitcoin or "
+                                     "names: [Bitcoin, Ethereum], "
+                                     "archive: true",
                         "Data Format": "JSON"})
 
-    data = request.get_json()
-
-    if 'name' not in data.keys():
-        return jsonify({'ERROR': 'To DEL data set <name> param!',
-                        "Template:": "name: Bitcoin",
-                        "Data Format": "JSON"})
+    names = data.get('names') or [data.get('name')]
+    if not isinstance(names, list) or \
+            not all(isinstance(name, str) for name in names):
+        return jsonify({'ERROR': 'Currency names must be strings!'})
 
-    currency = data['name']
-    curr_query = Currency.query.filter_by(name=currency.lower()).first()
-    if not curr_query:
-        return jsonify({"ERROR:": "Data DEL error."
-                                  "Currency with name {0} not exist!"
-                       .format(currency)})
+    archive = app.config['ARCHIVE_DB'] if data.get('archive') else None
 
-    history_query = curr_query.info.all()
     try:
-        if history_query:
-            for record in history_query:
-                db.session.delete(record)
-
-        db.session.delete(curr_query)
-        db.session.commit()
-
-        return jsonify({"Status:": "Success !"})
+        deleted = delete_currencies(names, archive, store=ts_store)
 
     except Exception as err:
-        db.session.rollback()
-
         print("[+]REST API DEL Data error...\n"
               "{0}".format(err))
 
         return jsonify({'ERROR': 'Data DEL some error! Try later!'})
 
+    if not deleted:
+        return jsonify({"ERROR:": "Data DEL error."
+                                  "Currency with name {0} not exist!"
+                       .format(', '.join(names))})
 
-def background_task():
-    sc = Scraper()
-    data = sc.start()
+    snapshots.invalidate()
 
-    with app.app_context():
+    missing = sorted(set(name.lower() for name in names) - set(deleted))
 
-        try:
-            date_t = datetime.now()
+    return jsonify({"Status:": "Success !", "deleted": sorted(deleted),
+                    "not_found": missing, "archived": bool(archive)})
+
+
+def background_task():
+    start = perf_counter()
+    data, stats = scraper_service.fetch()
+
+    if metrics:
+        metrics.since('coin_pipeline_seconds', start, 'background', 'scrape')
 
-            for rec in data:
-                currency = Currency.query.filter_by(
-                    name=rec[0].lower()).first()
+    if stats.unchanged:
+        scraper_service.commit(stats)
+        print("[Background:] Page not changed, skip. "
+              "({0}) Byte's saved !".format(stats.bytes_saved))
+        return
 
-                if not currency:
-                    continue
+    with app.app_context():
 
-                info = Info(rec[2], rec[3], rec[4], rec[5],
-                            rec[6], rec[7], rec[8], date_t, currency=currency)
+        try:
+            start = perf_counter()
+            count = ingest_snapshot(data, datetime.now(), store=ts_store)
+            snapshots.invalidate()
+            scraper_service.commit(stats)
 
-                currency.info.append(info)
-                db.session.commit()
+            if metrics:
+                metrics.since('coin_pipeline_seconds', start,
+                              'background', 'ingest')
+                metrics.inc('coin_pipeline_rows_total', 'background',
+                            amount=count)
 
-            print("[Background:] New data added to DB.")
+            print("[Background:] New data added to DB. "
+                  "({0}) Write's !".format(count))
 
         except Exception as err:
             db.session.rollback()
@@ -522,14 +1173,6 @@ def background_task():
                   '{0}'.format(err))
 
 
-def run():
-    logging.debug("[+]BG Task Running...")
-
-    while 1:
-        schedule.run_pending()
-        sleep(1)
-
-
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     logging.debug("[+]Flask App Started...")
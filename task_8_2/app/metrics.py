@@ -0,0 +1,198 @@
+from time import perf_counter
+from bisect import bisect_left
+from threading import Lock
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram upper bounds: seconds and DB queries per request.
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+# name -> (type, help, label names, buckets).
+METRICS = {
+    'coin_scrape_stage_seconds': (
+        'histogram', 'Scrap time of one page by stage: dns, connect, '
+        'ttfb (request start to response headers, dns and connect '
+        'included), download, parse.',
+        ('stage',), TIME_BUCKETS),
+    'coin_scrape_pages_total': (
+        'counter', 'Scraped pages by result: ok, not_modified, '
+        'hash_hit, http_<status>, error, timeout.', ('result',), None),
+    'coin_scrape_bytes_total': (
+        'counter', 'Scraped page bytes received.', (), None),
+    'coin_pipeline_seconds': (
+        'histogram', 'Scrap and save task time by stage: scrape, ingest.',
+        ('task', 'stage'), TIME_BUCKETS),
+    'coin_pipeline_rows_total': (
+        'counter', 'Rows saved by scrap tasks.', ('task',), None),
+    'coin_http_request_seconds': (
+        'histogram', 'Flask request latency (streamed responses until '
+        'first byte).', ('method', 'endpoint', 'status'), TIME_BUCKETS),
+    'coin_http_request_db_queries': (
+        'histogram', 'DB queries made by one request.', ('endpoint',),
+        COUNT_BUCKETS),
+    'coin_db_queries_total': (
+        'counter', 'DB queries made by app (requests and tasks).', (),
+        None),
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')\
+        .replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = ['{0}="{1}"'.format(name, escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """
+    Process local registry of counters and histograms (see METRICS),
+    rendered in Prometheus text format.
+    Thread safe. Code checks "if metrics" before measure, so
+    disabled app (metrics = None) pays nothing.
+
+    """
+    def __init__(self, definitions=None):
+        """
+        Constructor.
+
+        """
+        self.definitions = definitions or METRICS
+        self.values = {name: {} for name in self.definitions}
+        self.lock = Lock()
+
+    def inc(self, name, *labels, amount=1):
+        """
+        Add amount to counter with label values.
+
+        """
+        series = self.values[name]
+
+        with self.lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, value, *labels):
+        """
+        Add value to histogram with label values.
+
+        """
+        buckets = self.definitions[name][3]
+        series = self.values[name]
+
+        with self.lock:
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = [[0] * (len(buckets) + 1), 0.0, 0]
+
+            hist[0][bisect_left(buckets, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def since(self, name, start, *labels):
+        """
+        Observe time passed since start (perf_counter value).
+
+        """
+        self.observe(name, perf_counter() - start, *labels)
+
+    def render(self):
+        """
+        Return all metrics in Prometheus text format.
+
+        """
+        lines = []
+
+        with self.lock:
+            snapshot = {name: {labels: (list(value[0]), value[1], value[2])
+                               if isinstance(value, list) else value
+                               for labels, value in series.items()}
+                        for name, series in self.values.items()}
+
+        for name in sorted(self.definitions):
+            kind, help_text, label_names, buckets = self.definitions[name]
+
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+            for labels, value in sorted(snapshot[name].items()):
+                if kind == 'counter':
+                    lines.append('{0}{1} {2}'.format(
+                        name, format_labels(label_names, labels),
+                        format_value(value)))
+                    continue
+
+                counts, total, count = value
+                cumulative = 0
+
+                for bound, bucket_count in zip(
+                        buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        name, format_labels(
+                            label_names, labels,
+                            'le="{0}"'.format(format_value(bound))),
+                        cumulative))
+
+                lines.append('{0}_sum{1} {2}'.format(
+                    name, format_labels(label_names, labels),
+                    format_value(total)))
+                lines.append('{0}_count{1} {2}'.format(
+                    name, format_labels(label_names, labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app, metrics):
+    """
+    Register request latency and DB query count hooks.
+    Called only if metrics enabled, else app has no hooks.
+
+    """
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_query(*args):
+        metrics.inc('coin_db_queries_total')
+
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_queries += 1
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = perf_counter()
+        g.metrics_queries = 0
+
+    @app.after_request
+    def end_request(response):
+        if 'metrics_start' not in g:
+            return response
+
+        endpoint = request.endpoint or 'unknown'
+
+        metrics.since('coin_http_request_seconds', g.metrics_start,
+                      request.method, endpoint, response.status_code)
+        metrics.observe('coin_http_request_db_queries', g.metrics_queries,
+                        endpoint)
+
+        return response
@@ -0,0 +1,273 @@
+import os
+import random
+import logging
+
+from time import monotonic
+from datetime import datetime
+from threading import Thread, Event, Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+class FileLock(object):
+    """
+    Inter-process lock on file, non blocking by default.
+    As context manager waits for lock ("with FileLock(path):").
+    Lock released by OS if process died.
+
+    """
+    def __init__(self, path):
+        """
+        Constructor.
+
+        """
+        self.path = path
+        self.file = None
+
+    def acquire(self, blocking=False):
+        """
+        Try to get lock. Return True if lock is held.
+        blocking - wait until lock is free.
+
+        """
+        if self.file:
+            return True
+
+        lock_file = open(self.path, 'a+')
+
+        try:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK
+                               if blocking else msvcrt.LK_NBLCK, 1)
+
+        except (IOError, OSError):
+            lock_file.close()
+            return False
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+
+        self.file = lock_file
+
+        return True
+
+    def release(self):
+        if not self.file:
+            return
+
+        try:
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        finally:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        if not self.acquire(blocking=True):
+            raise IOError('Lock error: {0}'.format(self.path))
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class Job(object):
+    """
+    Periodic job with run status.
+    Interval in seconds, jitter - part of interval to randomize
+    next run time, so workers don't hit source at same moment.
+
+    """
+    def __init__(self, name, func, interval, jitter=0.1):
+        """
+        Constructor.
+
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+
+        self.thread = None
+        self.next_run = None
+
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def schedule_next(self, now):
+        delta = self.interval * random.uniform(1 - self.jitter,
+                                               1 + self.jitter)
+        self.next_run = now + delta
+
+    def run(self):
+        """
+        Start job in own thread.
+        Skip run if previous one is not finished yet.
+
+        """
+        if self.running:
+            self.skipped += 1
+            logging.debug("[+]Job {0} still running, skip...".format(
+                self.name))
+            return
+
+        self.thread = Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.last_start = datetime.now()
+        start = monotonic()
+
+        try:
+            self.func()
+            self.last_error = None
+
+        except Exception as err:
+            self.errors += 1
+            self.last_error = str(err)
+
+            logging.error("[+]Job {0} Error...\n"
+                          "{1}".format(self.name, err))
+
+        finally:
+            self.runs += 1
+            self.last_duration = monotonic() - start
+
+    def status(self, now):
+        return {'name': self.name,
+                'interval': self.interval,
+                'running': self.running,
+                'runs': self.runs,
+                'skipped': self.skipped,
+                'errors': self.errors,
+                'last_start': self.last_start and
+                              self.last_start.strftime("%Y-%m-%d %H:%M:%S"),
+                'last_duration': self.last_duration,
+                'last_error': self.last_error,
+                'next_run_in': self.next_run and max(self.next_run - now, 0)}
+
+
+class Scheduler(object):
+    """
+    Background jobs runner.
+    Only one process (owner of lock file) runs jobs, others wait
+    in standby and retry lock every <lock_retry> seconds, so
+    jobs continue if active process died.
+
+    """
+    def __init__(self, lock_path, lock_retry=30, tick=1):
+        """
+        Constructor.
+
+        """
+        self.lock = FileLock(lock_path)
+        self.lock_retry = lock_retry
+        self.tick = tick
+
+        self.jobs = []
+        self.active = False
+
+        self._stop = Event()
+        self._thread = None
+        self._start_lock = Lock()
+
+    def every(self, interval, func, name=None, jitter=0.1):
+        """
+        Add job run every <interval> seconds.
+
+        """
+        job = Job(name or func.__name__, func, interval, jitter)
+        self.jobs.append(job)
+
+        return job
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._start_lock:
+            if self.running:
+                return
+
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='scheduler',
+                                  daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Stop scheduler, wait for running jobs and release lock.
+
+        """
+        self._stop.set()
+
+        if self._thread:
+            self._thread.join(timeout)
+
+        for job in self.jobs:
+            if job.running:
+                job.thread.join(timeout)
+
+        self.lock.release()
+        self.active = False
+
+    def status(self):
+        now = monotonic()
+
+        return {'active': self.active,
+                'running': self.running,
+                'pid': os.getpid(),
+                'jobs': [job.status(now) for job in self.jobs]}
+
+    def _run(self):
+        logging.debug("[+]Scheduler Running...")
+
+        while not self._stop.is_set():
+            if not self.active:
+                self.active = self.lock.acquire()
+
+                if not self.active:
+                    self._stop.wait(self.lock_retry)
+                    continue
+
+                logging.debug("[+]Scheduler is active in process "
+                              "{0}".format(os.getpid()))
+
+                now = monotonic()
+                for job in self.jobs:
+                    job.schedule_next(now)
+
+            now = monotonic()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    job.run()
+                    job.schedule_next(now)
+
+            self._stop.wait(self.tick)
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from threading import Lock
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+class ScrapStats(object):
+    """
+    Counters of one scrap run (or total of many runs).
+    hits - pages not parsed: 304 Not Modified or same body hash.
+    bytes_saved - body size not downloaded on 304 answers.
+    pending - new response cache entries of run, saved with
+    ResponseCache.save() only after scraped data is stored.
+
+    """
+    FIELDS = ['requests', 'not_modified', 'hash_hits', 'misses',
+              'bytes_received', 'bytes_saved']
+
+    def __init__(self):
+        """
+        Constructor.
+
+        """
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+
+        self.pending = []
+
+    @property
+    def hits(self):
+        return self.not_modified + self.hash_hits
+
+    @property
+    def unchanged(self):
+        """
+        All pages of run were same as cached.
+
+        """
+        return self.requests > 0 and self.hits == self.requests
+
+    def add(self, other):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_json(self):
+        j_data = {name: getattr(self, name) for name in self.FIELDS}
+        j_data['hits'] = self.hits
+
+        return j_data
+
+
+def file_version(file_name):
+    """
+    Return (inode, mtime, size) of file, changed by each replace.
+
+    """
+    stat = os.stat(file_name)
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of scraped pages: validators (ETag,
+    Last-Modified), body hash and parsed records for each url.
+    One JSON file per url in <root>, loaded entries kept in memory
+    and read again if other worker replaced file.
+
+    """
+    def __init__(self, root):
+        """
+        Constructor.
+
+        """
+        self.root = root
+        self.entries = {}
+        self.lock = Lock()
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.root, name + '.json')
+
+    def get(self, url):
+        """
+        Return cache entry dict for url or None.
+        File is read on miss or if it was replaced (inode, mtime
+        or size changed).
+
+        """
+        file_name = self.path(url)
+
+        try:
+            version = file_version(file_name)
+
+        except (IOError, OSError):
+            return None
+
+        with self.lock:
+            cached = self.entries.get(url)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        try:
+            with open(file_name, encoding='utf-8') as f:
+                entry = json.load(f)
+
+        except (IOError, OSError, ValueError):
+            return None
+
+        entry['records'] = [tuple(rec) for rec in entry['records']]
+
+        with self.lock:
+            self.entries[url] = (version, entry)
+
+        return entry
+
+    @staticmethod
+    def headers(entry):
+        """
+        Return conditional request headers for cache entry.
+
+        """
+        headers = {}
+
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    @staticmethod
+    def entry(url, response, digest, size, records=None):
+        """
+        Make entry for url. Validators taken from response headers.
+
+        """
+        return {'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'hash': digest,
+                'size': size,
+                'records': records}
+
+    def save(self, entries):
+        """
+        Save entries (see entry()). Each file written to unique
+        temp file and replaced atomically, so concurrent writers
+        never mix their data.
+
+        """
+        for entry in entries:
+            with tempfile.NamedTemporaryFile(
+                    'w', encoding='utf-8', dir=self.root, suffix='.tmp',
+                    delete=False) as f:
+                json.dump(entry, f)
+
+            os.replace(f.name, self.path(entry['url']))
+            version = file_version(self.path(entry['url']))
+
+            with self.lock:
+                self.entries[entry['url']] = (version, entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.root, name))
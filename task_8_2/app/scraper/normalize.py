@@ -0,0 +1,53 @@
+__author__ = "Andrew Gafiychuk"
+
+
+# Scraped values without number: unknown ("?") or too low to show.
+NO_DATA = {'?': None, '': None, 'Low Vol': 0.0}
+
+
+def to_number(value):
+    """
+    Convert scraped value ("$1,234,567", "-2.31%", "16,344,600")
+    to float. Return None if value unknown.
+    Numbers passed as is.
+
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+
+    value = value.strip()
+    if value in NO_DATA:
+        return NO_DATA[value]
+
+    value = value.replace('$', '').replace(',', '').replace('%', '')
+    value = value.replace('*', '').strip()
+
+    try:
+        return float(value)
+
+    except ValueError:
+        return None
+
+
+def format_money(value):
+    if value is None:
+        return '?'
+
+    if value >= 1:
+        return '${0:,.2f}'.format(value)
+
+    return '${0:.6f}'.format(value)
+
+
+def format_number(value):
+    if value is None:
+        return '?'
+
+    return '{0:,.0f}'.format(value)
+
+
+def format_perc(value):
+    if value is None:
+        return '?'
+
+    return '{0:.2f}%'.format(value)
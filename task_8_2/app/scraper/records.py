@@ -0,0 +1,208 @@
+import numpy as np
+
+from app.scraper.normalize import to_number
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Record fields in scraped tuple order.
+FIELDS = ['name', 'symbol', 'market_cap', 'price', 'cs', 'volume',
+          'perc_1h', 'perc_24h', 'perc_7d']
+
+# Numeric fields, names same as Info columns.
+VALUES = FIELDS[2:]
+
+
+class CoinRecord(object):
+    """
+    One scraped currency row with numeric fields as floats
+    (None if value unknown).
+    Attribute access (rec.price) or by position as old
+    9-tuple (rec[3]), so tuple consumers keep working.
+
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+        """
+        Constructor.
+        values - 9 fields in FIELDS order.
+
+        """
+        for name, value in zip(FIELDS, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.as_tuple()[index]
+
+        return getattr(self, FIELDS[index])
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __eq__(self, other):
+        if isinstance(other, (CoinRecord, tuple)):
+            return self.as_tuple() == tuple(other)
+
+        return NotImplemented
+
+    def __repr__(self):
+        return 'CoinRecord{0}'.format(self.as_tuple())
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in FIELDS)
+
+
+class SnapshotBatch(object):
+    """
+    Scraped snapshot stored by columns:
+    names, symbols - lists of str;
+    values - float64 array (rows x 7) of VALUES columns,
+    NaN for unknown values.
+    Numbers parsed once when batch built. Iteration gives
+    CoinRecord for each row.
+
+    """
+    def __init__(self, names, symbols, values):
+        """
+        Constructor.
+
+        """
+        self.names = names
+        self.symbols = symbols
+        self.values = values
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build batch from scraped records (9-tuples of strings,
+        numbers or CoinRecord).
+
+        """
+        if isinstance(records, cls):
+            return records
+
+        records = list(records)
+        values = np.empty((len(records), len(VALUES)), dtype=np.float64)
+
+        for n, rec in enumerate(records):
+            values[n] = [np.nan if value is None else value
+                         for value in map(to_number, rec[2:9])]
+
+        return cls([rec[0] for rec in records],
+                   [rec[1] for rec in records], values)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        """
+        Row as CoinRecord, or new batch for slice.
+
+        """
+        if isinstance(index, slice):
+            return self.take(range(len(self))[index])
+
+        row = self.values[index].tolist()
+
+        return CoinRecord(self.names[index], self.symbols[index],
+                          *[None if value != value else value
+                            for value in row])
+
+    def __iter__(self):
+        for name, symbol, row in zip(self.names, self.symbols,
+                                     self.value_rows()):
+            yield CoinRecord(name, symbol, *row)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and \
+                all(rec == other_rec for rec, other_rec in zip(self, other))
+
+        except TypeError:
+            return NotImplemented
+
+    def column(self, name):
+        """
+        Return column array (view) of numeric field.
+
+        """
+        return self.values[:, VALUES.index(name)]
+
+    def value_rows(self):
+        """
+        Return list of numeric tuples, None for unknown values.
+
+        """
+        rows = self.values.astype(object)
+        rows[np.isnan(self.values)] = None
+
+        return [tuple(row) for row in rows.tolist()]
+
+    def take(self, indices):
+        """
+        Return new batch with rows by indices (or bool mask).
+
+        """
+        indices = np.asarray(indices)
+
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        else:
+            indices = indices.astype(np.intp)
+
+        return SnapshotBatch([self.names[i] for i in indices],
+                             [self.symbols[i] for i in indices],
+                             self.values[indices])
+
+    def sorted(self, name, reverse=False):
+        """
+        Return new batch sorted by field, unknown values last.
+
+        """
+        if name in ('name', 'symbol'):
+            column = getattr(self, name + 's')
+            order = sorted(range(len(self)), key=column.__getitem__,
+                           reverse=reverse)
+
+            return self.take(order)
+
+        column = self.column(name)
+        order = np.argsort(-column if reverse else column, kind='mergesort')
+
+        return self.take(order)
+
+    def as_json(self):
+        """
+        Return batch as JSON data: names, symbols and value rows
+        (null for unknown values).
+
+        """
+        return {'names': self.names, 'symbols': self.symbols,
+                'values': self.value_rows()}
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Build batch from as_json() data.
+
+        """
+        values = np.array(data['values'], dtype=np.float64)
+
+        return cls(list(data['names']), list(data['symbols']),
+                   values.reshape(len(data['names']), len(VALUES)))
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory size of batch data.
+
+        """
+        return self.values.nbytes + sum(
+            len(name) + len(symbol) for name, symbol in
+            zip(self.names, self.symbols))
@@ -1,8 +1,17 @@
+import os
 import logging
 import asyncio
+import hashlib
 import aiohttp
 
-from lxml import html
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+from urllib.parse import urlsplit
+from lxml import html, etree
+
+from app.scraper.cache import ScrapStats
+from app.scraper.records import SnapshotBatch
 
 
 __author__ = "Andrew Gafiychuk"
@@ -12,24 +21,60 @@ class Scraper(object):
     """
     Simple class for parsing "https://coinmarketcap.com/".
     Parse it for all data about each coin.
-    Return list of tuples with name, market_cap,
-    price, circulating supply, volume(24h), change in %(24h)
+    Return SnapshotBatch of records with name, symbol, market_cap,
+    price, circulating supply, volume(24h), change in %(1h, 24h, 7d).
+    Streamed records (stream) are tuples of strings.
+
+    Can scrap list of urls concurrently. Each url is a string
+    (parsed with default RowStreamParser) or (url, parser) tuple,
+    where parser is a factory parser(encoding) of object with
+    feed(chunk) and close() methods (see RowStreamParser, PageParser).
+
+    With parse_executor pages are downloaded whole and parsed in
+    thread / process pool, so event loop keeps fetching other
+    pages while parsing runs on all cores.
     
     """
-    def __init__(self):
+    def __init__(self, urls=None, concurrency=10, host_rate=None,
+                 timeout=None, cache=None, parse_executor=None,
+                 parse_workers=None, metrics=None):
         """
         Constructor.
+        urls - list of sources, default is self.url only.
+        concurrency - max pages fetched at once.
+        host_rate - max requests per second to one host.
+        timeout - global timeout for all pages in seconds.
+        cache - ResponseCache for conditional requests, pages
+        same as cached are not parsed.
+        parse_executor - 'thread', 'process' or Executor instance
+        for parse pages out of event loop (None - parse in loop).
+        With 'process' parser factories must be picklable.
+        parse_workers - pool size for 'thread' / 'process'.
+        metrics - app.metrics.Metrics for stage timings
+        (None - no measures).
         
         """
         logging.debug("[+] Scraper initial...")
 
         self.url = "https://coinmarketcap.com/all/views/all/"
+        self.urls = urls
+        self.concurrency = concurrency
+        self.host_rate = host_rate
+        self.timeout = timeout
+        self.cache = cache
+        self.parse_executor = parse_executor
+        self.parse_workers = parse_workers
+        self.executor = None
+        self.metrics = metrics
         self.session = None
+        self.last_stats = None
 
-    async def _init_session(self):
+    async def _init_session(self, **connector_params):
         """
         Private method for init sessions params.
         Header, connector.
+        Extra connector_params passed to TCPConnector
+        (pool limits, keep-alive, DNS cache).
         
         """
         logging.debug("[+] Created HEADER's...")
@@ -48,17 +93,70 @@ class Scraper(object):
                           'Chrome/57.0.2987.133 Safari/537.36',
         }
 
-        connector = aiohttp.TCPConnector(verify_ssl=True)
+        connector = aiohttp.TCPConnector(verify_ssl=True,
+                                         **connector_params)
+        session_params = {}
+        trace_configs = self._trace_configs()
+        if trace_configs:
+            session_params['trace_configs'] = trace_configs
+
         self.session = aiohttp.ClientSession(connector=connector,
-                                             headers=HEADER)
+                                             headers=HEADER,
+                                             **session_params)
 
         logging.debug("[+] HEADER's init complete!!!")
 
-    def start(self):
+    def _trace_configs(self):
+        """
+        Private method, aiohttp request tracing for DNS and
+        connect timings. Needs metrics and aiohttp >= 3.0.
+        
+        """
+        if not self.metrics or not hasattr(aiohttp, 'TraceConfig'):
+            return []
+
+        def on_start(stage):
+            async def handler(session, ctx, params):
+                setattr(ctx, stage, perf_counter())
+
+            return handler
+
+        def on_end(stage):
+            async def handler(session, ctx, params):
+                self.metrics.since('coin_scrape_stage_seconds',
+                                   getattr(ctx, stage), stage)
+
+            return handler
+
+        trace = aiohttp.TraceConfig()
+        trace.on_dns_resolvehost_start.append(on_start('dns'))
+        trace.on_dns_resolvehost_end.append(on_end('dns'))
+        trace.on_connection_create_start.append(on_start('connect'))
+        trace.on_connection_create_end.append(on_end('connect'))
+
+        return [trace]
+
+    def _count(self, result, size=0):
+        """
+        Private method, count scraped page result and bytes.
+        
+        """
+        if self.metrics:
+            self.metrics.inc('coin_scrape_pages_total', result)
+
+            if size:
+                self.metrics.inc('coin_scrape_bytes_total', amount=size)
+
+    def start(self, stream=False):
         """
         Main method for start parsing.
+        With stream=True return async generator of records
+        (see Scraper.stream), which must be consumed in caller loop.
         
         """
+        if stream:
+            return self.stream()
+
         logging.debug("[+] Start scrap task...")
 
         event_loop = asyncio.new_event_loop()
@@ -68,6 +166,10 @@ class Scraper(object):
             event_loop.run_until_complete(self._init_session())
             data = event_loop.run_until_complete(self._main_task())
 
+            # No caller to store data first, cache saved at once.
+            if self.cache is not None:
+                self.cache.save(self.last_stats.pending)
+
             return data
 
         except Exception as err:
@@ -75,85 +177,612 @@ class Scraper(object):
                           "{0}".format(err))
 
         finally:
-            self.session.close()
+            event_loop.run_until_complete(self.session.close())
             event_loop.close()
+            self.shutdown()
 
             logging.debug("[+] Scrap complete!!!")
 
-    async def _main_task(self):
+    async def stream(self):
+        """
+        Async generator of records.
+        Each record yielded as soon as its table row downloaded,
+        page is never buffered in memory.
+        
+        """
+        logging.debug("[+] Start stream scrap task...")
+
+        await self._init_session()
+
+        try:
+            for url, parser in self._sources():
+                async for rec in self._stream(url, parser):
+                    yield rec
+
+        finally:
+            await self.session.close()
+            self.shutdown()
+
+            logging.debug("[+] Stream scrap complete!!!")
+
+    async def scrap(self, urls=None, stats=None):
         """
-        Create task and start it.
-        Return results if success, else print error.
+        Coroutine for run scrap task with already opened session
+        in caller loop (see ScraperService).
+        stats - ScrapStats to count run requests and cache hits.
+        
+        """
+        return await self._main_task(urls, stats)
+
+    def _executor(self):
+        """
+        Private method, return parse executor or None.
+        Pool for 'thread' / 'process' created on first use.
+        
+        """
+        if self.parse_executor is None or \
+                not isinstance(self.parse_executor, str):
+            return self.parse_executor
+
+        if self.executor is None:
+            self.executor = make_parse_executor(self.parse_executor,
+                                                self.parse_workers)
+
+        return self.executor
+
+    def shutdown(self):
+        """
+        Stop parse pool created by scraper. Executor instance
+        passed by caller is not touched.
+        
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def _parse(self, parser, body, encoding):
+        """
+        Private method, parse whole page body.
+        Run in parse executor if it set, else in event loop.
+        
+        """
+        executor = self._executor()
+        start = perf_counter()
+
+        if executor is None:
+            records = parse_body(parser, body, encoding)
+        else:
+            records = await asyncio.get_event_loop().run_in_executor(
+                executor, parse_body, parser, body, encoding)
+
+        if self.metrics:
+            self.metrics.since('coin_scrape_stage_seconds', start, 'parse')
+
+        return records
+
+    def _sources(self, urls=None):
+        """
+        Private method, return list of (url, parser) pairs.
+        
+        """
+        sources = []
+
+        for src in urls or self.urls or [self.url]:
+            if isinstance(src, str):
+                src = (src, RowStreamParser)
+
+            sources.append(src)
+
+        return sources
+
+    async def _main_task(self, urls=None, stats=None):
+        """
+        Create tasks for all urls and run them concurrently,
+        bounded by semaphore, per host rate and global timeout.
+        Return merged results in urls order as SnapshotBatch
+        if success, else print error.
         
         """
         logging.debug("[+] Main task started...")
 
-        tasks = [self._scrap(self.url)]
+        if stats is None:
+            stats = ScrapStats()
+        self.last_stats = stats
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = HostRateLimiter(self.host_rate) if self.host_rate else None
+
+        tasks = [asyncio.ensure_future(
+                     self._scrap(url, parser, semaphore, limiter, stats))
+                 for url, parser in self._sources(urls)]
         results = []
 
         try:
-            for task in asyncio.as_completed(tasks):
-                data = await task
-                results.extend(data)
-                task.close()
+            done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+
+            if pending:
+                logging.error("[+] Main task timeout, {0} pages "
+                              "cancelled...".format(len(pending)))
+
+                for task in pending:
+                    task.cancel()
+                    self._count('timeout')
+
+            for task in tasks:
+                if task not in done:
+                    continue
+
+                if task.exception():
+                    self._count('error')
+                    logging.error("[+] Page scrap error...\n"
+                                  "{0}".format(task.exception()))
+                    continue
+
+                results.extend(task.result())
 
             logging.debug("[+] Main task complete!!!")
-            return results
+            return SnapshotBatch.from_records(results)
 
         except Exception as err:
             logging.error("[+] Main task error...\n"
                           "{0}".format(err))
 
-    async def _scrap(self, url):
+    async def _scrap(self, url, parser=None, semaphore=None, limiter=None,
+                     stats=None):
         """
         Private method for GET data from host.
         Parse page for data and create result list.
+        With parse executor page is parsed after semaphore
+        released, so next pages are fetched meanwhile.
+        New cache entry added to stats.pending after parse.
         
         """
-        async with self.session.get(url) as response:
-            if response.status == 200:
-                page = await response.text()
-
-                res_list = []
-
-                root = html.fromstring(page)
-
-                table = root.xpath(
-                    '//table[@id="currencies-all"]/tbody/tr')
-
-                for n, tr in enumerate(table, 1):
-                    name = tr.xpath(
-                        './/td[@class="no-wrap currency-name"]'
-                        '/a/text()')[0]
-                    symbol = tr.xpath(
-                        './/td[@class="text-left"]'
-                        '/text()')[0]
-                    market_cap = tr.xpath(
-                        './/td[@class="no-wrap market-cap '
-                        'text-right"]'
-                        '/text()')[0].strip()
-                    price = tr.xpath(
-                        './/td[@class="no-wrap text-right"]'
-                        '/a[@class="price"]/text()')[0]
-                    cs = tr.xpath(
-                        './/td[@class="no-wrap text-right"]'
-                        '/a[@target="_blank"]/text() |'
-                        './/td[@class="no-wrap text-right"]'
-                        '/span/text()')[0].strip()
-                    volume = tr.xpath(
-                        './/td[@class="no-wrap text-right "]'
-                        '/a/text()')[0]
-                    changes = tr.xpath(
-                        './/td[starts-with(@class,"no-wrap percent-")]'
-                        '/text() |'
-                        './/td[@class="text-right"]/text()')
-
-                    t = (name, symbol, market_cap, price, cs, volume,
-                         changes[0], changes[1], changes[2])
-
-                    res_list.append(t)
-
-                return res_list
+        res_list = []
+        page = None
+        entry = None
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore()
+        if stats is None:
+            stats = ScrapStats()
+
+        async with semaphore:
+            if limiter:
+                await limiter.wait(urlsplit(url).netloc)
+
+            if self.cache is not None:
+                res_list, entry, page = await self._fetch_cached(
+                    url, parser, stats)
+            elif self._executor() is None:
+                async for rec in self._stream(url, parser):
+                    res_list.append(rec)
             else:
+                page = await self._fetch_body(url, stats)
+
+        if page is not None:
+            res_list = await self._parse(parser, *page)
+
+        if entry is not None:
+            entry['records'] = res_list
+            stats.pending.append(entry)
+
+        return res_list
+
+    async def _fetch_cached(self, url, parser, stats):
+        """
+        Private method for conditional GET with response cache.
+        Cached records returned if server answer 304 Not Modified.
+        Else body is hashed and parsed by chunks in one pass
+        while downloading (as _stream); if body hash is same as
+        cached, page counted as unchanged.
+        With parse executor body is kept whole and parsed in pool.
+        Return (records, entry, page): entry - new cache entry
+        (None if cached is valid), page - (body, encoding) to parse
+        out of semaphore, None if records are known.
+        
+        """
+        entry = self.cache.get(url)
+        executor = self._executor()
+        start = perf_counter()
+
+        async with self.session.get(
+                url, headers=self.cache.headers(entry)) as response:
+            stats.requests += 1
+            start = self._observe_ttfb(start)
+
+            if response.status == 304 and entry:
+                stats.not_modified += 1
+                stats.bytes_saved += entry['size']
+                self._count('not_modified')
+
+                return entry['records'], None, None
+
+            if response.status != 200:
+                self._count('http_{0}'.format(response.status))
+                logging.error("[+] Response error...\n"
+                              "{0}".format(response.status))
+                return [], None, None
+
+            digest = hashlib.sha1()
+            size = 0
+            records = []
+            chunks = []
+
+            page_parser = None
+            if executor is None:
+                page_parser = (parser or RowStreamParser)(response.charset)
+                if self.metrics:
+                    page_parser = TimedParser(page_parser)
+
+            while True:
+                chunk = await response.content.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                digest.update(chunk)
+
+                if page_parser is None:
+                    chunks.append(chunk)
+                else:
+                    records.extend(page_parser.feed(chunk))
+
+            if page_parser is not None:
+                records.extend(page_parser.close())
+
+            new_entry = self.cache.entry(url, response, digest.hexdigest(),
+                                         size)
+            encoding = response.charset
+
+        stats.bytes_received += size
+
+        if self.metrics:
+            parse_time = 0.0
+
+            # Page parsed while downloading, parse time taken out.
+            if page_parser is not None:
+                parse_time = page_parser.seconds
+                self.metrics.observe('coin_scrape_stage_seconds',
+                                     parse_time, 'parse')
+
+            self.metrics.observe('coin_scrape_stage_seconds',
+                                 perf_counter() - start - parse_time,
+                                 'download')
+
+        if entry and entry['hash'] == new_entry['hash']:
+            stats.hash_hits += 1
+            self._count('hash_hit', size)
+
+            return entry['records'], new_entry, None
+
+        stats.misses += 1
+        self._count('ok', size)
+
+        if page_parser is None:
+            return [], new_entry, (b''.join(chunks), encoding)
+
+        return records, new_entry, None
+
+    async def _fetch_body(self, url, stats):
+        """
+        Private method for GET whole page body.
+        Return (body, encoding) or None on error.
+        
+        """
+        start = perf_counter()
+
+        async with self.session.get(url) as response:
+            stats.requests += 1
+            start = self._observe_ttfb(start)
+
+            if response.status != 200:
+                self._count('http_{0}'.format(response.status))
                 logging.error("[+] Response error...\n"
                               "{0}".format(response.status))
+                return None
+
+            body = await response.read()
+            encoding = response.charset
+
+        if self.metrics:
+            self.metrics.since('coin_scrape_stage_seconds', start,
+                               'download')
+
+        stats.misses += 1
+        stats.bytes_received += len(body)
+        self._count('ok', len(body))
+
+        return body, encoding
+
+    def _observe_ttfb(self, start):
+        """
+        Private method, observe time to response headers.
+        Return download start time.
+        
+        """
+        if not self.metrics:
+            return start
+
+        self.metrics.since('coin_scrape_stage_seconds', start, 'ttfb')
+
+        return perf_counter()
+
+    async def _stream(self, url, parser=None):
+        """
+        Private async generator for GET data from host.
+        Feed response body chunks to incremental parser and
+        yield records while page is downloading.
+        
+        """
+        start = perf_counter()
+        size = 0
+
+        async with self.session.get(url) as response:
+            start = self._observe_ttfb(start)
+
+            if response.status != 200:
+                self._count('http_{0}'.format(response.status))
+                logging.error("[+] Response error...\n"
+                              "{0}".format(response.status))
+                return
+
+            parser = (parser or RowStreamParser)(response.charset)
+            if self.metrics:
+                parser = TimedParser(parser)
+
+            while True:
+                chunk = await response.content.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+
+                for rec in parser.feed(chunk):
+                    yield rec
+
+            for rec in parser.close():
+                yield rec
+
+        if self.metrics:
+            # Page parsed while downloading, parse time taken out.
+            self.metrics.observe('coin_scrape_stage_seconds',
+                                 parser.seconds, 'parse')
+            self.metrics.observe('coin_scrape_stage_seconds',
+                                 perf_counter() - start - parser.seconds,
+                                 'download')
+
+        self._count('ok', size)
+
+
+class TimedParser(object):
+    """
+    Parser wrapper, sum time spent in feed and close.
+    
+    """
+    def __init__(self, parser):
+        """
+        Constructor.
+        
+        """
+        self.parser = parser
+        self.seconds = 0.0
+
+    def feed(self, chunk):
+        start = perf_counter()
+        records = self.parser.feed(chunk)
+        self.seconds += perf_counter() - start
+
+        return records
+
+    def close(self):
+        start = perf_counter()
+        records = self.parser.close()
+        self.seconds += perf_counter() - start
+
+        return records
+
+
+class HostRateLimiter(object):
+    """
+    Simple per host rate limiter.
+    Spread requests starts to one host by 1 / rate seconds.
+    Use in one event loop only.
+    
+    """
+    def __init__(self, rate):
+        """
+        Constructor.
+        rate - max requests per second to one host.
+        
+        """
+        self.interval = 1.0 / rate
+        self.next_time = {}
+
+    async def wait(self, host):
+        """
+        Wait until next request to host allowed.
+        
+        """
+        now = asyncio.get_event_loop().time()
+        start = max(now, self.next_time.get(host, now))
+
+        self.next_time[host] = start + self.interval
+
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+CHUNK_SIZE = 64 * 1024
+
+PARSE_EXECUTORS = {'thread': ThreadPoolExecutor,
+                   'process': ProcessPoolExecutor}
+
+
+def make_parse_executor(kind, workers=None):
+    """
+    Create pool for parse pages: 'thread' (lxml release GIL
+    while parsing) or 'process'.
+    workers - pool size, default is CPU count.
+
+    """
+    if kind not in PARSE_EXECUTORS:
+        raise ValueError('Unknown parse executor: {0}'.format(kind))
+
+    return PARSE_EXECUTORS[kind](max_workers=workers or os.cpu_count())
+
+
+def parse_body(parser, body, encoding=None):
+    """
+    Parse whole page body (bytes) with parser factory
+    (RowStreamParser by default). Return list of records.
+    Module function, so it can be sent to process pool.
+
+    """
+    parser = (parser or RowStreamParser)(encoding)
+
+    return parser.feed(body) + parser.close()
+
+
+ROWS_XPATH = etree.XPath('//table[@id="currencies-all"]/tbody/tr')
+
+
+def parse_row(tr):
+    """
+    Parse one currency table row in a single pass over its cells.
+    Cells are taken by position: rank, name, symbol, market cap,
+    price, circulating supply, volume(24h), % 1h, % 24h, % 7d.
+    Return tuple of 9 fields.
+
+    """
+    cells = tr.findall('td')
+
+    name = cells[1].find('a').text
+    symbol = cells[2].text
+    market_cap = cells[3].text.strip()
+    price = cells[4].find('a').text
+    cs = cells[5].find('*').text.strip()
+    volume = cells[6].find('a').text
+
+    return (name, symbol, market_cap, price, cs, volume,
+            cells[7].text, cells[8].text, cells[9].text)
+
+
+def parse_page(page):
+    """
+    Parse full coinmarketcap page.
+    Return list of tuples (see parse_row).
+
+    """
+    root = html.fromstring(page)
+
+    return [parse_row(tr) for tr in ROWS_XPATH(root)]
+
+
+class RowStreamParser(object):
+    """
+    Incremental parser for coinmarketcap page.
+    Takes page by chunks and return records for each
+    currency row as soon as its </tr> closed.
+    Parsed rows are dropped from tree, so memory stay flat.
+    
+    """
+    def __init__(self, encoding=None):
+        """
+        Constructor.
+        Create lxml pull parser, listen only for rows end.
+        
+        """
+        self.parser = etree.HTMLPullParser(events=('end',), tag='tr',
+                                           encoding=encoding)
+
+    def feed(self, chunk):
+        """
+        Feed next page chunk.
+        Return list of records completed by this chunk.
+        
+        """
+        self.parser.feed(chunk)
+
+        return self._read_rows()
+
+    def close(self):
+        """
+        Finish parsing.
+        Return list of rest records.
+        
+        """
+        self.parser.close()
+
+        return self._read_rows()
+
+    def _read_rows(self):
+        """
+        Private method for parse finished currency rows
+        and free them.
+        
+        """
+        res_list = []
+
+        for _, tr in self.parser.read_events():
+            if not is_currency_row(tr):
+                continue
+
+            res_list.append(parse_row(tr))
+
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+
+        return res_list
+
+
+def is_currency_row(tr):
+    """
+    Check row is in <table id="currencies-all"><tbody>.
+    
+    """
+    tbody = tr.getparent()
+    if tbody is None or tbody.tag != 'tbody':
+        return False
+
+    table = tbody.getparent()
+
+    return table is not None and table.get('id') == 'currencies-all'
+
+
+class PageParser(object):
+    """
+    Adapter for plug simple parser function, which takes whole page,
+    into scraper (detail pages, other exchanges).
+    Buffer page chunks and parse all on close.
+    Use: Scraper(urls=[(url, PageParser.using(func))]).
+    
+    """
+    def __init__(self, func, encoding=None):
+        """
+        Constructor.
+        
+        """
+        self.func = func
+        self.encoding = encoding or 'utf-8'
+        self.chunks = []
+
+    @classmethod
+    def using(cls, func):
+        """
+        Return parser factory for func.
+        Factory is picklable if func is module function.
+        
+        """
+        return partial(cls, func)
+
+    def feed(self, chunk):
+        self.chunks.append(chunk)
+
+        return []
+
+    def close(self):
+        page = b''.join(self.chunks).decode(self.encoding, 'replace')
+        self.chunks = []
+
+        return self.func(page)
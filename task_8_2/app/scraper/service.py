@@ -0,0 +1,171 @@
+import logging
+import asyncio
+
+from threading import Thread, Lock
+
+from app.scraper.scraper import Scraper
+from app.scraper.cache import ScrapStats
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+class ScraperService(object):
+    """
+    Long-lived scraper service.
+    Keep one event loop in background thread and one pooled
+    aiohttp session (keep-alive, DNS cache, connection limits),
+    so repeated scrapes reuse opened connections.
+    Callers submit scrap jobs and wait on futures.
+
+    """
+    def __init__(self, limit=20, limit_per_host=5, keepalive_timeout=60,
+                 **scraper_params):
+        """
+        Constructor.
+        Init connector params. Loop started on first job.
+        scraper_params passed to Scraper (concurrency, host_rate, timeout,
+        cache, parse_executor).
+
+        """
+        logging.debug("[+] Scraper service initial...")
+
+        self.connector_params = {'use_dns_cache': True,
+                                 'limit': limit,
+                                 'limit_per_host': limit_per_host,
+                                 'keepalive_timeout': keepalive_timeout}
+
+        self.scraper = Scraper(**scraper_params)
+        self.last_stats = None
+        self.total_stats = ScrapStats()
+        self.loop = None
+        self.thread = None
+        self.lock = Lock()
+
+    @property
+    def running(self):
+        """
+        Check loop thread is alive.
+
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """
+        Start loop thread and open shared session.
+        Do nothing if service already running.
+
+        """
+        with self.lock:
+            if self.running:
+                return
+
+            logging.debug("[+] Scraper service starting...")
+
+            self.loop = asyncio.new_event_loop()
+            self.thread = Thread(target=self._run, name='scraper-service',
+                                 daemon=True)
+            self.thread.start()
+
+            future = asyncio.run_coroutine_threadsafe(
+                self.scraper._init_session(**self.connector_params),
+                self.loop)
+            future.result()
+
+            logging.debug("[+] Scraper service started!!!")
+
+    async def _close_session(self):
+        """
+        Private method, close shared session inside service loop.
+
+        """
+        await self.scraper.session.close()
+
+    def _run(self):
+        """
+        Private method, loop thread body.
+
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, urls=None):
+        """
+        Submit scrap job to service loop.
+        urls - list of sources (see Scraper), default scraper url.
+        Return concurrent.futures.Future with SnapshotBatch of records.
+
+        """
+        self.start()
+
+        return asyncio.run_coroutine_threadsafe(self.scraper.scrap(urls),
+                                                self.loop)
+
+    def scrape(self, urls=None, timeout=None):
+        """
+        Submit scrap job and wait for result.
+        Response cache saved at once.
+
+        """
+        records, stats = self.fetch(urls, timeout)
+        self.commit(stats)
+
+        return records
+
+    def fetch(self, urls=None, timeout=None):
+        """
+        Submit scrap job and wait for result.
+        Return (records, ScrapStats of this run), with scraper
+        cache stats.unchanged tells all pages are same as cached.
+        Call commit(stats) after records are stored.
+
+        """
+        self.start()
+
+        stats = ScrapStats()
+        future = asyncio.run_coroutine_threadsafe(
+            self.scraper.scrap(urls, stats), self.loop)
+        records = future.result(timeout)
+
+        with self.lock:
+            self.last_stats = stats
+            self.total_stats.add(stats)
+
+        return records, stats
+
+    def commit(self, stats):
+        """
+        Save response cache entries of fetch run (stats.pending).
+        Until then pages are not cached, so run failed to store
+        data is scraped and parsed again.
+
+        """
+        if self.scraper.cache is not None and stats.pending:
+            self.scraper.cache.save(stats.pending)
+
+        stats.pending = []
+
+    def stop(self):
+        """
+        Close shared session and stop loop thread.
+
+        """
+        with self.lock:
+            if not self.running:
+                return
+
+            logging.debug("[+] Scraper service stopping...")
+
+            future = asyncio.run_coroutine_threadsafe(
+                self._close_session(), self.loop)
+            future.result()
+
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.scraper.shutdown()
+
+            self.thread = None
+            self.loop = None
+
+            logging.debug("[+] Scraper service stopped!!!")
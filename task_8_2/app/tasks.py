@@ -0,0 +1,401 @@
+import os
+import json
+import logging
+
+from time import time, sleep
+from uuid import uuid4
+from threading import Lock, Condition
+from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+
+from app.cache import TTLCache
+from app.scheduler import FileLock
+
+
+__author__ = "Andrew Gafiychuk"
+
+
+# Seconds between state file reads of task run by other process.
+POLL_INTERVAL = 0.5
+
+
+class Task(object):
+    """
+    Background task state: pending -> running -> done / error.
+    Task function report progress with update(),
+    waiters get notified on each change.
+    If path is set, state (and result by encode function) saved
+    to JSON file on each change, so other processes can read it
+    (see StoredTask).
+    owners - users allowed to see task. Owners added later are
+    appended to <path>.owners, so any process can share task.
+
+    """
+    def __init__(self, key, owner=None, path=None, encode=None):
+        """
+        Constructor.
+
+        """
+        self.id = uuid4().hex
+        self.key = key
+        self.owners = set([owner]) if owner else set()
+
+        self.state = 'pending'
+        self.stage = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+
+        self.created = time()
+        self.finished = None
+
+        self.version = 0
+        self.changed = Condition()
+
+        self.path = path
+        self.encode = encode
+
+    @property
+    def done(self):
+        return self.state in ('done', 'error')
+
+    def allowed(self, user):
+        return user in self.owners or user in self.shared_owners()
+
+    def shared_owners(self):
+        """
+        Return owners added by other processes.
+
+        """
+        if self.path is None:
+            return set()
+
+        try:
+            with open(self.path + '.owners', encoding='utf-8') as f:
+                return set(f.read().split())
+
+        except (IOError, OSError):
+            return set()
+
+    def add_owner(self, user):
+        """
+        Share in flight task with one more user.
+
+        """
+        with self.changed:
+            self.owners.add(user)
+
+            if self.path is None:
+                return
+
+            try:
+                with open(self.path + '.owners', 'a',
+                          encoding='utf-8') as f:
+                    f.write(user + '\n')
+
+            except (IOError, OSError) as err:
+                logging.error("[+]Task {0} owner save Error...\n"
+                              "{1}".format(self.key, err))
+
+    def update(self, stage=None, state=None, **progress):
+        """
+        Change task stage/state and notify waiters.
+
+        """
+        with self.changed:
+            if stage is not None:
+                self.stage = stage
+            if state is not None:
+                self.state = state
+
+            self.progress.update(progress)
+            self.version += 1
+            self.save()
+            self.changed.notify_all()
+
+    def wait(self, version, timeout=None):
+        """
+        Wait for change after <version>. Return current version.
+
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+
+            return self.version
+
+    def save(self):
+        """
+        Write state file, replaced atomically. Called under lock.
+
+        """
+        if self.path is None:
+            return
+
+        state = {'id': self.id, 'key': self.key,
+                 'owners': sorted(self.owners), 'state': self.state,
+                 'stage': self.stage, 'progress': self.progress,
+                 'error': self.error, 'created': self.created,
+                 'finished': self.finished, 'version': self.version,
+                 'result': None}
+
+        if self.state == 'done' and self.encode is not None and \
+                self.result is not None:
+            state['result'] = self.encode(self.result)
+
+        try:
+            with NamedTemporaryFile('w', encoding='utf-8', suffix='.tmp',
+                                    dir=os.path.dirname(self.path),
+                                    delete=False) as f:
+                json.dump(state, f)
+
+            os.replace(f.name, self.path)
+
+        except (IOError, OSError, TypeError, ValueError) as err:
+            logging.error("[+]Task {0} state save Error...\n"
+                          "{1}".format(self.key, err))
+
+    def as_json(self):
+        end = self.finished or time()
+
+        return {'id': self.id,
+                'state': self.state,
+                'stage': self.stage,
+                'progress': self.progress,
+                'error': self.error,
+                'elapsed': round(end - self.created, 3)}
+
+
+class StoredTask(Task):
+    """
+    Read only view of task run by other process, loaded from
+    its state file. wait() polls the file.
+
+    """
+    def __init__(self, path, decode=None):
+        """
+        Constructor.
+
+        """
+        super().__init__(None)
+
+        self.path = path
+        self.decode = decode
+
+    @classmethod
+    def load(cls, path, decode=None):
+        """
+        Return task from state file or None if no such file.
+
+        """
+        task = cls(path, decode)
+
+        return task if task.reload() else None
+
+    def reload(self):
+        """
+        Read state file. Return False if it is missing or broken.
+
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+
+        except (IOError, OSError, ValueError):
+            return False
+
+        for name in ('id', 'key', 'state', 'stage', 'progress', 'error',
+                     'created', 'finished', 'version'):
+            setattr(self, name, state[name])
+
+        self.owners = set(state['owners'])
+        self.result = state['result']
+
+        if self.result is not None and self.decode is not None:
+            self.result = self.decode(self.result)
+
+        return True
+
+    def update(self, stage=None, state=None, **progress):
+        raise TypeError('Task of other process is read only')
+
+    def wait(self, version, timeout=None):
+        deadline = time() + (timeout or 0)
+
+        while True:
+            self.reload()
+
+            if self.version != version or time() >= deadline:
+                return self.version
+
+            sleep(POLL_INTERVAL)
+
+
+class TaskQueue(object):
+    """
+    Run tasks in thread pool.
+    Tasks with same key coalesced: while task is in flight,
+    submit() return it instead of starting new one.
+    Finished tasks kept for <ttl> seconds.
+    With root dir (shared by all app workers) task state saved
+    in <root>/<task_id>.json, so status of task started by one
+    worker can be read in any other. Running task holds lock file
+    <root>/<key>.lock (id in <root>/<key>.active), so coalescing
+    works across workers too.
+
+    """
+    def __init__(self, max_workers=2, max_size=256, ttl=3600, root=None,
+                 encode=None, decode=None):
+        """
+        Constructor.
+        encode / decode - task result to / from JSON data
+        (result is not shared if not set).
+
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.tasks = TTLCache(max_size, ttl)
+        self.ttl = ttl
+
+        self.root = root
+        self.encode = encode
+        self.decode = decode
+
+        self.active = {}
+        self.locks = {}
+        self.lock = Lock()
+
+        if root and not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, task_id):
+        if not self.root:
+            return None
+
+        return os.path.join(self.root, '{0}.json'.format(task_id))
+
+    def key_path(self, key, ext):
+        return os.path.join(self.root, '{0}{1}'.format(key, ext))
+
+    def submit(self, key, func, owner=None):
+        """
+        Start func(task) in pool, or return in flight task with key
+        of this or other process (shared with owner).
+        Value returned by func saved to task.result.
+
+        """
+        with self.lock:
+            task = self.active.get(key)
+            if task is None or task.done:
+                task = self.running_elsewhere(key)
+
+            if task is not None and not task.done:
+                if owner:
+                    task.add_owner(owner)
+
+                return task
+
+            task = Task(key, owner, encode=self.encode)
+            task.path = self.path(task.id)
+            task.save()
+
+            if self.root:
+                with open(self.key_path(key, '.active'), 'w') as f:
+                    f.write(task.id)
+
+            self.active[key] = task
+            self.tasks.set(task.id, task)
+
+        self.cleanup()
+        self.executor.submit(self._run, task, func)
+
+        return task
+
+    def running_elsewhere(self, key):
+        """
+        Take key lock for new task (kept in self.locks until task
+        is finished). Return task of process holding the lock
+        (None if lock taken here).
+
+        """
+        if not self.root:
+            return None
+
+        lock = FileLock(self.key_path(key, '.lock'))
+        if lock.acquire():
+            self.locks[key] = lock
+            return None
+
+        try:
+            with open(self.key_path(key, '.active')) as f:
+                task_id = f.read().strip()
+
+        except (IOError, OSError):
+            return None
+
+        return self.get(task_id)
+
+    def get(self, task_id, owner=None):
+        """
+        Return task of this or other process (by state file),
+        None if not found or owner is not allowed to see it.
+
+        """
+        task = self.tasks.get(task_id)
+
+        if task is None and self.root and task_id.isalnum():
+            task = StoredTask.load(self.path(task_id), self.decode)
+
+        if task is None or (owner is not None and not task.allowed(owner)):
+            return None
+
+        return task
+
+    def cleanup(self):
+        """
+        Remove state files of tasks older than ttl.
+
+        """
+        if not self.root:
+            return
+
+        expired = time() - self.ttl
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def _run(self, task, func):
+        task.update(state='running')
+
+        try:
+            task.result = func(task)
+            state = 'done'
+
+        except Exception as err:
+            logging.error("[+]Task {0} Error...\n"
+                          "{1}".format(task.key, err))
+
+            task.error = str(err)
+            state = 'error'
+
+        task.finished = time()
+
+        # Key free before task is done, so waiters of done task
+        # always can start new one.
+        with self.lock:
+            if self.active.get(task.key) is task:
+                del self.active[task.key]
+
+            lock = self.locks.pop(task.key, None)
+            if lock is not None:
+                lock.release()
+
+        task.update(state=state)